@@ -1,14 +1,45 @@
 import argparse
+import hashlib
+import multiprocessing
 import os
 import random
+import tempfile
+import time
+from collections import deque, namedtuple
+from multiprocessing.util import Finalize
 
+import numpy as np
 import psutil
+from tqdm import tqdm
+
+from Augmenter import instrumentation
 from Augmenter.Augmenter import Audio
+from Augmenter.dataset_index import DatasetIndex
+from Augmenter.decode_cache import DecodeCache
+from Augmenter.journal import CompletionJournal
+from Augmenter.noise_bank import NoiseBank
+from Augmenter.pipeline import PipelineMetrics
+from Augmenter.scheduler import report_load, run_scheduled
+from Augmenter.shards import ShardWriter
+from Augmenter.shared_noise import SharedNoiseBank
+from Augmenter.streaming import can_stream, stream_mix
+from Augmenter.tool_kit import energy_index, mix_snr_librosa, pad_batch
 
 cpu_core_in_use = psutil.cpu_count(logical=True)
 
+# a single unit of work: which sound to noise, where to save it and which (sound begin, noise begin, length)
+# windows, in seconds, are going to be mixed
+NoiseInjectionTask = namedtuple("NoiseInjectionTask", ["path", "samplingRate", "duration", "saveDir", "windows"])
+
+
 def advanced_noise_injection(sound_path, noise_path, save_path, percentage: int = 20,
-                             copy_remaining_sounds: bool = False):
+                             copy_remaining_sounds: bool = False, worker_count: int = 1,
+                             noise_bank_dir: str = None, stream_threshold: int = None, decode_cache_dir: str = None,
+                             decode_cache_size: int = 4 * 1024 * 1024 * 1024, dataset_index: str = None,
+                             journal_path: str = None, seed: int = None, shard_index: int = 0, shard_count: int = 1,
+                             output_shard_size: int = None, read_threads: int = 0, write_threads: int = 0,
+                             queue_depth: int = 4, metrics_json: str = None, metrics_prometheus: str = None,
+                             snr_db: float = None):
     """ sound_path dizini altında verilen kişilerin sesleri ile noise_path dizini altında verilen noise'lar mix'lenir.
     Mix'lenmiş sesler save_path alanında verilen dizine kaydedilir. Mixleme işlemi yapılırken her bir wav dosyasının
     percentage kadar uzunluğuna noise eklenir.
@@ -19,106 +50,577 @@ def advanced_noise_injection(sound_path, noise_path, save_path, percentage: int
     :param noise_path: noise'ların oldugu dizin
     :param save_path:  yeni seslerin kaydedileceği dizin
     :percentage: seslerin yuzde kacına noise eklenecegi bilgisi girilir
+    :param worker_count: mixleme işlemini paralel yürütecek process sayısı
+    :param noise_bank_dir: noise'ların decode edilmiş hallerinin saklanacağı dizin, verilmezse her seferinde decode edilir
+    :param stream_threshold: bu boyuttan (byte) büyük dosyalar belleğe alınmadan blok blok mixlenir
+    :param decode_cache_dir: seslerin decode edilmiş hallerinin çalıştırmalar arasında saklanacağı dizin
+    :param decode_cache_size: decode cache'inin byte cinsinden boyutu, aşılınca en eski kullanılanlar silinir
+    :param dataset_index: sound_path'in DatasetIndex manifest'inin yolu, verilirse sadece degişen dosyaların
+                          header'ları okunur
+    :param journal_path: tamamlanan seslerin kaydedildiği CompletionJournal dosyası, verilirse yarıda kalan bir
+                         çalıştırma kaldığı yerden devam eder ve sadece yeni veya degişen sesler işlenir. Journal'lı
+                         bir çalıştırmanın her zaman bir seed'i olur, bu yüzden noise pencereleri seed verilmiş gibi
+                         seçilir
+    :param seed: noise eklenecek yerleri seçen random seed, verilmezse journal'daki seed kullanılır. Seed verildiğinde
+                 her sesin noise penceresi noise'lar içinden rastgele seçilir, pencereler üst üste gelebilir. Seed
+                 verilmezse noise'lar seslere sırayla, birbirini takip eden ve çakışmayan pencereler halinde dağıtılır
+    :param shard_index: bu çalıştırmanın işleyecegi parça, 0 ile shard_count - 1 arasında
+    :param shard_count: dataset'in kaç parçaya bölündüğü, aynı seed ile çalışan bütün parçalar birlikte tek bir
+                        çalıştırmanın çıktısının aynısını üretir
+    :param output_shard_size: verilirse sesler ve recipe'leri tek tek dosyalar yerine save_path altında bu boyutta
+                              (byte) tar shard'larına yazılır, bkz. Augmenter.shards.ShardReader
+    :param read_threads: her process'te sıradaki sesleri önceden decode eden thread sayısı
+    :param write_threads: her process'te mixlenmiş sesleri arkadan yazan thread sayısı
+    :param queue_depth: önceden decode edilen ve yazılmayı bekleyen en fazla ses sayısı
+    :param metrics_json: verilirse decode, resample, mix, effect, write ve encode aşamalarının süreleri, sample ve
+                         byte sayıları ile process'lerin en yüksek bellek kullanımı bu dosyaya JSON olarak yazılır
+    :param metrics_prometheus: verilirse aynı ölçümler bu dosyaya Prometheus text formatında yazılır
+    :param snr_db: verilirse her noise penceresi, eklendiği ses penceresi ile arasında bu signal to noise oranı (dB)
+                   olacak şekilde ölçeklenir. Noise pencerelerinin enerjisi noise'ların energy index'inden okunur,
+                   noise_bank_dir verildiyse bu index bank'ın yanında bir kere oluşturulur. Bu modda sesler blok blok
+                   mixlenmez.
     """
     # percentage range check
     if percentage < 0 or percentage > 100:
         return
 
+    if shard_count > 1 and seed is None:
+        raise ValueError("every shard must be given the same seed")
+    if not 0 <= shard_index < shard_count:
+        raise ValueError("shard_index must be in [0, {0})".format(shard_count))
+
+    begin = time.time()
+    instrumentation.recorder.reset()
+    _use_decode_cache(decode_cache_dir, decode_cache_size)
+    journal = None if journal_path is None else CompletionJournal(journal_path, seed)
+    if journal is not None:
+        seed = journal.getSeed()
     noises = {}
+    tasks = plan_noise_injection(sound_path, noise_path, save_path, percentage=percentage,
+                                 noise_bank_dir=noise_bank_dir, dataset_index=dataset_index, seed=seed,
+                                 shard_index=shard_index, shard_count=shard_count, noises=noises)
+
+    keys = {}
+    if journal is not None:
+        recipe = {"noisePath": os.path.abspath(noise_path), "savePath": os.path.abspath(save_path),
+                  "percentage": percentage, "seed": seed, "snrDb": snr_db}
+        keys = {task.path: CompletionJournal.keyOf(task.path, recipe) for task in tasks}
+        tasks = [task for task in tasks if not journal.isDone(keys[task.path])]
+
+    # the noises decoded while planning are handed to the workers through shared memory, instead of every worker
+    # decoding a copy of its own. A noise bank is memory-mapped, so its pages are already shared.
+    shared_noises = {}
+    if worker_count is not None and worker_count > 1 and noise_bank_dir is None and SharedNoiseBank.isAvailable():
+        for sr, noise in noises.items():
+            shared_noises[sr] = SharedNoiseBank.create(noise.impl.getData(), noise.getSamplingRate(),
+                                                       noise.impl.getPath())
+    noises.clear()
+
+    # the longest sounds are noised first and short ones are sent to the workers in groups
+    loads = {}
+    durations = [task.duration for task in tasks]
+    initargs = (noise_path, noise_bank_dir, stream_threshold, decode_cache_dir, decode_cache_size, save_path,
+                output_shard_size, {sr: bank.descriptor() for sr, bank in shared_noises.items()}, snr_db)
+    metrics = None
+    if read_threads > 0 or write_threads > 0:
+        # reads, mixes and writes overlap within a batch, so a batch is made of several sounds
+        metrics = PipelineMetrics()
+        min_batch_duration = max(1.0, sum(durations) / (max(1, worker_count or 1) * 8))
+        results = run_scheduled(_mix_noise_windows, tasks, durations, worker_count=worker_count,
+                                initializer=_init_worker, initargs=initargs, min_batch_duration=min_batch_duration,
+                                loads=loads, metrics=metrics,
+                                stages=(_read_sound, _write_noised_sound,
+                                        {"read_threads": read_threads, "write_threads": write_threads,
+                                         "depth": queue_depth}))
+    else:
+        results = run_scheduled(_inject_noise_into_file, tasks, durations, worker_count=worker_count,
+                                initializer=_init_worker, initargs=initargs, loads=loads)
+    try:
+        for path, outputs in tqdm(results, total=len(tasks)):
+            if journal is not None:
+                journal.record(keys[path], outputs)
+    finally:
+        if journal is not None:
+            journal.close()
+        # the shard writer of the serial mode is the one of this process
+        _close_shard_writer()
+        for bank in shared_noises.values():
+            bank.unlink()
+    report_load(loads)
+    if metrics is not None:
+        metrics.report()
+    instrumentation.recorder.report()
+    if metrics_json is not None:
+        instrumentation.recorder.to_json(metrics_json, soundPath=os.path.abspath(sound_path),
+                                         workerCount=worker_count, files=len(tasks), audioSeconds=sum(durations),
+                                         wallSeconds=time.time() - begin,
+                                         workers={str(pid): dict(zip(("files", "busySeconds", "audioSeconds"), load))
+                                                  for pid, load in loads.items()})
+    if metrics_prometheus is not None:
+        instrumentation.recorder.to_prometheus(metrics_prometheus)
+
+
+def noise_injection_stream(sound_path, noise_path, percentage: int = 20, noise_bank_dir: str = None,
+                           dataset_index: str = None, seed: int = None, epochs: int = 1, shuffle: bool = True,
+                           sampling_rate: int = None, batch_size: int = None, batch_length: int = None,
+                           drop_last: bool = False, worker_count: int = 1, prefetch: int = 64,
+                           decode_cache_dir: str = None, decode_cache_size: int = 4 * 1024 * 1024 * 1024,
+                           shard_index: int = 0, shard_count: int = 1, metrics: PipelineMetrics = None,
+                           snr_db: float = None):
+    """ advanced_noise_injection'ın diske hiçbir şey yazmayan hali: noise eklenmiş sesler dosyaya yazılmak yerine
+    eğitim döngüsüne verilir. Sesler worker_count arka plan process'inde mixlenir, en fazla prefetch tanesi önceden
+    hazırlanıp sırada bekletilir, böylece eğitim döngüsü bir sonraki sesi beklemeden alır.
+    İlk epoch, aynı seed ile çalıştırılan advanced_noise_injection'ın yazacağı seslerin aynısını verir, sonraki
+    epoch'larda her ses için noise eklenecek yer ve noise penceresi yeniden seçilir.
+    :param sound_path: seslerin olduğu dizin, altındaki klasörler speaker adlarıdır
+    :param noise_path: noise'ların oldugu dizin
+    :param percentage: seslerin yuzde kacına noise eklenecegi bilgisi girilir
+    :param noise_bank_dir: noise'ların decode edilmiş hallerinin saklanacağı dizin
+    :param dataset_index: sound_path'in DatasetIndex manifest'inin yolu
+    :param seed: noise eklenecek yerleri seçen random seed, verilmezse rastgele seçilir
+    :param epochs: dataset'in kaç kere dolaşılacağı, None ise sonsuza kadar
+    :param shuffle: her epoch'ta seslerin sırası seed'e göre karıştırılır
+    :param sampling_rate: verilirse bütün sesler bu sampling rate'e çevrilir, batch'ler için gereklidir
+    :param batch_size: verilirse sesler tek tek değil bu sayıda sesten oluşan batch'ler halinde verilir
+    :param batch_length: verilirse batch'teki sesler bu uzunluğa (sample) kesilir veya sıfırla doldurulur, böylece
+                         bütün batch'ler aynı boyutta olur
+    :param drop_last: batch_size'dan az ses kalan son batch atılır
+    :param worker_count: sesleri mixleyen arka plan process sayısı, 0 ise sesler bu process'te sırası gelince mixlenir
+    :param prefetch: önceden mixlenip sırada bekleyen en fazla ses sayısı
+    :param decode_cache_dir: seslerin decode edilmiş hallerinin saklanacağı dizin
+    :param decode_cache_size: decode cache'inin byte cinsinden boyutu
+    :param shard_index: bu stream'in dolaşacağı parça, örneğin birden çok makinede eğitim için
+    :param shard_count: dataset'in kaç parçaya bölündüğü
+    :param metrics: verilirse pipeline.PipelineMetrics, read_wait eğitim döngüsünün sesleri ne kadar beklediğini,
+                    read_time mixlemenin ne kadar sürdüğünü gösterir
+    :param snr_db: verilirse noise pencereleri bu signal to noise oranı (dB) ile eklenir, bkz.
+                   advanced_noise_injection
+    :return: generator of (speaker, samples, recipe) tuples, or (speakers, batch, lengths, recipes) batches when
+             batch_size is given, see tool_kit.pad_batch
+    """
+    if percentage < 0 or percentage > 100:
+        raise ValueError("percentage must be in [0, 100]")
+    if batch_size is not None and sampling_rate is None:
+        raise ValueError("the sounds of a batch must be resampled to a single sampling_rate")
+    if not 0 <= shard_index < shard_count:
+        raise ValueError("shard_index must be in [0, {0})".format(shard_count))
+    items = _noise_injection_items(sound_path, noise_path, percentage, noise_bank_dir, dataset_index,
+                                   random.randrange(2 ** 32) if seed is None else seed, epochs, shuffle, sampling_rate,
+                                   worker_count, prefetch, decode_cache_dir, decode_cache_size, shard_index,
+                                   shard_count, PipelineMetrics() if metrics is None else metrics, snr_db)
+    if batch_size is None:
+        return items
+    return _batches(items, batch_size, batch_length, drop_last)
+
+
+def _noise_injection_items(sound_path, noise_path, percentage, noise_bank_dir, dataset_index, seed, epochs, shuffle,
+                           sampling_rate, worker_count, prefetch, decode_cache_dir, decode_cache_size, shard_index,
+                           shard_count, metrics, snr_db):
+    noises = {}
+
+    def plan(epoch):
+        # the first epoch is planned like advanced_noise_injection with the same seed, every next one anew
+        epoch_seed = seed if epoch == 0 else "{0}/{1}".format(seed, epoch)
+        # the tasks are planned with an empty save path, so the save directory of a task is its speaker
+        tasks = plan_noise_injection(sound_path, noise_path, "", percentage=percentage, noise_bank_dir=noise_bank_dir,
+                                     dataset_index=dataset_index, seed=epoch_seed, shard_index=shard_index,
+                                     shard_count=shard_count, noises=noises)
+        if shuffle:
+            random.Random(str(epoch_seed)).shuffle(tasks)
+        return tasks
+
+    def epoch_tasks(first):
+        # the next epoch is planned while the workers are still busy with the end of the current one
+        yield from first
+        epoch = 1
+        while epochs is None or epoch < epochs:
+            yield from plan(epoch)
+            epoch += 1
+
+    _use_decode_cache(decode_cache_dir, decode_cache_size)
+    tasks = epoch_tasks(plan(0) if epochs is None or epochs > 0 else [])
+    pool = None
+    shared_noises = {}
+    try:
+        if worker_count > 0:
+            if noise_bank_dir is None and SharedNoiseBank.isAvailable():
+                for sr, noise in noises.items():
+                    shared_noises[sr] = SharedNoiseBank.create(noise.impl.getData(), noise.getSamplingRate(),
+                                                               noise.impl.getPath())
+                    # the next epochs are planned with the shared copy, so this process does not keep one of its own
+                    noises[sr] = shared_noises[sr].toAudio()
+            pool = multiprocessing.Pool(processes=worker_count, initializer=_init_worker,
+                                        initargs=(noise_path, noise_bank_dir, None, decode_cache_dir,
+                                                  decode_cache_size, None, None,
+                                                  {sr: bank.descriptor() for sr, bank in shared_noises.items()},
+                                                  snr_db))
+        else:
+            _init_worker(noise_path, noise_bank_dir, None, decode_cache_dir, decode_cache_size, snr_db=snr_db)
+
+        pending = deque()
+        while True:
+            while pool is not None and len(pending) < prefetch:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                pending.append(pool.apply_async(_augment_sound, (task, sampling_rate)))
+            if pool is None:
+                task = next(tasks, None)
+                if task is None:
+                    return
+                item, busy = _augment_sound(task, sampling_rate)
+            else:
+                if not pending:
+                    return
+                metrics.sample_depths(sum(result.ready() for result in pending), 0)
+                begin = time.time()
+                item, busy = pending.popleft().get()
+                metrics.read_wait += time.time() - begin
+            metrics.read_time += busy
+            metrics.items += 1
+            yield item
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        noises.clear()
+        for bank in shared_noises.values():
+            bank.unlink()
+
+
+def _batches(items, batch_size, batch_length=None, drop_last=False):
+    """ Groups (speaker, samples, recipe) items into zero padded (speakers, batch, lengths, recipes) batches. """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) < batch_size:
+            continue
+        yield _pad_items(batch, batch_length)
+        batch = []
+    if batch and not drop_last:
+        yield _pad_items(batch, batch_length)
+
+
+def _pad_items(items, batch_length=None):
+    speakers, sounds, recipes = zip(*items)
+    if batch_length is not None:
+        sounds = [sound[:batch_length] for sound in sounds]
+    batch, lengths = pad_batch(sounds)
+    if batch_length is not None and batch.shape[1] < batch_length:
+        batch = np.pad(batch, ((0, 0), (0, batch_length - batch.shape[1])), mode="constant")
+    return list(speakers), batch, lengths, list(recipes)
+
+
+def plan_noise_injection(sound_path, noise_path, save_path, percentage: int = 20, noise_bank_dir: str = None,
+                         dataset_index: str = None, seed: int = None, shard_index: int = 0, shard_count: int = 1,
+                         noises: dict = None):
+    """ Decides, up front, which part of every sound gets noise and which window of the concatenated noise is used
+    for it, so the tasks can later be executed in any order by any worker.
+
+    Without a seed the files are planned in the order the serial implementation walked them, and consecutive files
+    get consecutive, non-overlapping noise windows. With a seed, the choices of every file come from a random
+    generator of its own, keyed by the seed and the path of the file in the dataset. A file is then planned the same
+    way whichever other files are planned with it, which is what lets the dataset be split into shards.
+    :param sound_path: seslerin olduğu dizin
+    :param noise_path: noise'ların oldugu dizin
+    :param save_path:  yeni seslerin kaydedileceği dizin
+    :param percentage: seslerin yuzde kacına noise eklenecegi bilgisi girilir
+    :param noise_bank_dir: noise'ların decode edilmiş hallerinin saklanacağı dizin
+    :param dataset_index: sound_path'in DatasetIndex manifest'inin yolu
+    :param seed: verilirse aynı dataset için her seferinde aynı plan çıkar
+    :param shard_index: planlanacak parça
+    :param shard_count: dataset'in kaç parçaya bölündüğü, bölmek için seed gerekir
+    :param noises: verilirse planlama için okunan noise'lar sampling rate'lerine göre bu dict'e konur, dict'te
+                   zaten bulunan noise'lar tekrar okunmaz
+    :return: list of NoiseInjectionTask
+    """
+    tasks = []
+    noise_lengths = {}
+    noise_start_at = 0
+
+    index = DatasetIndex.loadOrScan(sound_path, dataset_index)
+    for record in index.speakerRecords():
+        if shard_count > 1 and shard_of(record.relpath, shard_count) != shard_index:
+            continue
+        rng = random if seed is None else file_rng(seed, record.relpath)
+        sr, duration = record.samplingRate, index.getDuration(record)
+        noised_sound_duration = (duration / 100) * percentage  # calculates the noise length of the sound
+        # picks a random start time to add noise
+        start_at = rng.uniform(0, duration - noised_sound_duration)
+
+        # gets the total length of concatenated noises corresponding to sampling rate of sound
+        if str(sr) not in noise_lengths:
+            if noises is not None and str(sr) in noises:
+                noise = noises[str(sr)]
+            else:
+                noise = load_noises(noise_path, sr, noise_bank_dir)
+            noise_lengths[str(sr)] = noise.getLength()
+            if noises is not None:
+                noises[str(sr)] = noise
+        noise_length = noise_lengths[str(sr)]
+
+        if seed is not None:
+            # picks the noise window of the file instead of continuing from the previous file
+            noise_start_at = rng.uniform(0, noise_length / float(sr))
+        # the windows are planned in whole samples and kept within the sound, so Audio.mix, stream_mix and the SNR
+        # mix cut the sound and the noise at the same samples
+        noised_length = min(int(noised_sound_duration * sr), record.frames)
+        start = min(int(start_at * sr), record.frames - noised_length)
+        noise_start = Audio.AudioSegment.toSamples(noise_start_at, sr) % noise_length
+        windows = []
+        if noised_length > 0:
+            windows, noise_start = _plan_noise_windows(start, noised_length, noise_start, noise_length)
+        noise_start_at = noise_start / float(sr)
+        windows = [(begin / float(sr), noise_begin / float(sr), length / float(sr))
+                   for begin, noise_begin, length in windows]
+        tasks.append(NoiseInjectionTask(path=index.getPath(record), samplingRate=sr, duration=duration,
+                                        saveDir=os.path.join(save_path, record.speaker), windows=windows))
+    return tasks
+
+
+def _file_key(relpath):
+    # the same on every machine and operating system, wherever the dataset is mounted
+    return relpath.replace(os.sep, "/").encode("utf-8")
+
+
+def file_rng(seed, relpath):
+    """ The random generator of a single file of the dataset, keyed by the seed and the path of the file in it. """
+    return random.Random(int(hashlib.sha1(str(seed).encode("utf-8") + b"/" + _file_key(relpath)).hexdigest(), 16))
+
+
+def shard_of(relpath, shard_count):
+    """ The shard a file of the dataset belongs to, decided by the path of the file in it alone. """
+    return int(hashlib.sha1(_file_key(relpath)).hexdigest()[:16], 16) % shard_count
 
-    for root, people, _ in os.walk(sound_path):
-        noise_start_at = 0
-        # iterates each speaker folder in the path
-        for person in people:
-            for person_root, _, sound_files in os.walk(os.path.join(root, person)):
-                # iterates each sound file of the speaker
-                for sound_file in (x for x in sound_files if
-                                   x.lower().endswith(".wav") or x.lower().endswith(".mp3") or x.lower().endswith(
-                                       ".flac")):
-
-                    # read current sound file
-                    sound = Audio(data=Audio.AudioImpl(path=os.path.join(person_root, sound_file)))
-                    sr = sound.getSamplingRate()  # gets the sampling rate of the sound
-                    duration = sound.getDuration()  # gets the duration of the sound
-                    noised_sound_duration = (duration / 100) * percentage  # calculates the noise length of the sound
-                    # picks a random start time to add noise
-                    start_at = random.uniform(0, duration - noised_sound_duration)
-
-                    # read noise sound and concatenate them corresponding to sampling rate of sound
-                    if str(sr) not in noises:
-                        noises[str(sr)] = load_noise_sound_and_concatenate(noise_path, sr=sr)
-
-                    # gets the total duration of concatenated noises
-                    noise_duration = noises[str(sr)].getDuration()
-                    # create corresponding path for saving the noised sound
-                    os.makedirs(os.path.join(save_path, person), exist_ok=True)
-
-                    # when there is no enough noises left
-                    if noise_start_at + noised_sound_duration > noise_duration:
-                        remaining_duration = noise_duration - noise_start_at  # finds the remaining noise duration
-                        # iterates till the noising process done
-                        while noised_sound_duration > 0:
-                            # when there is no enough noise duration for mixing
-                            if remaining_duration < noised_sound_duration:
-                                # mixes the remaining noise into sound
-                                sound = sound.mix(other=noises[str(sr)], segmentsAsSeconds=[
-                                    sound.getSegment(begin=start_at, end=start_at + remaining_duration),
-                                    noises[str(sr)].getSegment(begin=noise_start_at,
-                                                               end=noise_start_at + remaining_duration)])
-                                start_at += remaining_duration  # last index of the added noise on sound
-                                noised_sound_duration -= remaining_duration  # duration of noise that is left
-                                noise_start_at = 0  # noise sound is just finish, and operation start from beginning
-                                remaining_duration = noise_duration - noise_start_at
-                            else:  # when the noise duration is enough
-                                # mixes the noise, which has enough duration, into sound
-                                sound.mix(other=noises[str(sr)], segmentsAsSeconds=[
-                                    sound.getSegment(begin=start_at, end=start_at + noised_sound_duration),
-                                    noises[str(sr)].getSegment(begin=noise_start_at,
-                                                               end=noise_start_at + noised_sound_duration)]).write(
-                                    os.path.join(save_path, person))
-
-                                noise_start_at += noised_sound_duration  # set the index of remaining noise
-                                noised_sound_duration = 0
-                                """
-                                
-                                     else if: 
-                                    sound.mix(other=noises[str(sr),segmentsAsSeconds=[
-                                        sound.getDuration((begin=start_at) +noised_sound_duration),
-                                        noises[str(sr),segmentsAsSeconds=[os.path.gets]]
-                                    ]])
-                            """
-
-                    else:
-                        sound.mix(other=noises[str(sr)],
-                                  segmentsAsSeconds=[
-                                      sound.getSegment(begin=start_at, end=start_at + noised_sound_duration),
-                                      noises[str(sr)].getSegment(begin=noise_start_at,
-                                                                 end=noise_start_at + noised_sound_duration)]).write(
-                            os.path.join(save_path, person))
-
-                        # changes the noise sound start point for next iteration
-                        noise_start_at += noised_sound_duration
+
+def _plan_noise_windows(start_at, noised_sound_duration, noise_start_at, noise_duration):
+    """ Splits the noised part of a sound into (sound begin, noise begin, length) windows, in samples. When there is
+    not enough noise left, the noise is restarted from its beginning, exactly like the serial implementation did.
+    :return: the windows and the noise cursor for the next sound
+    """
+    windows = []
+    # when there is no enough noises left
+    if noise_start_at + noised_sound_duration > noise_duration:
+        remaining_duration = noise_duration - noise_start_at  # finds the remaining noise duration
+        # iterates till the noising process done
+        while noised_sound_duration > 0:
+            # when there is no enough noise duration for mixing
+            if remaining_duration < noised_sound_duration:
+                windows.append((start_at, noise_start_at, remaining_duration))
+                start_at += remaining_duration  # last index of the added noise on sound
+                noised_sound_duration -= remaining_duration  # duration of noise that is left
+                noise_start_at = 0  # noise sound is just finish, and operation start from beginning
+                remaining_duration = noise_duration - noise_start_at
+            else:  # when the noise duration is enough
+                windows.append((start_at, noise_start_at, noised_sound_duration))
+                noise_start_at += noised_sound_duration  # set the index of remaining noise
+                noised_sound_duration = 0
+    else:
+        windows.append((start_at, noise_start_at, noised_sound_duration))
+        # changes the noise sound start point for next iteration
+        noise_start_at += noised_sound_duration
+    return windows, noise_start_at
+
+
+# noise banks of the current process, keyed by sampling rate
+_worker_noise_path = None
+_worker_noise_bank_dir = None
+_worker_stream_threshold = None
+_worker_noises = {}
+_worker_shard_writer = None
+_worker_shard_writer_finalizer = None
+_worker_snr_db = None
+# energy indexes of the noises of the current process, keyed by sampling rate, built on the first SNR-targeted mix
+_worker_noise_energy = {}
+# shared memory segments the noises of the current process are views of, kept open as long as the process lives
+_worker_shared_noises = {}
+
+
+def _init_worker(noise_path, noise_bank_dir=None, stream_threshold=None, decode_cache_dir=None,
+                 decode_cache_size=None, save_path=None, output_shard_size=None, shared_noises=None, snr_db=None):
+    global _worker_noise_path, _worker_noise_bank_dir, _worker_stream_threshold, _worker_noises, \
+        _worker_shard_writer, _worker_shard_writer_finalizer, _worker_shared_noises, _worker_snr_db, \
+        _worker_noise_energy
+    _worker_noise_path = noise_path
+    _worker_noise_bank_dir = noise_bank_dir
+    _worker_stream_threshold = stream_threshold
+    _worker_snr_db = snr_db
+    _worker_noises = {}
+    _worker_noise_energy = {}
+    _worker_shared_noises = {sr: SharedNoiseBank.attach(descriptor) for sr, descriptor in (shared_noises or {}).items()}
+    for sr, bank in _worker_shared_noises.items():
+        _worker_noises[sr] = bank.toAudio()
+    _use_decode_cache(decode_cache_dir, decode_cache_size)
+    _worker_shard_writer = None
+    if output_shard_size is not None:
+        # every process writes shards of its own, closed when the process exits
+        _worker_shard_writer = ShardWriter(save_path, maxShardSize=output_shard_size)
+        _worker_shard_writer_finalizer = Finalize(_worker_shard_writer, _worker_shard_writer.close, exitpriority=10)
+
+
+def _close_shard_writer():
+    global _worker_shard_writer
+    if _worker_shard_writer is not None:
+        _worker_shard_writer_finalizer()
+        _worker_shard_writer = None
+
+
+def _use_decode_cache(decode_cache_dir, decode_cache_size=None):
+    """ Makes every decode of the current process go through the decode cache in decode_cache_dir, if it is given. """
+    if decode_cache_dir is None:
+        Audio.AudioImpl.decodeCache = None
+    elif decode_cache_size is None:
+        Audio.AudioImpl.decodeCache = DecodeCache(decode_cache_dir)
+    else:
+        Audio.AudioImpl.decodeCache = DecodeCache(decode_cache_dir, decode_cache_size)
+
+
+def _get_noises(sr):
+    if str(sr) not in _worker_noises:
+        _worker_noises[str(sr)] = load_noises(_worker_noise_path, sr, _worker_noise_bank_dir)
+    return _worker_noises[str(sr)]
+
+
+def _get_noise_energy(sr):
+    """ The energy_index of the noises of the given sampling rate. The one of a noise bank is memory-mapped from the
+    bank directory and shared by every process, otherwise every process builds its own.
+    """
+    if str(sr) not in _worker_noise_energy:
+        if _worker_noise_bank_dir is not None:
+            index = NoiseBank.openOrBuild(_worker_noise_path, _worker_noise_bank_dir, sr).energyIndex()
+        else:
+            index = energy_index(_get_noises(sr).impl.getData())
+        _worker_noise_energy[str(sr)] = index
+    return _worker_noise_energy[str(sr)]
+
+
+def _inject_noise_into_file(task: "NoiseInjectionTask"):
+    """ Mixes the planned noise windows into a single sound file and writes the result.
+    :return: (path of the sound, paths of the written sounds)
+    """
+    return _write_noised_sound(task, _mix_noise_windows(task, _read_sound(task)))
+
+
+def _augment_sound(task: "NoiseInjectionTask", sampling_rate=None):
+    """ Mixes the planned noise windows into a single sound in memory, for noise_injection_stream.
+    :return: ((speaker, samples, recipe), seconds it took)
+    """
+    begin = time.time()
+    sound = _mix_noise_windows(task, Audio(data=Audio.AudioImpl(path=task.path)))
+    mixed = sound.pipeBuffer if sampling_rate is None else sound.pipeBuffer.resample(sampling_rate)
+    data = mixed.impl.getData()
+    if not data.flags.writeable:
+        # a sound without noise is still the memory-mapped decode cache entry
+        data = data.copy()
+    return (os.path.basename(task.saveDir), data, sound.getPipeRecipe()), time.time() - begin
+
+
+def _is_streamed(task: "NoiseInjectionTask"):
+    # a mix at a target SNR needs the whole noised part of the sound, so it is never streamed
+    return _worker_snr_db is None and _worker_stream_threshold is not None and \
+        os.path.getsize(task.path) > _worker_stream_threshold and can_stream(task.path)
+
+
+def _read_sound(task: "NoiseInjectionTask"):
+    """ Read stage: decodes the sound, unless it is a long recording which is mixed block by block. """
+    if not task.windows or _is_streamed(task):
+        return None
+    return Audio(data=Audio.AudioImpl(path=task.path))
+
+
+def _mix_noise_windows(task: "NoiseInjectionTask", sound):
+    """ Compute stage: mixes the planned noise windows into the decoded sound. Long recordings are mixed and written
+    block by block here, since they are never decoded as a whole.
+    :return: the noised Audio, or the written outputs of a streamed sound
+    """
+    noises = _get_noises(task.samplingRate)
+    if sound is None:
+        return _stream_noise_windows(task, noises) if task.windows else []
+    if _worker_snr_db is not None and task.windows:
+        return _mix_noise_windows_at_snr(task, sound, noises)
+    for start_at, noise_start_at, noised_sound_duration in task.windows:
+        sound = sound.mix(other=noises, segmentsAsSeconds=[
+            sound.getSegment(begin=start_at, end=start_at + noised_sound_duration),
+            noises.getSegment(begin=noise_start_at, end=noise_start_at + noised_sound_duration)])
+    return sound
+
+
+def _mix_noise_windows_at_snr(task: "NoiseInjectionTask", sound, noises):
+    """ Mixes every noise window scaled to the target SNR against the part of the sound it is added to, see
+    tool_kit.mix_snr_librosa. The power of a noise window is a subtraction in the energy index of the noises.
+    """
+    sr = task.samplingRate
+    data = np.array(sound.impl.getData())
+    noise_data = noises.impl.getData()
+    noise_index = _get_noise_energy(sr)
+    for start_at, noise_start_at, noised_sound_duration in task.windows:
+        begin = Audio.AudioSegment.toSamples(start_at, sr)
+        end = min(len(data), begin + Audio.AudioSegment.toSamples(noised_sound_duration, sr))
+        if end > begin:
+            data[begin:end] = mix_snr_librosa(data[begin:end], noise_data, snr_db=_worker_snr_db,
+                                              sound2_begin=Audio.AudioSegment.toSamples(noise_start_at, sr),
+                                              sound2_index=noise_index)
+    mixed = Audio(data=Audio.AudioImpl(array=data, samplingRate=sr, path=task.path))
+    # a single step for every window, so the file is named like the ones of the other modes
+    mixed.addPipeMetadata(Audio.AugmentationStep(audio=noises, step=Audio.AugmentationStep.Steps.Mix,
+                                                 parameters={"snr": _worker_snr_db})())
+    return mixed
+
+
+def _write_noised_sound(task: "NoiseInjectionTask", sound):
+    """ Write stage: writes the noised sound and its recipe.
+    :return: (path of the sound, paths of the written sounds)
+    """
+    if not isinstance(sound, Audio):
+        return task.path, sound
+    if _worker_shard_writer is not None:
+        return task.path, [sound.write(task.saveDir, shardWriter=_worker_shard_writer)]
+    # create corresponding path for saving the noised sound
+    os.makedirs(task.saveDir, exist_ok=True)
+    return task.path, [sound.write(task.saveDir)]
+
+
+def _stream_noise_windows(task: "NoiseInjectionTask", noises):
+    """ Mixes a long recording block by block, without loading it.
+    :return: paths, or shard keys, of the written sounds
+    """
+    if _worker_shard_writer is not None:
+        # mixed into a directory of its own next to the shards, then moved into them
+        with tempfile.TemporaryDirectory(dir=_worker_shard_writer.directory) as mix_dir:
+            mixed = stream_mix(task.path, noises.impl.getData(), Audio.operandCache.peak(noises), task.samplingRate,
+                               task.windows, mix_dir, noise_name=noises.impl.getPath(), description=False)
+            key = _worker_shard_writer.keyOf(os.path.join(task.saveDir, os.path.basename(mixed)))
+            _worker_shard_writer.addFile(key, mixed, recipe=[
+                (noises.impl.getPath(), Audio.AugmentationStep.Steps.Mix.value, {})])
+        return [key]
+    os.makedirs(task.saveDir, exist_ok=True)
+    return [stream_mix(task.path, noises.impl.getData(), Audio.operandCache.peak(noises), task.samplingRate,
+                       task.windows, task.saveDir, noise_name=noises.impl.getPath())]
 
 
 def load_noise_sound_and_concatenate(path, sr):
     """ Bu fonksiyon verilen bir dizin altında bulunan wav veya mp3 dosyalarını tek tek okuyup,
-    data array'ini peşpeşe tek bir listeye ekler.
+    data array'ini peşpeşe tek bir listeye ekler. Dosyalar önce bir listede toplanır ve tek seferde birleştirilir.
+    Dosyalar path'lerine göre sıralı birleştirilir, bkz. NoiseBank.listFiles, böylece her makinede aynı sonuç çıkar.
     :param path: seslerin okunacağı dizin
     :param sr: seslerin okunacağı sampling rate degeri
     :return: seslerin librosa ile okunmuş numpy array değerlerinin bulunduğu bir list
     """
-    sound_list = []
-    for root, _, sound_files in os.walk(path):
-        sound_list = None
-        for sound_file in (x for x in sound_files if
-                           x.lower().endswith(".wav") or x.lower().endswith(".mp3") or x.lower().endswith(".flac")):
-            if sound_list == None:
-                sound_list = Audio(data=Audio.AudioImpl(path=os.path.join(root, sound_file), samplingRate=sr))
-            else:
-                sound_list = sound_list.concat(
-                    Audio(data=Audio.AudioImpl(path=os.path.join(root, sound_file), samplingRate=sr)))
+    noise_files = NoiseBank.listFiles(path)
+    if not noise_files:
+        return None
+
+    sound_list = [Audio.AudioImpl.decode(noise_file, sr)[0] for noise_file in noise_files]
+    return Audio(data=Audio.AudioImpl(array=np.concatenate(sound_list), samplingRate=sr, path=noise_files[0]))
 
-    return sound_list
+
+def load_noises(noise_path, sr, noise_bank_dir=None):
+    """ Returns the concatenated noises for the given sampling rate. When noise_bank_dir is given, the noises are
+    served from a memory-mapped NoiseBank which is built there on the first use.
+    """
+    if noise_bank_dir is not None:
+        return NoiseBank.openOrBuild(noise_path, noise_bank_dir, sr).toAudio()
+    return load_noise_sound_and_concatenate(noise_path, sr=sr)
 
 
 def main():
@@ -128,7 +630,45 @@ def main():
     ap.add_argument("-sp", "--save-path", required=True, help="the path that the noised sounds will be saved")
     ap.add_argument("-p", "--percentage", required=True, default=20,
                     help="the percentage of dataset that is mixed by noises")
-    ap.add_argument("-wo", "--worker-count", required=False, help="")
+    ap.add_argument("-nb", "--noise-bank-dir", required=False,
+                    help="the directory where the decoded noises are kept between runs")
+    ap.add_argument("-st", "--stream-threshold-mb", required=False, type=float,
+                    help="sounds bigger than this many megabytes are mixed block by block instead of in memory")
+    ap.add_argument("-dc", "--decode-cache-dir", required=False,
+                    help="the directory where the decoded sounds are kept between runs, "
+                         "see python -m Augmenter.decode_cache to fill it in advance")
+    ap.add_argument("-dcs", "--decode-cache-size-mb", required=False, type=float, default=4096,
+                    help="the size of the decode cache in megabytes")
+    ap.add_argument("-di", "--dataset-index", required=False,
+                    help="the manifest file of the dataset, created on the first run and refreshed on the next ones")
+    ap.add_argument("-j", "--journal", required=False,
+                    help="the completion journal of the run, an interrupted run continues from where it stopped. "
+                         "A journaled run always has a seed, so the noise windows are picked as with --seed")
+    ap.add_argument("-se", "--seed", required=False, type=int,
+                    help="the random seed that picks the noised parts, defaults to the seed kept in the journal. "
+                         "With a seed the noise window of every sound is picked at random and windows may overlap, "
+                         "without one the noises are handed out in consecutive windows that do not overlap")
+    ap.add_argument("-si", "--shard-index", required=False, type=int, default=0,
+                    help="the shard of the dataset this run noises, in [0, shard count)")
+    ap.add_argument("-sc", "--shard-count", required=False, type=int, default=1,
+                    help="the number of shards the dataset is split into, every shard needs the same --seed")
+    ap.add_argument("-os", "--output-shard-size-mb", required=False, type=float,
+                    help="packs the noised sounds and their recipes into tar shards of this many megabytes")
+    ap.add_argument("-rt", "--read-threads", required=False, type=int, default=0,
+                    help="threads per process that decode the next sounds while the current one is mixed")
+    ap.add_argument("-wt", "--write-threads", required=False, type=int, default=0,
+                    help="threads per process that write the mixed sounds while the next one is mixed")
+    ap.add_argument("-qd", "--queue-depth", required=False, type=int, default=4,
+                    help="the most sounds decoded ahead, and the most sounds waiting to be written")
+    ap.add_argument("-mj", "--metrics-json", required=False,
+                    help="writes the time, samples and bytes of every stage and the peak memory to this json file")
+    ap.add_argument("-mp", "--metrics-prometheus", required=False,
+                    help="writes the same metrics to this file in the Prometheus text format")
+    ap.add_argument("-snr", "--snr-db", required=False, type=float,
+                    help="scales every noise window to this signal to noise ratio in dB against the part of the sound "
+                         "it is added to, instead of mixing it at its own level")
+    ap.add_argument("-wo", "--worker-count", required=False,
+                    help="number of processes that mix the sounds, defaults to the logical cpu count")
     args = vars(ap.parse_args())
 
     coreCount = psutil.cpu_count(logical=True)
@@ -137,12 +677,31 @@ def main():
     save_path = args["save_path"]
     percentage = int(args["percentage"])
 
-    cpu_core_in_use = coreCount if args["worker_count"] is None else args["worker_count"]
+    cpu_core_in_use = coreCount if args["worker_count"] is None else int(args["worker_count"])
 
     advanced_noise_injection(sound_path,
                              noise_path,
                              save_path,
-                             percentage=percentage)
+                             percentage=percentage,
+                             worker_count=cpu_core_in_use,
+                             noise_bank_dir=args["noise_bank_dir"],
+                             stream_threshold=None if args["stream_threshold_mb"] is None else
+                             int(args["stream_threshold_mb"] * 1024 * 1024),
+                             decode_cache_dir=args["decode_cache_dir"],
+                             decode_cache_size=int(args["decode_cache_size_mb"] * 1024 * 1024),
+                             dataset_index=args["dataset_index"],
+                             journal_path=args["journal"],
+                             seed=args["seed"],
+                             shard_index=args["shard_index"],
+                             shard_count=args["shard_count"],
+                             output_shard_size=None if args["output_shard_size_mb"] is None else
+                             int(args["output_shard_size_mb"] * 1024 * 1024),
+                             read_threads=args["read_threads"],
+                             write_threads=args["write_threads"],
+                             queue_depth=args["queue_depth"],
+                             metrics_json=args["metrics_json"],
+                             metrics_prometheus=args["metrics_prometheus"],
+                             snr_db=args["snr_db"])
 
 
 if __name__ == "__main__":
@@ -1,13 +1,18 @@
+import audioread
 import librosa as rosa
 import numpy as np
+import soundfile
 from enum import Enum
 from json_tricks import dump, dumps, load, loads
 import os
 from typing import List, Tuple
 import copy
 import math
+from collections import OrderedDict
 from pysndfx import AudioEffectsChain
 
+from Augmenter import dsp, instrumentation
+
 
 class Audio:
 	class AugmentationStep:
@@ -18,7 +23,7 @@ class Audio:
 			BandPass = "BandPass"
 			BandReject = "BandReject"
 			LowShelf = "LowShelf"
-			HighSelf = "LowShelf"
+			HighSelf = "HighShelf"
 			HighPass = "HighPass"
 			LowPass = "LowPass"
 			Limiter = "Limiter"
@@ -77,22 +82,33 @@ class Audio:
 				assert self.end > self.begin
 			self.complete = False
 			if audio is not None and samplingRate is not None:
-				duration = rosa.get_duration(y=rosa.to_mono(audio.impl.getData()), sr=samplingRate)
+				duration = audio.getDuration()
 				self.complete = (self.end == duration)
 				if self.end is -1:
 					self.complete = True
 					self.end = duration
 
+		@staticmethod
+		def toSamples(seconds: float, samplingRate: int) -> int:
+			""" The sample a time in seconds falls in. A time which is a whole number of samples but for the float
+			rounding of a division, e.g. length / samplingRate, gives that number instead of the sample before it.
+			"""
+			samples = seconds * samplingRate
+			nearest = round(samples)
+			return int(nearest) if abs(samples - nearest) < 1e-6 else int(samples)
+
 		def getBegin(self, samplingRate: int = 1) -> float:
-			begin = self.begin * samplingRate
-			return int(begin) if samplingRate != 1 else begin
+			if samplingRate != 1:
+				return Audio.AudioSegment.toSamples(self.begin, samplingRate)
+			return self.begin
 
 		def isComplete(self):
 			return self.complete
 
 		def getEnd(self, samplingRate: int = 1) -> float:
-			end = self.end * samplingRate
-			return int(end) if samplingRate != 1 else end
+			if samplingRate != 1:
+				return Audio.AudioSegment.toSamples(self.end, samplingRate)
+			return self.end
 
 		def getRange(self, samplingRate: int = 1) -> int:
 			theRange = (self.getEnd(samplingRate) - self.getBegin(samplingRate))
@@ -103,34 +119,140 @@ class Audio:
 			Padding = "Padding"
 			Looping = "Looping"
 
-		def __init__(self, array: np.ndarray = None, samplingRate: int = None, path: str = None):
+		# decode_cache.DecodeCache that decode reads through, when it is set
+		decodeCache = None
+
+		def __init__(self, array: np.ndarray = None, samplingRate: int = None, path: str = None, lazy: bool = False,
+					 validate: bool = True):
+			""" When lazy is set and only a path is given, the sampling rate, the length and the duration are read from
+			the header of the file and the samples are decoded on the first getData call.
+
+			When validate is not set, a given array is trusted to be finite mono samples and is not read at all, e.g. a
+			memory-mapped noise bank which was validated when it was decoded.
+
+			The samples are copy-on-write: clones and slices share the buffer of their origin as NumPy views, gain and
+			normalize are kept as pending elementwise operations until the data is asked for, and a shared buffer is
+			only copied when it is about to be written through getWritableData.
+			"""
 			assert (array is not None and samplingRate is not None) or path is not None
 			self.array = array
-			if self.array is not None:
+			self.pending = []
+			self.shared = False
+			if self.array is not None and validate:
 				self.array = rosa.to_mono(self.array)
-				rosa.util.valid_audio(self.array, mono=True)
+				rosa.util.valid_audio(self.array)
 			self.samplingRate = samplingRate
 			self.path = path
-			self.length = len(self.getData())
-			self.duration = (rosa.get_duration(y=rosa.to_mono(self.getData()), sr=self.samplingRate))
+			if self.array is None and lazy:
+				self.samplingRate, self.length = Audio.AudioImpl.readHeader(self.path)
+				self.duration = self.length / float(self.samplingRate)
+			elif not validate:
+				self.length = len(self.array)
+				self.duration = self.length / float(self.samplingRate)
+			else:
+				self.length = len(self.getData())
+				self.duration = (rosa.get_duration(y=rosa.to_mono(self.getData()), sr=self.samplingRate))
 			self.id = np.random.randint(0, 10 ** 10)
 
+		@staticmethod
+		def readHeader(path: str) -> Tuple[int, int]:
+			""" Returns the sampling rate and the frame count of a sound file without decoding it. """
+			try:
+				info = soundfile.info(path)
+				return info.samplerate, info.frames
+			except RuntimeError:
+				# formats libsndfile can not open, e.g. mp3, only report an estimated frame count
+				with audioread.audio_open(path) as fp:
+					return fp.samplerate, int(fp.duration * fp.samplerate)
+
+		@staticmethod
+		def decode(path: str, samplingRate: int = None) -> Tuple[np.ndarray, int]:
+			""" rosa.load(path, sr=samplingRate, mono=True), served from the decode cache when one is set. Samples which
+			come from the cache are a read-only memory map.
+			"""
+			with instrumentation.recorder.stage("decode") as stage:
+				if Audio.AudioImpl.decodeCache is None:
+					data, samplingRate = rosa.load(path, sr=samplingRate, mono=True)
+				else:
+					if samplingRate is None:
+						# decoding at the native sampling rate is the same as not resampling
+						samplingRate, _ = Audio.AudioImpl.readHeader(path)
+					data, samplingRate = Audio.AudioImpl.decodeCache.load(path, samplingRate)
+				stage.add(samples=len(data), nbytes=os.path.getsize(path))
+			return data, samplingRate
+
+		@staticmethod
+		def readFrames(path: str, begin: int, end: int) -> np.ndarray:
+			""" Decodes only the frames in [begin, end) of a sound file as mono, or returns None when the format does not
+			support seeking.
+			"""
+			try:
+				data, _ = soundfile.read(path, start=begin, stop=end, dtype="float32", always_2d=True)
+			except RuntimeError:
+				return None
+			data = rosa.to_mono(data.T)
+			rosa.util.valid_audio(data)
+			return data
+
 		def clone(self) -> "Audio.AudioImpl":
-			return Audio.AudioImpl(array=copy.deepcopy(self.array), samplingRate=self.samplingRate, path=self.path)
+			cloneOfThis = copy.copy(self)
+			cloneOfThis.pending = list(self.pending)
+			cloneOfThis.id = np.random.randint(0, 10 ** 10)
+			self.shared = cloneOfThis.shared = self.array is not None
+			return cloneOfThis
+
+		def isLoaded(self) -> bool:
+			return self.array is not None
 
 		def getData(self) -> np.ndarray:
 			if self.array is None:
 				if self.path is not None:
-					self.array, self.samplingRate = rosa.load(self.path, sr=None, mono=True)
-					rosa.util.valid_audio(self.array, mono=True)
+					self.array, self.samplingRate = Audio.AudioImpl.decode(self.path)
+					rosa.util.valid_audio(self.array)
+					self.length = len(self.array)
+					self.duration = (rosa.get_duration(y=self.array, sr=self.samplingRate))
+			if self.pending:
+				self.array = self.applyPending(self.array)
+				self.pending = []
+				self.shared = False
+			return self.array
+
+		def getWritableData(self) -> np.ndarray:
+			""" Returns the samples for in-place modification, copying them first if the buffer is shared. """
+			data = self.getData()
+			if self.shared or not data.flags.writeable:
+				self.array = data.copy()
+				self.shared = False
 			return self.array
 
+		def applyPending(self, data: np.ndarray) -> np.ndarray:
+			""" Applies the pending elementwise operations to data in the order they were requested. Only the first
+			operation allocates, the rest of them run in place.
+			"""
+			for index, (operation, operand) in enumerate(self.pending):
+				if index > 0 and np.result_type(data, operand) == data.dtype:
+					operation(data, operand, out=data)
+				else:
+					data = operation(data, operand)
+			return data
+
+		def getPeak(self):
+			""" np.max of the data, computed without applying the pending operations to the whole buffer. Gains and
+			divisions are monotonic, so the peak of the result comes from the minimum or the maximum of the buffer.
+			"""
+			if not self.pending or any(operand == 0 or not np.isfinite(operand) for _, operand in self.pending):
+				return np.max(self.getData())
+			data = self.getData() if self.array is None else self.array
+			return np.max(self.applyPending(np.array([np.min(data), np.max(data)], dtype=data.dtype)))
+
 		def getClonedData(self) -> np.ndarray:
 			return copy.deepcopy(self.getData())
 
 		def setData(self, data: np.ndarray):
 			assert data is not None
 			self.array = data
+			self.pending = []
+			self.shared = False
 			self.length = len(self.getData())
 			self.duration = (rosa.get_duration(y=rosa.to_mono(self.getData()), sr=self.samplingRate))
 
@@ -151,8 +273,19 @@ class Audio:
 			return self.duration
 
 		def getSlicedData(self, segment) -> np.ndarray:
-			return self.getData()[segment.getBegin(samplingRate=self.getSamplingRate()):
-								  segment.getEnd(samplingRate=self.getSamplingRate())]
+			return self.applyPending(self.getRawSlicedData(segment))
+
+		def getRawSlicedData(self, segment) -> np.ndarray:
+			""" The samples of the segment before the pending operations, as a view of the buffer when it is decoded. """
+			if self.array is None and self.path is not None:
+				# not decoded yet, so only the frames of the segment are decoded
+				slicedData = Audio.AudioImpl.readFrames(self.path, segment.getBegin(samplingRate=self.getSamplingRate()),
+														segment.getEnd(samplingRate=self.getSamplingRate()))
+				if slicedData is not None:
+					return slicedData
+				self.getData()
+			return self.array[segment.getBegin(samplingRate=self.getSamplingRate()):
+							  segment.getEnd(samplingRate=self.getSamplingRate())]
 
 		def getClonedSlicedData(self, segment) -> np.ndarray:
 			return copy.deepcopy(self.getSlicedData(segment))
@@ -160,7 +293,10 @@ class Audio:
 		def resample(self, targetRatio: float):
 			assert targetRatio > 0
 			if self.getSamplingRate() != targetRatio:
-				self.setData(rosa.resample(self.array, self.getSamplingRate(), targetRatio))
+				data = self.getData()
+				with instrumentation.recorder.stage("resample") as stage:
+					self.setData(rosa.resample(data, orig_sr=self.getSamplingRate(), target_sr=targetRatio))
+					stage.add(samples=len(data))
 				self.samplingRate = targetRatio
 
 		def fitLength(self, length: int, fittingMethod: FittingMethod = FittingMethod.Padding):
@@ -186,62 +322,161 @@ class Audio:
 										   theEnd),
 								mode='constant', constant_values=(0,)))
 
-		def normalize(self):
-			self.setData(self.array / np.max(self.array))
+		def normalize(self, peak: float = None):
+			self.pending.append((np.true_divide, self.getPeak() if peak is None else peak))
 
 		def gain(self, ratio: float = 1):
-			self.setData(self.array * ratio)
+			self.pending.append((np.multiply, ratio))
 
 		def write(self, path: str = None):
 			pathToWrite = path
 			if path is None:
 				pathToWrite = self.getPath()
-			rosa.output.write_wav(pathToWrite, self.getData(), self.getSamplingRate())
+			data = self.getData()
+			with instrumentation.recorder.stage("encode") as stage:
+				# always a WAV file of float samples, whatever the extension of the path is
+				soundfile.write(pathToWrite, data, self.getSamplingRate(), format="WAV",
+								subtype="DOUBLE" if data.dtype == np.float64 else "FLOAT")
+				stage.add(samples=len(data), nbytes=os.path.getsize(pathToWrite))
 
 
 		def slice(self, segment: "Audio.AudioSegment"):
-			self.setData(self.getSlicedData(segment))
+			slicedData = self.getRawSlicedData(segment)
+			pending = self.pending
+			shared = self.shared
+			self.setData(slicedData)
+			# a view keeps sharing the buffer of its origin and the operations requested so far
+			self.pending = pending
+			self.shared = shared and self.array.base is not None
+
+	class OperandCache:
+		""" Keeps the resampled and normalized versions of the opponents of Audio.mix, keyed by the identity of the
+		opponent and the target sampling rate. The cached samples are bounded by budget bytes and the least recently
+		used ones are evicted first. Peaks of the opponents are kept as well, so a segment of an opponent which already
+		has the target sampling rate can be normalized without touching the rest of it.
+		"""
+
+		def __init__(self, budget: int = 512 * 1024 * 1024, peakCount: int = 1024):
+			self.budget = budget
+			self.size = 0
+			self.operands = OrderedDict()
+			self.peakCount = peakCount
+			self.peaks = OrderedDict()
+
+		def get(self, other: "Audio", samplingRate: int) -> "Audio":
+			key = (other.impl.id, other.getLength(), samplingRate)
+			if key in self.operands:
+				self.operands.move_to_end(key)
+				return self.operands[key]
+			operand = other.resample(ratio=samplingRate).normalize()
+			nbytes = operand.impl.getData().nbytes
+			if nbytes <= self.budget:
+				self.operands[key] = operand
+				self.size += nbytes
+				while self.size > self.budget:
+					_, evicted = self.operands.popitem(last=False)
+					self.size -= evicted.impl.getData().nbytes
+			return operand
+
+		def peak(self, other: "Audio") -> float:
+			key = (other.impl.id, other.getLength())
+			if key in self.peaks:
+				self.peaks.move_to_end(key)
+				return self.peaks[key]
+			peak = other.impl.getPeak()
+			self.peaks[key] = peak
+			if len(self.peaks) > self.peakCount:
+				self.peaks.popitem(last=False)
+			return peak
+
+		def clear(self):
+			self.operands.clear()
+			self.peaks.clear()
+			self.size = 0
 
 	class Effect:
-		def __init__(self, audio: "Audio", segmentsAsSeconds: List["Audio.AudioSegment"] = None, **options):
+		# "sox" pipes the samples through a sox subprocess, "native" runs the steps in nativeSteps in process
+		backend = "sox"
+		# step value -> (dsp effect, parameter conversions), the conversions are the ones used for the sox chain
+		nativeSteps = {
+			"Equalizer": ("equalizer", {"frequency": int, "q": float, "db": float}),
+			"BandPass": ("bandpass", {"frequency": int, "q": float}),
+			"BandReject": ("bandreject", {"frequency": int, "q": float}),
+			"LowShelf": ("lowshelf", {"slope": float, "gain": float, "frequency": int}),
+			"HighShelf": ("highshelf", {"slope": float, "gain": float, "frequency": int}),
+			"HighPass": ("highpass", {"frequency": int, "q": float}),
+			"LowPass": ("lowpass", {"frequency": int, "q": float}),
+		}
+
+		# step value -> a function appending the sox command of the step to a chain, with the step parameters converted
+		soxSteps = {
+			"Equalizer": lambda chain, options: chain.equalizer(frequency=int(options["frequency"]),
+																q=float(options["q"]), db=float(options["db"])),
+			"BandPass": lambda chain, options: chain.bandpass(frequency=int(options["frequency"]),
+															  q=float(options["q"])),
+			"BandReject": lambda chain, options: chain.bandreject(frequency=int(options["frequency"]),
+																  q=float(options["q"])),
+			"LowShelf": lambda chain, options: chain.lowshelf(slope=float(options["slope"]),
+															  gain=float(options["gain"]),
+															  frequency=int(options["frequency"])),
+			"HighShelf": lambda chain, options: chain.highshelf(slope=float(options["slope"]),
+																gain=float(options["gain"]),
+																frequency=int(options["frequency"])),
+			"HighPass": lambda chain, options: chain.highpass(frequency=int(options["frequency"]),
+															  q=float(options["q"])),
+			"LowPass": lambda chain, options: chain.lowpass(frequency=int(options["frequency"]), q=float(options["q"])),
+			"Limiter": lambda chain, options: chain.limiter(gain=float(options["gain"])),
+			"Compressor": lambda chain, options: chain.compand(attack=float(options["attack"]),
+															   decay=int(options["decay"]),
+															   soft_knee=float(options["soft_knee"]),
+															   threshold=int(options["threshold"]),
+															   db_from=float(options["db_from"]),
+															   db_to=float(options["db_to"])),
+			"Delay": lambda chain, options: chain.delay(gain_in=float(options["gain_in"]),
+														gain_out=float(options["gain_out"]), delays=options["delays"],
+														decays=options["decays"], parallel=options["parallel"]),
+			"Overdrive": lambda chain, options: chain.overdrive(gain=int(options["gain"]),
+																colour=int(options["colour"])),
+			"Phaser": lambda chain, options: chain.phaser(gain_in=float(options["gain_in"]),
+														  gain_out=float(options["gain_out"]),
+														  delay=int(options["delay"]), decay=options["decay"],
+														  speed=int(options["speed"]),
+														  triangular=bool(options["triangular"])),
+			"Pitch": lambda chain, options: chain.pitch(options["shift"], use_tree=options["use_tree"],
+														segment=options["segment"], search=options["search"],
+														overlap=options["overlap"]),
+			"Reverb": lambda chain, options: chain.reverb(reverberance=options["reverberance"],
+														  hf_damping=options["hf_damping"],
+														  room_scale=options["room_scale"],
+														  stereo_depth=options["stereo_depth"],
+														  pre_delay=options["pre_delay"], wet_gain=options["wet_gain"],
+														  wet_only=options["wet_only"]),
+		}
+		# steps which are recorded in a pipeRecipe but do not change the segment an effect is applied to
+		otherSteps = ("Raw", "Mix")
+
+		def __init__(self, audio: "Audio", segmentsAsSeconds: List["Audio.AudioSegment"] = None, backend: str = None,
+					 **options):
 			assert segmentsAsSeconds is None or len(segmentsAsSeconds) > 1
+			assert backend in (None, "sox", "native")
 			self.segment = segmentsAsSeconds[0]
 			self.effectProcessor = AudioEffectsChain()
 			self.audio = audio
 			self.slice = audio.slice(segment=self.segment)
 			self.parameters = options
+			if backend is not None:
+				self.backend = backend
 
+		@instrumentation.recorder.timed("effect", samples=lambda audio: audio.impl.length)
 		def __call__(self, step: "Audio.AugmentationStep.Steps", **options):
-			effectExpression = {
-				Audio.AugmentationStep.Steps.Equalizer:
-					'self.effectProcessor.equalizer(frequency=int(options["frequency"]),q=float(options["q"]),db=float(options["db"]))',
-				Audio.AugmentationStep.Steps.BandPass:
-					'self.effectProcessor.bandpass(frequency=int(options["frequency"]),q=float(options["q"]))',
-				Audio.AugmentationStep.Steps.BandReject:
-					'self.effectProcessor.bandreject(frequency=int(options["frequency"]),q=float(options["q"]))',
-				Audio.AugmentationStep.Steps.LowShelf:
-					'self.effectProcessor.lowshelf(slope=float(options["slope"]),gain=float(options["gain"]),frequency=int(options["frequency"]))',
-				Audio.AugmentationStep.Steps.HighSelf:
-					'self.effectProcessor.highshelf(slope=float(options["slope"]),gain=float(options["gain"]),frequency=int(options["frequency"]))',
-				Audio.AugmentationStep.Steps.HighPass:
-					'self.effectProcessor.highpass(frequency=int(options["frequency"]),q=float(options["q"]))',
-				Audio.AugmentationStep.Steps.LowPass:
-					'self.effectProcessor.lowpass(frequency=int(options["frequency"]),q=float(options["q"]))',
-				Audio.AugmentationStep.Steps.Limiter:
-					'self.effectProcessor.limiter(gain=float(options["gain"]))',
-				Audio.AugmentationStep.Steps.Compressor:
-					'self.effectProcessor.compand(attack=float(options["attack"]),decay=int(options["decay"]),soft_knee=float(options["soft_knee"]),threshold=int(options["threshold"]),db_from=float(options["db_from"]),db_to=float(options["db_to"]))',
-				Audio.AugmentationStep.Steps.Delay:
-					'self.effectProcessor.delay(gain_in=float(options["gain_in"]),gain_out=float(options["gain_out"]),delays=options["delays"],decays=options["decays"],parallel=options["parallel"])',
-				Audio.AugmentationStep.Steps.Overdrive:
-					'self.effectProcessor.overdrive(gain=int(options["gain"]),colour=int(options["colour"]))',
-				Audio.AugmentationStep.Steps.Phaser:
-					'self.effectProcessor.phaser(gain_in=float(options["gain_in"]),gain_out=float(options["gain_out"]),delay=int(options["delay"]),decay=options["decay"],speed=int(options["speed"]),triangular=bool(options["triangular"]))',
-				Audio.AugmentationStep.Steps.Pitch:
-					'self.effectProcessor.pitch(options["shift"],use_tree=options["use_tree"],segment=options["segment"],search=options["search"],overlap=options["overlap"])',
-			}.get(step, "Raw")
-			self.effectProcessor = exec(effectExpression)
-			self.slice.impl.setData(self.effectProcessor(src=self.slice))
+			samplingRate = self.slice.getSamplingRate()
+			if self.backend == "native" and step.value in Audio.Effect.nativeSteps:
+				effect, conversions = Audio.Effect.nativeSteps[step.value]
+				wetData = dsp.apply_effect(self.slice.impl.getData(), samplingRate, effect,
+										   **{name: convert(options[name]) for name, convert in conversions.items()})
+			else:
+				wetData = self.__runSox(step, samplingRate, **options)
+			self.slice.impl.setData(wetData)
 			alignedWetAudio = self.slice.align(
 				Audio.AudioSegment(begin=self.segment.begin, end=self.audio.getDuration()))
 			pipeBuffer = (self.audio + alignedWetAudio)
@@ -249,6 +484,91 @@ class Audio:
 				Audio.AugmentationStep(audio=self.audio, step=step, parameters=self.parameters)())
 			return pipeBuffer
 
+		@instrumentation.recorder.timed("effect", samples=lambda audio: audio.impl.length)
+		def apply(self, steps: List) -> "Audio":
+			""" Applies a whole recipe, a list of AugmentationStep entries as they are kept in pipeRecipe, to the
+			segment with one compiled effect chain, then aligns and adds the wet segment back only once.
+			"""
+			recipe = Audio.EffectRecipe.compile(steps, backend=self.backend)
+			self.slice.impl.setData(recipe(self.slice.impl.getData(), self.slice.getSamplingRate()))
+			alignedWetAudio = self.slice.align(
+				Audio.AudioSegment(begin=self.segment.begin, end=self.audio.getDuration()))
+			pipeBuffer = (self.audio + alignedWetAudio)
+			for _, stepValue, parameters in recipe.steps:
+				pipeBuffer.addPipeMetadata(Audio.AugmentationStep(audio=self.audio,
+																  step=Audio.AugmentationStep.Steps(stepValue),
+																  parameters=parameters)())
+			return pipeBuffer
+
+		def __runSox(self, step: "Audio.AugmentationStep.Steps", samplingRate: int, **options) -> np.ndarray:
+			self.effectProcessor = Audio.Effect.appendStep(AudioEffectsChain(), step, **options)
+			return self.effectProcessor(self.slice.impl.getData(), sample_in=samplingRate)
+
+		@staticmethod
+		def appendStep(chain: AudioEffectsChain, step: "Audio.AugmentationStep.Steps", **options) -> AudioEffectsChain:
+			""" Appends the sox command of a single step to the given chain and returns the chain. """
+			if step.value not in Audio.Effect.soxSteps:
+				raise ValueError("{0} is not an effect step".format(step.value))
+			return Audio.Effect.soxSteps[step.value](chain, options)
+
+	class EffectRecipe:
+		""" A list of AugmentationStep entries compiled into as few effect invocations as possible. Consecutive sox steps
+		become one AudioEffectsChain, so they cost a single sox run, and consecutive native steps become one cascade of
+		second-order sections. Compiled recipes are cached by their content, so files sharing a recipe reuse them.
+		"""
+		cacheSize = 128
+		cache = OrderedDict()
+
+		def __init__(self, steps: List[Tuple[str, str, dict]], backend: str = "sox"):
+			# the steps of the recipe which are effects, e.g. a whole pipeRecipe can be given and its mixes are skipped
+			self.steps = []
+			self.backend = backend
+			# list of ("sox", AudioEffectsChain) or ("native", [(effect, parameters)]) stages
+			self.stages = []
+			self.sections = {}
+			for path, stepValue, parameters in steps:
+				step = Audio.AugmentationStep.Steps(stepValue)
+				if stepValue in Audio.Effect.otherSteps:
+					continue
+				self.steps.append((path, stepValue, parameters))
+				if backend == "native" and stepValue in Audio.Effect.nativeSteps:
+					effect, conversions = Audio.Effect.nativeSteps[stepValue]
+					if not self.stages or self.stages[-1][0] != "native":
+						self.stages.append(("native", []))
+					self.stages[-1][1].append(
+						(effect, {name: convert(parameters[name]) for name, convert in conversions.items()}))
+				else:
+					if not self.stages or self.stages[-1][0] != "sox":
+						self.stages.append(("sox", AudioEffectsChain()))
+					Audio.Effect.appendStep(self.stages[-1][1], step, **parameters)
+
+		@staticmethod
+		def key(steps: List[Tuple[str, str, dict]], backend: str = "sox"):
+			return backend, tuple((stepValue, dumps(parameters, sort_keys=True)) for _, stepValue, parameters in steps)
+
+		@classmethod
+		def compile(cls, steps: List, backend: str = "sox") -> "Audio.EffectRecipe":
+			steps = [step() if isinstance(step, Audio.AugmentationStep) else tuple(step) for step in steps]
+			key = cls.key(steps, backend)
+			if key in cls.cache:
+				cls.cache.move_to_end(key)
+				return cls.cache[key]
+			recipe = cls(steps, backend=backend)
+			cls.cache[key] = recipe
+			if len(cls.cache) > cls.cacheSize:
+				cls.cache.popitem(last=False)
+			return recipe
+
+		def __call__(self, data: np.ndarray, samplingRate: int) -> np.ndarray:
+			for index, (kind, stage) in enumerate(self.stages):
+				if kind == "sox":
+					data = stage(data, sample_in=samplingRate)
+				else:
+					if (index, samplingRate) not in self.sections:
+						self.sections[(index, samplingRate)] = dsp.biquad_sections(stage, samplingRate)
+					data = dsp.apply_sections(data, self.sections[(index, samplingRate)])
+			return data
+
 	def __init__(self, data: AudioImpl, pipeSuffix: str = ""):
 		self.impl = data
 		self.pipeBuffer = self
@@ -290,7 +610,7 @@ class Audio:
 		return self.impl.getSamplingRate()
 
 	def getLength(self) -> int:
-		return len(self.impl.getData())
+		return self.impl.getLength()
 
 	def getDuration(self) -> int:
 		return self.impl.getDuration()
@@ -306,9 +626,9 @@ class Audio:
 		cloneOfThis.impl.fitLength(length=duration * self.getSamplingRate(), method=fittingMethod)
 		return cloneOfThis
 
-	def normalize(self):
+	def normalize(self, peak: float = None):
 		cloneOfThis = self.clone()
-		cloneOfThis.impl.normalize()
+		cloneOfThis.impl.normalize(peak)
 		return cloneOfThis
 
 	def align(self, segment: "Audio.AudioSegment"):
@@ -337,6 +657,7 @@ class Audio:
 	def __add__(self, other: "Audio") -> "Audio":
 		return self.add(other=other)
 
+	@instrumentation.recorder.timed("mix", samples=lambda audio: audio.impl.length)
 	def mix(self, other: "Audio" = None, segmentsAsSeconds: List[AudioSegment] = None, **options) -> "Audio":
 		if other is None:
 			return self.pipeBuffer
@@ -349,10 +670,10 @@ class Audio:
 		if "fittingMethod" not in options:
 			options["fittingMethod"] = Audio.AudioImpl.FittingMethod.Looping.value
 		options["opponent"] = other.impl.getPath()
-		resampledAndNormalizedOther = other.resample(ratio=self.getSamplingRate()).normalize()
 		normalizedMe = self.normalize()
 		pipeBuffer = None
 		if segmentsAsSeconds is None:
+			resampledAndNormalizedOther = Audio.operandCache.get(other, self.getSamplingRate())
 			pipeBuffer = normalizedMe.gain(ratio=options["weightOfMe"]) + \
 						 resampledAndNormalizedOther.fitLength(
 							 length=self.getLength()).gain(ratio=options["weightOfOther"])
@@ -361,28 +682,71 @@ class Audio:
 				segmentsAsSeconds *= 2
 			me = normalizedMe.gain(ratio=options["weightOfMe"])
 			mySlice = me.slice(segment=segmentsAsSeconds[0])
-			othersSlice = resampledAndNormalizedOther.slice(segment=segmentsAsSeconds[1])
+			if other.getSamplingRate() == self.getSamplingRate():
+				# no resampling needed, so only the requested segment of the opponent is normalized
+				othersSlice = Audio(data=Audio.AudioImpl(
+					array=other.impl.getSlicedData(segmentsAsSeconds[1]) / Audio.operandCache.peak(other),
+					samplingRate=other.getSamplingRate(), path=other.impl.getPath()))
+			else:
+				othersSlice = Audio.operandCache.get(other, self.getSamplingRate()).slice(
+					segment=segmentsAsSeconds[1])
 			othersFit = othersSlice.fitLength(length=segmentsAsSeconds[0].getRange(),
 											  fittingMethod=Audio.AudioImpl.FittingMethod(options["fittingMethod"]))
 			othersNormalized = othersFit.gain(ratio=options["weightOfOther"])
-			mixOfUs = mySlice + othersNormalized
-			alignedMix = mixOfUs.align(Audio.AudioSegment(begin=segmentsAsSeconds[0].begin, end=me.getDuration()))
-			pipeBuffer = (me + alignedMix).normalize()
+			pipeBuffer = self.__mixSegment(me=me, mySlice=mySlice, other=othersNormalized,
+										   segment=segmentsAsSeconds[0])
+			if pipeBuffer is None:
+				mixOfUs = mySlice + othersNormalized
+				alignedMix = mixOfUs.align(Audio.AudioSegment(begin=segmentsAsSeconds[0].begin, end=me.getDuration()))
+				pipeBuffer = (me + alignedMix).normalize()
 		pipeBuffer.addPipeMetadata(step())
 		return pipeBuffer
 
-	def write(self, customPath: str = None, description: bool = True):
+	def __mixSegment(self, me: "Audio", mySlice: "Audio", other: "Audio", segment: "Audio.AudioSegment") -> "Audio":
+		""" Fused form of (me + (mySlice + other).align(segment)).normalize(). The fitted window of the opponent is added
+		into a single output buffer over the segment range only, instead of building full length temporaries for the
+		aligned mix. Returns None when the lengths do not line up, so the step by step form raises as it always did.
+		"""
+		samplingRate = me.getSamplingRate()
+		fittedOther = other.fitLength(length=mySlice.getLength(), fittingMethod=Audio.AudioImpl.FittingMethod.Looping)
+		if fittedOther.getLength() != mySlice.getLength():
+			return None
+		alignment = Audio.AudioSegment(begin=segment.begin, end=me.getDuration())
+		if alignment.getRange(samplingRate) < mySlice.getLength() or \
+				alignment.getEnd(samplingRate) != me.getLength():
+			return None
+		begin = alignment.getBegin(samplingRate)
+		output = me.impl.getWritableData()
+		window = output[begin:begin + mySlice.getLength()]
+		# me + (me + other) over the segment, in the same order of additions as the step by step form
+		np.add(window, window + fittedOther.impl.getData(), out=window)
+		return Audio(data=Audio.AudioImpl(samplingRate=samplingRate, array=output, path=self.impl.getPath())).normalize()
+
+	@instrumentation.recorder.timed("write")
+	def write(self, customPath: str = None, description: bool = True, shardWriter=None):
+		""" Writes the sound, and its recipe when description is set, next to the origin or to customPath. When a
+		shards.ShardWriter is given, they are added to its current shard instead, under the key of the path they
+		would have been written to, and the key is returned in place of the path.
+		"""
 		path = customPath if customPath is not None else os.path.dirname(self.impl.getPath())
 		path += "/"
 		name, extension = os.path.splitext(self.pipeBuffer.impl.getPath())
 		name = os.path.basename(name)
 		audioPath = path + name + self.pipeSuffix + extension
+		if shardWriter is not None:
+			key = shardWriter.keyOf(audioPath)
+			shardWriter.addAudio(key, self.pipeBuffer.impl.getData(), self.pipeBuffer.getSamplingRate(),
+								 self.getPipeRecipe() if description else None)
+			return key
 		self.pipeBuffer.impl.write(audioPath)
 		if description:
 			descriptionPath = path + name + self.pipeSuffix + ".json"
 			with open(descriptionPath, 'w') as fp:
 				dump(obj={"Steps": self.getPipeRecipe()}, fp=fp)
+		return audioPath
+
 
+Audio.operandCache = Audio.OperandCache()
 
 # audio1 = Audio(data=Audio.AudioImpl(path="sumeyracenet.wav"))
 # audio2 = Audio(data=Audio.AudioImpl(path="cagrisesi.wav"))
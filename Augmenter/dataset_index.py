@@ -0,0 +1,103 @@
+import json
+import os
+from collections import namedtuple
+from typing import Iterator, List, Tuple
+
+from Augmenter.Augmenter import Audio
+
+# a single sound file of a dataset. speaker is the top level directory the file is under, or None for the files in
+# the root of the dataset, relpath is relative to the root and format is the extension without the dot
+DatasetRecord = namedtuple("DatasetRecord", ["speaker", "relpath", "format", "samplingRate", "frames", "size", "mtime"])
+
+
+class DatasetIndex:
+	""" The sound files of a dataset and their header information, gathered by a single os.scandir pass over the
+	directory tree. Files are listed in the order os.walk would visit them: the files of a directory first, then the
+	ones of its subdirectories, in directory order.
+
+	The index can be saved as a manifest and refreshed from it later, in which case only the files whose size or
+	modification time changed have their header read again.
+	"""
+	soundExtensions = frozenset((".wav", ".mp3", ".flac"))
+
+	def __init__(self, root: str, records: List[DatasetRecord]):
+		self.root = root
+		self.records = records
+
+	@staticmethod
+	def scanFiles(root: str) -> Iterator[Tuple[str, os.DirEntry]]:
+		""" Yields (relative path, directory entry) of every sound file under root, in os.walk order. """
+		directories = [""]
+		while directories:
+			relativeDirectory = directories.pop()
+			subdirectories = []
+			with os.scandir(os.path.join(root, relativeDirectory)) as entries:
+				for entry in entries:
+					relativePath = os.path.join(relativeDirectory, entry.name)
+					if entry.is_dir():
+						subdirectories.append(relativePath)
+					elif os.path.splitext(entry.name)[1].lower() in DatasetIndex.soundExtensions:
+						yield relativePath, entry
+			# popped from the end, so the first subdirectory is visited first
+			directories.extend(reversed(subdirectories))
+
+	@staticmethod
+	def listFiles(root: str) -> List[str]:
+		""" Paths of the sound files under root, without reading their headers. """
+		return [os.path.join(root, relativePath) for relativePath, _ in DatasetIndex.scanFiles(root)]
+
+	@classmethod
+	def scan(cls, root: str, previous: "DatasetIndex" = None) -> "DatasetIndex":
+		""" Indexes the sound files under root. The header information of a file is taken from previous when its
+		size and modification time did not change, and read from the file otherwise.
+		"""
+		known = {}
+		if previous is not None and os.path.abspath(previous.root) == os.path.abspath(root):
+			known = {record.relpath: record for record in previous.records}
+		records = []
+		for relativePath, entry in cls.scanFiles(root):
+			stat = entry.stat()
+			record = known.get(relativePath)
+			if record is None or record.size != stat.st_size or record.mtime != stat.st_mtime_ns:
+				samplingRate, frames = Audio.AudioImpl.readHeader(entry.path)
+				parts = relativePath.split(os.sep)
+				record = DatasetRecord(speaker=parts[0] if len(parts) > 1 else None, relpath=relativePath,
+									   format=os.path.splitext(entry.name)[1][1:].lower(), samplingRate=samplingRate,
+									   frames=frames, size=stat.st_size, mtime=stat.st_mtime_ns)
+			records.append(record)
+		return cls(root, records)
+
+	@classmethod
+	def load(cls, manifestPath: str) -> "DatasetIndex":
+		with open(manifestPath) as fp:
+			manifest = json.load(fp)
+		return cls(manifest["root"], [DatasetRecord(*row) for row in manifest["records"]])
+
+	def save(self, manifestPath: str):
+		""" Writes the index as a manifest, one row per file with the fields of DatasetRecord in order. """
+		with open(manifestPath + ".tmp", "w") as fp:
+			json.dump({"root": os.path.abspath(self.root), "fields": DatasetRecord._fields,
+					   "records": [list(record) for record in self.records]}, fp, separators=(",", ":"))
+		os.replace(manifestPath + ".tmp", manifestPath)
+
+	@classmethod
+	def loadOrScan(cls, root: str, manifestPath: str = None) -> "DatasetIndex":
+		""" Refreshes the manifest at manifestPath against root, creating it when it does not exist yet. Without a
+		manifest path the dataset is scanned from scratch and nothing is written.
+		"""
+		if manifestPath is None:
+			return cls.scan(root)
+		previous = cls.load(manifestPath) if os.path.exists(manifestPath) else None
+		index = cls.scan(root, previous)
+		index.save(manifestPath)
+		return index
+
+	def getPath(self, record: DatasetRecord) -> str:
+		return os.path.join(self.root, record.relpath)
+
+	def getDuration(self, record: DatasetRecord) -> float:
+		return record.frames / float(record.samplingRate)
+
+	def speakerRecords(self) -> List[DatasetRecord]:
+		""" The files that are under a speaker directory, the ones in the root of the dataset are left out. """
+		return [record for record in self.records if record.speaker is not None]
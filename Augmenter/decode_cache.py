@@ -0,0 +1,172 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from typing import Tuple
+
+import librosa as rosa
+import numpy as np
+
+try:
+	import fcntl
+except ImportError:  # not available on windows, eviction is then not serialized between processes
+	fcntl = None
+
+
+class DecodeCache:
+	""" Decoded float32 mono samples of sound files, kept on disk as .npy files which are memory-mapped when read. An
+	entry is keyed by the absolute path, the size and the modification time of the sound file and the sampling rate it
+	was decoded at, so a changed file is decoded again instead of being served stale.
+
+	Any number of processes can share a cache directory: entries are written to a temporary file and renamed into
+	place, so a reader sees either no entry or a complete one, and the least recently used entries are evicted under
+	a lock once the cache grows beyond budget bytes. An entry which is evicted while it is mapped stays readable until
+	it is unmapped.
+	"""
+	extension = ".npy"
+
+	def __init__(self, directory: str, budget: int = 4 * 1024 * 1024 * 1024):
+		os.makedirs(directory, exist_ok=True)
+		self.directory = directory
+		self.budget = budget
+		# bytes in the cache as of the last scan plus the bytes this process wrote since then
+		self.size = None
+		self.hits = 0
+		self.misses = 0
+
+	@staticmethod
+	def keyOf(path: str, samplingRate: int) -> str:
+		stat = os.stat(path)
+		key = "{0}|{1}|{2}|{3}".format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns, samplingRate)
+		return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+	def entryPath(self, key: str) -> str:
+		return os.path.join(self.directory, key + self.extension)
+
+	def get(self, path: str, samplingRate: int) -> np.ndarray:
+		""" Returns the cached samples as a read-only memory map, or None on a miss. """
+		entryPath = self.entryPath(self.keyOf(path, samplingRate))
+		try:
+			data = np.load(entryPath, mmap_mode="r")
+			# the modification time of an entry is the time it was last used
+			os.utime(entryPath)
+		except (FileNotFoundError, ValueError):
+			# ValueError: an entry which was evicted between np.load opening and mapping it
+			return None
+		return data
+
+	def put(self, path: str, samplingRate: int, data: np.ndarray):
+		data = np.ascontiguousarray(data, dtype=np.float32)
+		handle, temporaryPath = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+		try:
+			with os.fdopen(handle, "wb") as fp:
+				np.save(fp, data)
+			os.replace(temporaryPath, self.entryPath(self.keyOf(path, samplingRate)))
+		except BaseException:
+			os.remove(temporaryPath)
+			raise
+		if self.size is not None:
+			self.size += data.nbytes
+		if self.size is None or self.size > self.budget:
+			self.evict()
+
+	def load(self, path: str, samplingRate: int) -> Tuple[np.ndarray, int]:
+		""" The cached counterpart of rosa.load(path, sr=samplingRate, mono=True), decoding and storing on a miss. """
+		data = self.get(path, samplingRate)
+		if data is not None:
+			self.hits += 1
+			return data, samplingRate
+		self.misses += 1
+		data, samplingRate = rosa.load(path, sr=samplingRate, mono=True)
+		self.put(path, samplingRate, data)
+		return data, samplingRate
+
+	def evict(self):
+		""" Removes the least recently used entries until the cache is back to 90% of its budget. """
+		with open(os.path.join(self.directory, ".lock"), "a") as lock:
+			if fcntl is not None:
+				fcntl.flock(lock, fcntl.LOCK_EX)
+			entries = []
+			for entry in os.scandir(self.directory):
+				if entry.name.endswith(self.extension):
+					try:
+						stat = entry.stat()
+					except FileNotFoundError:
+						continue
+					entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+			self.size = sum(size for _, size, _ in entries)
+			if self.size > self.budget:
+				for _, size, entryPath in sorted(entries):
+					if self.size <= self.budget * 0.9:
+						break
+					try:
+						os.remove(entryPath)
+					except FileNotFoundError:
+						pass
+					self.size -= size
+
+	def clear(self):
+		for entry in os.scandir(self.directory):
+			if entry.name.endswith(self.extension):
+				os.remove(entry.path)
+		self.size = 0
+
+
+# cache of the current warm-up process
+_warmCache = None
+
+
+def _initWarmWorker(directory: str, budget: int):
+	global _warmCache
+	_warmCache = DecodeCache(directory, budget)
+
+
+def _warmFile(job: Tuple[str, int]) -> bool:
+	from Augmenter.Augmenter import Audio
+	path, samplingRate = job
+	try:
+		if samplingRate is None:
+			samplingRate, _ = Audio.AudioImpl.readHeader(path)
+		_warmCache.load(path, samplingRate)
+		return True
+	except Exception as e:
+		print("\nError: ", e)
+		print("filename: {0}".format(path))
+		return False
+
+
+def warm(soundPath: str, directory: str, samplingRates=None, budget: int = 4 * 1024 * 1024 * 1024,
+		 workerCount: int = 1) -> int:
+	""" Decodes every sound file under soundPath into the cache, once per sampling rate, at the native sampling rate
+	of the file when no sampling rates are given. Returns the number of files decoded or already cached.
+	"""
+	from Augmenter.noise_bank import NoiseBank
+	jobs = [(path, samplingRate) for path in NoiseBank.listFiles(soundPath) for samplingRate in samplingRates or [None]]
+	if workerCount is None or workerCount <= 1:
+		_initWarmWorker(directory, budget)
+		return sum(map(_warmFile, jobs))
+	with multiprocessing.Pool(processes=workerCount, initializer=_initWarmWorker, initargs=(directory, budget)) as pool:
+		return sum(pool.imap_unordered(_warmFile, jobs, chunksize=max(1, len(jobs) // (workerCount * 16))))
+
+
+def main():
+	ap = argparse.ArgumentParser(description="decodes the sound files of a directory into a decode cache")
+	ap.add_argument("-dp", "--dataset-path", required=True, help="the directory of the sound files, walked recursively")
+	ap.add_argument("-dc", "--decode-cache-dir", required=True, help="the directory of the decode cache")
+	ap.add_argument("-sr", "--sampling-rates", required=False,
+					help="sampling rates separated by , to decode at, defaults to the native rate of every file")
+	ap.add_argument("-cs", "--cache-size-mb", required=False, type=float, default=4096,
+					help="the size of the cache in megabytes, least recently used entries are evicted beyond it")
+	ap.add_argument("-wo", "--worker-count", required=False, type=int, default=1,
+					help="number of processes that decode the sounds")
+	args = vars(ap.parse_args())
+
+	samplingRates = None if args["sampling_rates"] is None else [int(x) for x in args["sampling_rates"].split(",")]
+	count = warm(args["dataset_path"], args["decode_cache_dir"], samplingRates,
+				 budget=int(args["cache_size_mb"] * 1024 * 1024), workerCount=args["worker_count"])
+	print("{0} decoded sounds in {1}".format(count, args["decode_cache_dir"]))
+
+
+if __name__ == "__main__":
+	main()
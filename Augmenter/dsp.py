@@ -0,0 +1,108 @@
+import math
+
+import numpy as np
+from scipy.signal import lfilter, sosfilt
+
+# effects that can run in process instead of piping the samples through a sox subprocess. The names are the ones of
+# the AudioEffectsChain methods, and every effect takes the same parameters that method does.
+NATIVE_EFFECTS = ("equalizer", "bandpass", "bandreject", "lowshelf", "highshelf", "highpass", "lowpass")
+
+
+def biquad_coefficients(effect, sr, frequency, q=0.707, db=0.0, gain=0.0, slope=0.5):
+    """ Designs the biquad sox uses for the given effect, following the formulas of sox's biquads.c (which are the
+    ones of the Audio EQ Cookbook).
+
+    Parameters
+    ----------
+    effect: one of NATIVE_EFFECTS
+    sr: sampling rate of the sound the filter will be applied to
+    frequency: center, corner or shelf frequency in Hz
+    q: quality factor, used by every effect except the shelves
+    db: gain of the equalizer in dB
+    gain: gain of the shelves in dB
+    slope: slope of the shelves
+
+    Returns
+    -------
+    (b, a) coefficients, normalized by a0
+    """
+    w0 = 2 * math.pi * frequency / sr
+    cos_w0 = math.cos(w0)
+    alpha = math.sin(w0) / (2 * q)
+
+    if effect == "equalizer":
+        amplitude = 10 ** (db / 40.0)
+        b = [1 + alpha * amplitude, -2 * cos_w0, 1 - alpha * amplitude]
+        a = [1 + alpha / amplitude, -2 * cos_w0, 1 - alpha / amplitude]
+    elif effect == "bandpass":
+        b = [alpha, 0.0, -alpha]
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    elif effect == "bandreject":
+        b = [1.0, -2 * cos_w0, 1.0]
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    elif effect == "lowpass":
+        b = [(1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2]
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    elif effect == "highpass":
+        b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    elif effect in ("lowshelf", "highshelf"):
+        amplitude = 10 ** (gain / 40.0)
+        alpha = math.sin(w0) / 2 * math.sqrt((amplitude + 1 / amplitude) * (1 / slope - 1) + 2)
+        shelf = 2 * math.sqrt(amplitude) * alpha
+        sign = 1 if effect == "lowshelf" else -1
+        b = [amplitude * ((amplitude + 1) - sign * (amplitude - 1) * cos_w0 + shelf),
+             sign * 2 * amplitude * ((amplitude - 1) - sign * (amplitude + 1) * cos_w0),
+             amplitude * ((amplitude + 1) - sign * (amplitude - 1) * cos_w0 - shelf)]
+        a = [(amplitude + 1) + sign * (amplitude - 1) * cos_w0 + shelf,
+             -sign * 2 * ((amplitude - 1) + sign * (amplitude + 1) * cos_w0),
+             (amplitude + 1) + sign * (amplitude - 1) * cos_w0 - shelf]
+    else:
+        raise ValueError("{0} is not supported by the native backend".format(effect))
+
+    b = np.asarray(b) / a[0]
+    a = np.asarray(a) / a[0]
+    return b, a
+
+
+def apply_effect(sound_data, sr, effect, **parameters):
+    """ Applies a sox compatible biquad effect to the sound data in process.
+
+    Parameters
+    ----------
+    sound_data: sound file that is represented as array
+    sr: sampling rate of the sound data
+    effect: one of NATIVE_EFFECTS
+    parameters: parameters of the AudioEffectsChain method with the same name
+
+    Returns
+    -------
+    filtered sound data, with the dtype of the input
+    """
+    b, a = biquad_coefficients(effect, sr, **parameters)
+    return lfilter(b, a, sound_data).astype(sound_data.dtype, copy=False)
+
+
+def biquad_sections(effects, sr):
+    """ Stacks the biquads of several effects into second-order sections, so that a whole chain of them is applied
+    with a single sosfilt call.
+
+    Parameters
+    ----------
+    effects: list of (effect, parameters) tuples, effect being one of NATIVE_EFFECTS
+    sr: sampling rate of the sound the chain will be applied to
+
+    Returns
+    -------
+    sos array of shape (len(effects), 6)
+    """
+    sections = []
+    for effect, parameters in effects:
+        b, a = biquad_coefficients(effect, sr, **parameters)
+        sections.append(np.concatenate((b, a)))
+    return np.asarray(sections).reshape(-1, 6)
+
+
+def apply_sections(sound_data, sos):
+    """ Applies second-order sections built by biquad_sections, keeping the dtype of the input. """
+    return sosfilt(sos, sound_data).astype(sound_data.dtype, copy=False)
@@ -0,0 +1,171 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # windows, the peak memory of the processes is not reported then
+    resource = None
+
+# the fields kept for every stage, in the order of the lists in StageRecorder.stages
+STAGE_FIELDS = ("calls", "seconds", "samples", "bytes", "max_seconds")
+
+
+def peak_rss():
+    """ The peak resident memory of the current process in bytes, or None when it is not known. """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _Stage:
+    __slots__ = ("recorder", "name", "begin", "samples", "bytes")
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.samples = 0
+        self.bytes = 0
+
+    def add(self, samples=0, nbytes=0):
+        self.samples += samples
+        self.bytes += nbytes
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.recorder.record(self.name, time.perf_counter() - self.begin, self.samples, self.bytes)
+
+
+class StageRecorder:
+    """ Wall time, call count, samples and bytes of named stages, e.g. decode, resample, mix, effect and write, and
+    the peak memory of the processes that ran them. A stage costs two clock reads and a locked dict update, so the
+    recorder is always on. Stages can nest, e.g. the decode of a lazily loaded opponent is part of a mix, and the
+    time of a stage includes the stages inside it.
+
+    Worker processes send snapshot(reset=True) of their recorder back with their results, and the parent merges them,
+    so the totals of a run cover every process exactly once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.peaks = {}
+
+    def stage(self, name):
+        """ A context manager that records the time of its block as the stage name, see _Stage.add for samples. """
+        return _Stage(self, name)
+
+    def timed(self, name, samples=None):
+        """ Decorator that records every call of the function as the stage name, and the samples of its result when
+        a samples function is given.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                begin = time.perf_counter()
+                result = function(*args, **kwargs)
+                self.record(name, time.perf_counter() - begin, samples(result) if samples is not None else 0)
+                return result
+            return wrapper
+        return decorator
+
+    def record(self, name, seconds, samples=0, nbytes=0):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = [0, 0.0, 0, 0, 0.0]
+            stage[0] += 1
+            stage[1] += seconds
+            stage[2] += samples
+            stage[3] += nbytes
+            stage[4] = max(stage[4], seconds)
+
+    def snapshot(self, reset=False):
+        """ The recorded stages and peak memory as plain data that can be sent between processes. """
+        peak = peak_rss()
+        with self.lock:
+            if peak is not None:
+                self.peaks[str(os.getpid())] = max(peak, self.peaks.get(str(os.getpid()), 0))
+            snapshot = {"stages": {name: list(stage) for name, stage in self.stages.items()},
+                        "peaks": dict(self.peaks)}
+            if reset:
+                self.stages = {}
+                self.peaks = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        with self.lock:
+            for name, (calls, seconds, samples, nbytes, max_seconds) in snapshot["stages"].items():
+                stage = self.stages.get(name)
+                if stage is None:
+                    stage = self.stages[name] = [0, 0.0, 0, 0, 0.0]
+                stage[0] += calls
+                stage[1] += seconds
+                stage[2] += samples
+                stage[3] += nbytes
+                stage[4] = max(stage[4], max_seconds)
+            for pid, peak in snapshot["peaks"].items():
+                self.peaks[pid] = max(peak, self.peaks.get(pid, 0))
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.peaks = {}
+
+    def report(self):
+        snapshot = self.snapshot()
+        for name, (calls, seconds, samples, nbytes, max_seconds) in sorted(snapshot["stages"].items()):
+            print("{0}: {1} calls, {2:.2f}s, {3:.2f}ms per call, {4:.2f}s longest, {5} samples, {6:.1f} MB".format(
+                name, calls, seconds, 1000 * seconds / calls if calls else 0, max_seconds, samples, nbytes / 2 ** 20))
+        if snapshot["peaks"]:
+            print("peak memory: {0:.1f} MB in the largest of {1} processes".format(
+                max(snapshot["peaks"].values()) / 2 ** 20, len(snapshot["peaks"])))
+
+    def to_json(self, path, **run):
+        """ Writes the run report: the run information given as keyword arguments, every stage and the peak memory
+        of every process.
+        """
+        snapshot = self.snapshot()
+        report = dict(run)
+        report["stages"] = {name: dict(zip(STAGE_FIELDS, stage)) for name, stage in snapshot["stages"].items()}
+        report["peakMemory"] = snapshot["peaks"]
+        with open(path + ".tmp", "w") as fp:
+            json.dump(report, fp, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def to_prometheus(self, path, prefix="augmenter"):
+        """ Writes the stages in the Prometheus text format, e.g. for the textfile collector of node_exporter. """
+        snapshot = self.snapshot()
+        metrics = [("calls_total", "counter", "Number of times the stage ran", 0),
+                   ("seconds_total", "counter", "Wall time spent in the stage", 1),
+                   ("samples_total", "counter", "Samples processed by the stage", 2),
+                   ("bytes_total", "counter", "Bytes read or written by the stage", 3),
+                   ("max_seconds", "gauge", "Longest single run of the stage", 4)]
+        lines = []
+        for suffix, kind, description, field in metrics:
+            name = "{0}_stage_{1}".format(prefix, suffix)
+            lines.append("# HELP {0} {1}".format(name, description))
+            lines.append("# TYPE {0} {1}".format(name, kind))
+            for stage, values in sorted(snapshot["stages"].items()):
+                lines.append('{0}{{stage="{1}"}} {2}'.format(name, stage, values[field]))
+        if snapshot["peaks"]:
+            name = "{0}_process_peak_rss_bytes".format(prefix)
+            lines.append("# HELP {0} Peak resident memory of a process of the run".format(name))
+            lines.append("# TYPE {0} gauge".format(name))
+            for pid, peak in sorted(snapshot["peaks"].items()):
+                lines.append('{0}{{pid="{1}"}} {2}'.format(name, pid, peak))
+        with open(path + ".tmp", "w") as fp:
+            fp.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+
+# the recorder of the current process
+recorder = StageRecorder()
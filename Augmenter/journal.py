@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import random
+from typing import List
+
+
+class CompletionJournal:
+	""" Append-only record of the (input, recipe) pairs a run has finished and the outputs written for them, so that a
+	run which is interrupted, or started again over an updated dataset, only does the work that is missing.
+
+	The journal is a JSON lines file. Its first line keeps the seed of the run, which makes the random choices of a
+	resumed run the same as the ones of the run that was interrupted, and every other line is a {"key", "outputs"}
+	record. A record is written once its outputs are complete, and a half written last line, e.g. of a run that was
+	killed, is ignored when the journal is read.
+	"""
+
+	def __init__(self, path: str, seed: int = None):
+		""" Opens the journal at path, creating it when it does not exist. The seed of an existing journal is kept
+		unless another one is given, and a new journal without a seed draws one.
+		"""
+		self.path = path
+		self.done = {}
+		self.seed = None
+		if os.path.exists(path):
+			with open(path) as fp:
+				for line in fp:
+					try:
+						entry = json.loads(line)
+					except ValueError:
+						continue
+					if "seed" in entry:
+						self.seed = entry["seed"]
+					else:
+						self.done[entry["key"]] = entry["outputs"]
+		directory = os.path.dirname(path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		self.fp = open(path, "a")
+		if self.fp.tell() > 0:
+			with open(path, "rb") as fp:
+				fp.seek(-1, os.SEEK_END)
+				if fp.read(1) != b"\n":
+					# the next record must not be glued to a half written line
+					self.fp.write("\n")
+		if seed is None and self.seed is None:
+			seed = random.randrange(2 ** 32)
+		if seed is not None and seed != self.seed:
+			self.seed = seed
+			self.append({"seed": seed})
+
+	@staticmethod
+	def keyOf(inputPath: str, recipe) -> str:
+		""" The key of an input file and the recipe it is processed with. Changing the file, i.e. its size or its
+		modification time, or any part of the json serializable recipe gives another key.
+		"""
+		stat = os.stat(inputPath)
+		key = json.dumps([os.path.abspath(inputPath), stat.st_size, stat.st_mtime_ns, recipe], sort_keys=True)
+		return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+	def isDone(self, key: str) -> bool:
+		return key in self.done
+
+	def getOutputs(self, key: str) -> List[str]:
+		return self.done.get(key)
+
+	def getSeed(self) -> int:
+		return self.seed
+
+	def record(self, key: str, outputs: List[str]):
+		self.done[key] = outputs
+		self.append({"key": key, "outputs": outputs})
+
+	def append(self, entry: dict):
+		# a line is flushed as soon as it is written, so a crash loses at most the line being written
+		self.fp.write(json.dumps(entry) + "\n")
+		self.fp.flush()
+
+	def close(self):
+		self.fp.close()
+
+	def __enter__(self) -> "CompletionJournal":
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,166 @@
+import json
+import os
+import tempfile
+from typing import List
+
+import numpy as np
+
+from Augmenter.Augmenter import Audio
+from Augmenter.dataset_index import DatasetIndex
+
+
+class NoiseBank:
+	""" Decoded noise samples of a single sampling rate. The samples of every noise file are stored back to back as
+	float32 in one file, which is memory-mapped when the bank is opened, and an index keeps the (file, start, length)
+	entry of every noise file in it.
+	"""
+	def __init__(self, directory: str, samplingRate: int, array: np.ndarray, entries: List[dict]):
+		self.directory = directory
+		self.samplingRate = samplingRate
+		self.array = array
+		self.entries = entries
+		self.energy = None
+
+	@staticmethod
+	def dataPath(directory: str, samplingRate: int) -> str:
+		return os.path.join(directory, "noise_{0}.f32".format(samplingRate))
+
+	@staticmethod
+	def indexPath(directory: str, samplingRate: int) -> str:
+		return os.path.join(directory, "noise_{0}.json".format(samplingRate))
+
+	@staticmethod
+	def energyPath(directory: str, samplingRate: int) -> str:
+		return os.path.join(directory, "noise_{0}.energy".format(samplingRate))
+
+	@staticmethod
+	def listFiles(noisePath: str) -> List[str]:
+		""" The noise files under noisePath in the order they are concatenated: sorted by their path relative to
+		noisePath with / separators, so the concatenation, and every noise window picked from it, is the same on every
+		file system and operating system.
+		"""
+		return sorted(DatasetIndex.listFiles(noisePath),
+					  key=lambda path: os.path.relpath(path, noisePath).replace(os.sep, "/"))
+
+	@staticmethod
+	def describeFiles(noisePath: str) -> List[dict]:
+		described = []
+		for path in NoiseBank.listFiles(noisePath):
+			stat = os.stat(path)
+			described.append({"file": path, "size": stat.st_size, "mtime": stat.st_mtime_ns})
+		return described
+
+	@classmethod
+	def build(cls, noisePath: str, directory: str, samplingRate: int) -> "NoiseBank":
+		""" Decodes every noise file once at the given sampling rate and appends its samples to the bank file, so the
+		build is linear in the total noise length.
+		"""
+		os.makedirs(directory, exist_ok=True)
+		dataPath = cls.dataPath(directory, samplingRate)
+		indexPath = cls.indexPath(directory, samplingRate)
+		energyPath = cls.energyPath(directory, samplingRate)
+		entries = []
+		start = 0
+		# written to temporary files of their own and renamed into place, so builders of the same bank running at the
+		# same time do not write into each other's files
+		dataHandle, temporaryDataPath = tempfile.mkstemp(suffix=".tmp", dir=directory)
+		indexHandle, temporaryIndexPath = tempfile.mkstemp(suffix=".tmp", dir=directory)
+		try:
+			with os.fdopen(dataHandle, "wb") as fp:
+				for entry in cls.describeFiles(noisePath):
+					data, _ = Audio.AudioImpl.decode(entry["file"], samplingRate)
+					data = np.ascontiguousarray(data, dtype=np.float32)
+					fp.write(data.tobytes())
+					entry["start"] = start
+					entry["length"] = len(data)
+					entries.append(entry)
+					start += len(data)
+			with os.fdopen(indexHandle, "w") as fp:
+				json.dump({"source": os.path.abspath(noisePath), "samplingRate": samplingRate, "length": start,
+						   "entries": entries}, fp)
+			# the energy index of the previous samples is stale, it is built again when it is asked for
+			try:
+				os.remove(energyPath)
+			except FileNotFoundError:
+				pass
+			os.replace(temporaryDataPath, dataPath)
+			os.replace(temporaryIndexPath, indexPath)
+		except BaseException:
+			for temporaryPath in (temporaryDataPath, temporaryIndexPath):
+				if os.path.exists(temporaryPath):
+					os.remove(temporaryPath)
+			raise
+		return cls.open(directory, samplingRate)
+
+	@classmethod
+	def open(cls, directory: str, samplingRate: int) -> "NoiseBank":
+		with open(cls.indexPath(directory, samplingRate)) as fp:
+			index = json.load(fp)
+		if index["length"] == 0:
+			array = np.zeros(0, dtype=np.float32)
+		else:
+			array = np.memmap(cls.dataPath(directory, samplingRate), dtype=np.float32, mode="r",
+							  shape=(index["length"],))
+		return cls(directory=directory, samplingRate=samplingRate, array=array, entries=index["entries"])
+
+	@classmethod
+	def isUpToDate(cls, noisePath: str, directory: str, samplingRate: int) -> bool:
+		indexPath = cls.indexPath(directory, samplingRate)
+		if not (os.path.exists(indexPath) and os.path.exists(cls.dataPath(directory, samplingRate))):
+			return False
+		with open(indexPath) as fp:
+			index = json.load(fp)
+		built = [(x["file"], x["size"], x["mtime"]) for x in index["entries"]]
+		current = [(x["file"], x["size"], x["mtime"]) for x in cls.describeFiles(noisePath)]
+		return index["source"] == os.path.abspath(noisePath) and built == current
+
+	@classmethod
+	def openOrBuild(cls, noisePath: str, directory: str, samplingRate: int) -> "NoiseBank":
+		if cls.isUpToDate(noisePath, directory, samplingRate):
+			return cls.open(directory, samplingRate)
+		return cls.build(noisePath, directory, samplingRate)
+
+	def getSamplingRate(self) -> int:
+		return self.samplingRate
+
+	def getLength(self) -> int:
+		return len(self.array)
+
+	def getDuration(self) -> float:
+		return self.getLength() / float(self.samplingRate)
+
+	def getEntries(self) -> List[dict]:
+		return self.entries
+
+	def energyIndex(self) -> np.ndarray:
+		""" The memory-mapped cumulative energy of the bank, energyIndex()[i] being the energy of the first i samples,
+		see tool_kit.energy_index. It is float64, so twice the size of the bank, and is only written next to the bank
+		the first time it is asked for, e.g. by an SNR-targeted mix.
+		"""
+		if self.energy is None:
+			energyPath = self.energyPath(self.directory, self.samplingRate)
+			size = (self.getLength() + 1) * np.dtype(np.float64).itemsize
+			if not os.path.exists(energyPath) or os.path.getsize(energyPath) != size:
+				self.buildEnergyIndex(energyPath)
+			self.energy = np.memmap(energyPath, dtype=np.float64, mode="r", shape=(self.getLength() + 1,))
+		return self.energy
+
+	def buildEnergyIndex(self, energyPath: str, blockSize: int = 1024 * 1024):
+		# written block by block to a temporary file and renamed into place, so processes building it at the same
+		# time only duplicate the work
+		handle, temporaryPath = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+		totalEnergy = 0.0
+		with os.fdopen(handle, "wb") as fp:
+			fp.write(np.zeros(1).tobytes())
+			for begin in range(0, self.getLength(), blockSize):
+				energy = totalEnergy + np.cumsum(np.square(self.array[begin:begin + blockSize], dtype=np.float64))
+				fp.write(energy.tobytes())
+				totalEnergy = energy[-1]
+		os.replace(temporaryPath, energyPath)
+
+	def toAudio(self) -> Audio:
+		""" The bank as an Audio whose samples are the memory map, the samples were validated when they were decoded
+		into the bank, so they are not read here, only the windows mixed from them are.
+		"""
+		path = self.entries[0]["file"] if self.entries else self.dataPath(self.directory, self.samplingRate)
+		return Audio(data=Audio.AudioImpl(array=self.array, samplingRate=self.samplingRate, path=path, validate=False))
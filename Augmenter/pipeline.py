@@ -0,0 +1,141 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PipelineMetrics:
+    """ What the stages of run_pipeline spent their time on. The compute stage waiting for reads means the reads are
+    the bottleneck, waiting for writes means the writes are, and the depth of the queues shows how full they were
+    every time the compute stage took an item. Metrics of several pipelines, e.g. of every worker, can be merged.
+    """
+
+    def __init__(self):
+        self.items = 0
+        self.read_time = 0.0
+        self.compute_time = 0.0
+        self.write_time = 0.0
+        self.read_wait = 0.0
+        self.write_wait = 0.0
+        self.read_depth_sum = 0
+        self.read_depth_max = 0
+        self.write_depth_sum = 0
+        self.write_depth_max = 0
+
+    def sample_depths(self, read_depth, write_depth):
+        self.read_depth_sum += read_depth
+        self.read_depth_max = max(self.read_depth_max, read_depth)
+        self.write_depth_sum += write_depth
+        self.write_depth_max = max(self.write_depth_max, write_depth)
+
+    def merge(self, other):
+        self.items += other.items
+        self.read_time += other.read_time
+        self.compute_time += other.compute_time
+        self.write_time += other.write_time
+        self.read_wait += other.read_wait
+        self.write_wait += other.write_wait
+        self.read_depth_sum += other.read_depth_sum
+        self.read_depth_max = max(self.read_depth_max, other.read_depth_max)
+        self.write_depth_sum += other.write_depth_sum
+        self.write_depth_max = max(self.write_depth_max, other.write_depth_max)
+
+    def report(self):
+        items = max(1, self.items)
+        print("pipeline: {0} files, read {1:.1f}s, compute {2:.1f}s, write {3:.1f}s busy".format(
+            self.items, self.read_time, self.compute_time, self.write_time))
+        print("pipeline: compute waited {0:.1f}s for reads and {1:.1f}s for writes".format(
+            self.read_wait, self.write_wait))
+        print("pipeline: {0:.1f} avg / {1} max files decoded ahead, {2:.1f} avg / {3} max files waiting to be "
+              "written".format(self.read_depth_sum / items, self.read_depth_max, self.write_depth_sum / items,
+                               self.write_depth_max))
+
+
+_END = object()
+
+
+def _timed(function, *args):
+    begin = time.time()
+    return function(*args), time.time() - begin
+
+
+def run_pipeline(items, read, compute, write, read_threads=2, write_threads=2, depth=4, metrics=None):
+    """ Runs every item through read, compute and write, with the reads of the next items and the writes of the
+    previous ones overlapping the compute of the current one. The reads are done by read_threads threads at most
+    depth items ahead, and the writes by write_threads threads with at most depth items waiting, so no more than
+    about 2 * depth items are in memory at once. A stage without threads runs in the calling thread, which is the
+    one the compute stage always runs in.
+
+    :param items: the items to process
+    :param read: read(item) -> data, e.g. decodes a sound file
+    :param compute: compute(item, data) -> result
+    :param write: write(item, result) -> output, e.g. encodes and writes a sound file
+    :param metrics: a PipelineMetrics that is filled in, when given
+    :return: generator of the outputs, in the order of the items
+    """
+    metrics = PipelineMetrics() if metrics is None else metrics
+    items = iter(items)
+    readers = ThreadPoolExecutor(max_workers=read_threads) if read_threads > 0 else None
+    writers = ThreadPoolExecutor(max_workers=write_threads) if write_threads > 0 else None
+    reads = deque()
+    writes = deque()
+
+    def prefetch():
+        while readers is not None and len(reads) < depth:
+            item = next(items, _END)
+            if item is _END:
+                return
+            reads.append((item, readers.submit(_timed, read, item)))
+
+    def finish_write():
+        item, future = writes.popleft()
+        begin = time.time()
+        output, elapsed = future.result()
+        metrics.write_wait += time.time() - begin
+        metrics.write_time += elapsed
+        return output
+
+    try:
+        while True:
+            prefetch()
+            if readers is not None:
+                if not reads:
+                    break
+                metrics.sample_depths(sum(future.done() for _, future in reads), len(writes))
+                item, future = reads.popleft()
+                begin = time.time()
+                data, elapsed = future.result()
+                metrics.read_wait += time.time() - begin
+            else:
+                item = next(items, _END)
+                if item is _END:
+                    break
+                metrics.sample_depths(0, len(writes))
+                data, elapsed = _timed(read, item)
+            metrics.read_time += elapsed
+            # the next read starts before the compute of this item
+            prefetch()
+
+            result, elapsed = _timed(compute, item, data)
+            del data
+            metrics.compute_time += elapsed
+            metrics.items += 1
+
+            if writers is None:
+                output, elapsed = _timed(write, item, result)
+                metrics.write_time += elapsed
+                yield output
+                continue
+            writes.append((item, writers.submit(_timed, write, item, result)))
+            del result
+            # ready outputs are handed out right away, the oldest one is waited for only when the queue is full
+            while writes and (writes[0][1].done() or len(writes) > depth):
+                yield finish_write()
+        while writes:
+            yield finish_write()
+    finally:
+        if readers is not None:
+            for _, future in reads:
+                future.cancel()
+            readers.shutdown(wait=True)
+        if writers is not None:
+            writers.shutdown(wait=True)
@@ -2,10 +2,19 @@ import argparse
 import os
 import time
 
+import librosa as rosa
+import numpy as np
 import psutil
+import soundfile
 from pysndfx import AudioEffectsChain
 from tqdm import tqdm
 
+from Augmenter import instrumentation
+from Augmenter.dataset_index import DatasetIndex
+from Augmenter.journal import CompletionJournal
+from Augmenter.scheduler import report_load, run_scheduled
+from Augmenter.tool_kit import pitch_shift_multi_librosa
+
 cpu_core_in_use = psutil.cpu_count(logical=True)
 
 def main():
@@ -14,7 +23,21 @@ def main():
     ap.add_argument("-sp", "--save-path", required=True, default='./output',
                     help="saving path of manipulated sound files")
     ap.add_argument("-pl", "--pitch-list", required=True, help="list of pitch shift numbers separated by ,")
-    ap.add_argument("-wo", "--worker-count", required=False, help="")
+    ap.add_argument("-wo", "--worker-count", required=False,
+                    help="number of processes that pitch the sounds, defaults to the logical cpu count")
+    ap.add_argument("-en", "--engine", required=False, default="sox", choices=("sox", "librosa"),
+                    help="sox pipes every variant through a sox process, librosa derives all of the variants of a "
+                         "sound from a single stft in process")
+    ap.add_argument("-q", "--quality", required=False, default="high", choices=("high", "fast"),
+                    help="resampling quality of the librosa engine")
+    ap.add_argument("-di", "--dataset-index", required=False,
+                    help="the manifest file of the dataset, created on the first run and refreshed on the next ones")
+    ap.add_argument("-j", "--journal", required=False,
+                    help="the completion journal of the run, an interrupted run continues from where it stopped")
+    ap.add_argument("-mj", "--metrics-json", required=False,
+                    help="writes the time, samples and bytes of every stage and the peak memory to this json file")
+    ap.add_argument("-mp", "--metrics-prometheus", required=False,
+                    help="writes the same metrics to this file in the Prometheus text format")
 
     coreCount = psutil.cpu_count(logical=True)
 
@@ -24,63 +47,177 @@ def main():
     save_path = args["save_path"]
     pitch_list = args["pitch_list"].split(',')
 
-    cpu_core_in_use = coreCount if args["worker_count"] is None else args["worker_count"]
+    cpu_core_in_use = coreCount if args["worker_count"] is None else int(args["worker_count"])
 
-    pitch(sound_path, save_path, pitch_list)
+    pitch(sound_path, save_path, pitch_list, worker_count=cpu_core_in_use, engine=args["engine"],
+          quality=args["quality"], dataset_index=args["dataset_index"], journal_path=args["journal"],
+          metrics_json=args["metrics_json"], metrics_prometheus=args["metrics_prometheus"])
 
 
-def pitch(sound_path, save_path, pitch_list):
+def pitch(sound_path, save_path, pitch_list, worker_count=1, engine="sox", quality="high", dataset_index=None,
+          journal_path=None, metrics_json=None, metrics_prometheus=None):
     """ The function that gets the sound files, and the list of pitch operations. Then applies the pitch operation on the
-    sound files and save the new sound files to the given path.
+    sound files and save the new sound files to the given path. Every sound file is decoded only once, all of the
+    pitch variants are produced from that buffer, and the files are spread over worker_count processes.
 
     Parameters
     ----------
     sound_path: the path of sound files that will be pitched
     save_path: the saving path of newly pitched sound files.
     pitch_list: the list of pitch types that will be applied on the sounds
+    worker_count: the number of processes that pitch the sound files
+    engine: "sox" or "librosa", the pitch shifts are given in cents for both of them
+    quality: resampling quality of the librosa engine, see tool_kit.pitch_shift_multi_librosa
+    dataset_index: the DatasetIndex manifest of sound_path, only the changed files have their headers read when given
+    journal_path: the CompletionJournal of the run, the sound files which are already pitched with the same
+    parameters are skipped when given
+    metrics_json: the file the time, samples and bytes of the decode, pitch and encode stages of every process, and
+    their peak memory, are written to when given, see instrumentation.StageRecorder.to_json
+    metrics_prometheus: the file the same metrics are written to in the Prometheus text format when given
 
     Returns
     -------
 
+    Raises
+    ------
+    RuntimeError: when any sound file could not be pitched, after every other file is done, so the run does not
+    succeed with missing outputs, e.g. when the engine is not usable at all
     """
-    filters = []
-    names = []
+    index = DatasetIndex.loadOrScan(sound_path, dataset_index)
+    jobs = []
+    durations = []
+    for record in index.speakerRecords():
+        sound_file_path = index.getPath(record)
+        jobs.append((record.speaker, os.path.dirname(sound_file_path), os.path.basename(sound_file_path), save_path))
+        durations.append(index.getDuration(record))
+    print(len(set(job[0] for job in jobs)))
+
+    journal = None if journal_path is None else CompletionJournal(journal_path)
+    keys = {}
+    if journal is not None:
+        recipe = {"savePath": os.path.abspath(save_path), "pitchList": list(pitch_list), "engine": engine,
+                  "quality": quality}
+        keys = {os.path.join(job[1], job[2]): CompletionJournal.keyOf(os.path.join(job[1], job[2]), recipe)
+                for job in jobs}
+        pending = [i for i, job in enumerate(jobs) if not journal.isDone(keys[os.path.join(job[1], job[2])])]
+        jobs = [jobs[i] for i in pending]
+        durations = [durations[i] for i in pending]
+
+    begin = time.time()
+    instrumentation.recorder.reset()
+
+    # the longest sounds are pitched first and short ones are sent to the workers in groups
+    loads = {}
+    failed = []
+    try:
+        for infile, outputs in tqdm(run_scheduled(_pitch_file, jobs, durations, worker_count=worker_count,
+                                                  initializer=_init_worker, initargs=(pitch_list, engine, quality),
+                                                  loads=loads), total=len(jobs)):
+            # a file that failed is not recorded, so it is tried again on the next run
+            if outputs is None:
+                failed.append(infile)
+            elif journal is not None:
+                journal.record(keys[infile], outputs)
+    finally:
+        if journal is not None:
+            journal.close()
+
+    end = time.time()
+
+    print(end - begin)
+    report_load(loads)
+    instrumentation.recorder.report()
+    if metrics_json is not None:
+        instrumentation.recorder.to_json(metrics_json, soundPath=os.path.abspath(sound_path), workerCount=worker_count,
+                                         files=len(jobs), audioSeconds=sum(durations), wallSeconds=end - begin,
+                                         workers={str(pid): dict(zip(("files", "busySeconds", "audioSeconds"), load))
+                                                  for pid, load in loads.items()})
+    if metrics_prometheus is not None:
+        instrumentation.recorder.to_prometheus(metrics_prometheus)
+    if failed:
+        raise RuntimeError("{0} of {1} sound files could not be pitched, the first one is {2}".format(
+            len(failed), len(jobs), sorted(failed)[0]))
+
+
+# pitch filters of the current process, built once by _init_worker
+_filters = []
+_names = []
+_engine = "sox"
+_quality = "high"
+_semitones = []
+
+
+def _init_worker(pitch_list, engine="sox", quality="high"):
+    global _filters, _names, _engine, _quality, _semitones
+    _filters = []
+    _names = []
+    _engine = engine
+    _quality = quality
+    # sox shifts the pitch in cents, librosa in semitones
+    _semitones = [float(pitch) / 100 for pitch in pitch_list]
     for pitch in pitch_list:
         fx = (
             AudioEffectsChain()
                 .pitch(shift=pitch)
         )
-        filters.append(fx)
-        names.append("pitch_" + str(pitch))
+        _filters.append(fx)
+        _names.append("pitch_" + str(pitch))
 
-    begin = time.time()
 
-    for root, people, _ in os.walk(sound_path):
-        length = len(people)
-        print(length)
-        # iterates each speaker folder in the path
-        for index in range(length):
-            person = people[index]
-            for person_root, _, sound_files in os.walk(os.path.join(root, person)):
-                # iterates each sound file of the speaker
-                for sound_file in (x for x in sound_files if
-                                   x.lower().endswith(".wav") or x.lower().endswith(".mp3") or x.lower().endswith(
-                                       ".flac")):
-                    try:
-                        infile = os.path.join(person_root, sound_file)
-                        os.makedirs(os.path.join(save_path, person), exist_ok=True)
-
-                        for i in range(0, 6):
-                            name = names[i] + "_" + sound_file
-                            outfile = os.path.join(save_path, person, name)
-                            filters[i](infile, outfile)
-                    except Exception as e:
-                        print("\nError: ", e)
-                        print("person: {0}, filename: {1}".format(person_root, sound_file))
+def _librosa_variants(sound_data, sr):
+    """ Every pitch variant of the sound from a single stft per channel, channels first like rosa.load(mono=False). """
+    if sound_data.ndim == 1:
+        return pitch_shift_multi_librosa(sound_data, sr, _semitones, quality=_quality)
+    channels = [pitch_shift_multi_librosa(channel, sr, _semitones, quality=_quality) for channel in sound_data]
+    return [np.stack(variant) for variant in zip(*channels)]
 
-    end = time.time()
 
-    print(end - begin)
+def _pitch_file(job):
+    """ Decodes a single sound file once and writes every pitch variant of it.
+
+    Parameters
+    ----------
+    job: (person, person_root, sound_file, save_path) tuple
+
+    Returns
+    -------
+    (path of the sound file, paths of the written variants), or no paths when the sound file could not be pitched
+    """
+    person, person_root, sound_file, save_path = job
+    infile = os.path.join(person_root, sound_file)
+    written = []
+    try:
+        os.makedirs(os.path.join(save_path, person), exist_ok=True)
+        # the samples are piped into sox from memory, so the file is not decoded again for every variant
+        with instrumentation.recorder.stage("decode") as stage:
+            sound_data, sr = rosa.load(infile, sr=None, mono=False)
+            stage.add(samples=sound_data.shape[-1], nbytes=os.path.getsize(infile))
+
+        variants = None
+        if _engine == "librosa":
+            with instrumentation.recorder.stage("pitch") as stage:
+                variants = _librosa_variants(sound_data, sr)
+                stage.add(samples=sound_data.shape[-1] * len(variants))
+
+        for i in range(len(_filters)):
+            name = _names[i] + "_" + sound_file
+            outfile = os.path.join(save_path, person, name)
+            if variants is None:
+                # sox shifts and encodes in one go
+                with instrumentation.recorder.stage("pitch") as stage:
+                    _filters[i](sound_data, outfile, sample_in=sr)
+                    stage.add(samples=sound_data.shape[-1], nbytes=os.path.getsize(outfile))
+            else:
+                with instrumentation.recorder.stage("encode") as stage:
+                    soundfile.write(outfile, variants[i].T, sr)
+                    stage.add(samples=variants[i].shape[-1], nbytes=os.path.getsize(outfile))
+            written.append(outfile)
+    except Exception as e:
+        print("\nError: ", e)
+        print("person: {0}, filename: {1}".format(person_root, sound_file))
+        return infile, None
+    return infile, written
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+import time
+
+from Augmenter import instrumentation
+from Augmenter.pipeline import PipelineMetrics, run_pipeline
+
+# the function the batches of the current process are run through, and the pipeline stages around it, set by
+# _init_worker
+_worker_function = None
+_worker_stages = None
+
+
+def plan_batches(durations, min_batch_duration=1.0):
+    """ Orders the tasks longest first and groups the short ones, so that a long task never starts last and keeps a
+    single worker busy after the others are done, and tiny tasks do not cost one round trip to a worker each.
+
+    :param durations: the expected cost of every task, e.g. the duration of its sound in seconds
+    :param min_batch_duration: tasks shorter than this are grouped until the group is at least this long
+    :return: list of batches, every batch being a list of task indices
+    """
+    batches = []
+    batch, batch_duration = [], 0.0
+    for index in sorted(range(len(durations)), key=lambda i: durations[i], reverse=True):
+        if durations[index] >= min_batch_duration:
+            batches.append([index])
+            continue
+        batch.append(index)
+        batch_duration += durations[index]
+        if batch_duration >= min_batch_duration:
+            batches.append(batch)
+            batch, batch_duration = [], 0.0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _init_worker(function, initializer, initargs, stages=None, pooled=False):
+    global _worker_function, _worker_stages
+    _worker_function = function
+    _worker_stages = stages
+    if pooled:
+        # a forked worker starts with a copy of the stages the parent recorded so far, which the parent still counts
+        instrumentation.recorder.reset()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_batch(job):
+    batch_id, tasks = job
+    begin = time.time()
+    metrics = None
+    if _worker_stages is None:
+        results = [_worker_function(task) for task in tasks]
+    else:
+        read, write, options = _worker_stages
+        metrics = PipelineMetrics()
+        results = list(run_pipeline(tasks, read, _worker_function, write, metrics=metrics, **options))
+    # what the batch recorded is sent back with its results, and merged into the recorder of the parent
+    return batch_id, os.getpid(), time.time() - begin, results, metrics, instrumentation.recorder.snapshot(reset=True)
+
+
+def run_scheduled(function, tasks, durations, worker_count=1, initializer=None, initargs=(), min_batch_duration=1.0,
+                  loads=None, stages=None, metrics=None):
+    """ Runs function over the tasks, longest first, handing the next batch (see plan_batches) to whichever worker
+    becomes idle first. Results are yielded per task, in the order they are completed.
+
+    :param function: a module level function that takes a single task, or the compute stage when stages are given
+    :param tasks: list of tasks
+    :param durations: the expected cost of every task
+    :param worker_count: number of processes, the tasks are run in the current process when it is 1
+    :param initializer: called with initargs in every process before it runs any task
+    :param min_batch_duration: see plan_batches
+    :param loads: when given, filled with {process id: [task count, busy seconds, duration]} as batches complete,
+                  see report_load
+    :param stages: (read, write, options) module level functions, the tasks of a batch are then run through
+                   pipeline.run_pipeline(tasks, read, function, write, **options) by the worker
+    :param metrics: a pipeline.PipelineMetrics the pipelines of every batch are merged into, when stages are given
+
+    The stages recorded by the workers, see instrumentation.StageRecorder, are merged into instrumentation.recorder
+    of the calling process as batches complete.
+    """
+    batches = plan_batches(durations, min_batch_duration)
+    jobs = [(batch_id, [tasks[index] for index in batch]) for batch_id, batch in enumerate(batches)]
+    loads = {} if loads is None else loads
+
+    def account(batch_id, pid, busy, batch_metrics, stages):
+        instrumentation.recorder.merge(stages)
+        load = loads.setdefault(pid, [0, 0.0, 0.0])
+        load[0] += len(batches[batch_id])
+        load[1] += busy
+        load[2] += sum(durations[index] for index in batches[batch_id])
+        if metrics is not None and batch_metrics is not None:
+            metrics.merge(batch_metrics)
+
+    if worker_count is None or worker_count <= 1:
+        _init_worker(function, initializer, initargs, stages)
+        for batch_id, pid, busy, results, batch_metrics, stages in map(_run_batch, jobs):
+            account(batch_id, pid, busy, batch_metrics, stages)
+            yield from results
+        return
+
+    pool = multiprocessing.Pool(processes=worker_count, initializer=_init_worker,
+                                initargs=(function, initializer, initargs, stages, True))
+    try:
+        # a single batch per dispatch, so that a worker only takes new work once it is idle
+        for batch_id, pid, busy, results, batch_metrics, stages in pool.imap_unordered(_run_batch, jobs,
+                                                                                       chunksize=1):
+            account(batch_id, pid, busy, batch_metrics, stages)
+            yield from results
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+
+def report_load(loads):
+    """ Prints the busy time of every worker filled in by run_scheduled, and how evenly the work was spread: the mean
+    busy time over the longest one, 1.0 meaning every worker was busy until the end of the run.
+    """
+    for pid, (files, busy, duration) in sorted(loads.items()):
+        print("worker {0}: {1} files, {2:.1f}s busy, {3:.2f} files/s, {4:.1f}x real time".format(
+            pid, files, busy, files / busy if busy else 0, duration / busy if busy else 0))
+    busiest = max((busy for _, busy, _ in loads.values()), default=0)
+    if busiest:
+        print("load balance: {0:.2f}".format(sum(busy for _, busy, _ in loads.values()) / len(loads) / busiest))
@@ -0,0 +1,160 @@
+import glob
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Tuple
+
+import numpy as np
+import soundfile
+from json_tricks import dumps, loads
+
+from Augmenter import instrumentation
+
+
+class ShardWriter:
+	""" Packs written sounds and their recipes into tar shards instead of one wav and one json file per sound. Every
+	sound is stored under its key as the members key.wav and key.json, the shard is rolled over to a new one once it
+	grows beyond maxShardSize bytes, and the data offsets of every member are appended to the index of the writer, so
+	a ShardReader can seek to a sound without scanning the tar files.
+
+	A writer is used by a single process, whose threads can add to it concurrently. Writers of different processes
+	can share a directory, each of them writes its own shards and index, named after its prefix. A record is added to
+	the index only after its members are written and flushed, so the shards of a writer which was not closed, e.g. of
+	a killed run, are still readable.
+	"""
+	indexExtension = ".index.jsonl"
+
+	def __init__(self, directory: str, prefix: str = None, maxShardSize: int = 1024 * 1024 * 1024):
+		os.makedirs(directory, exist_ok=True)
+		self.directory = directory
+		self.prefix = prefix if prefix is not None else "shard-" + uuid.uuid4().hex[:12]
+		self.maxShardSize = maxShardSize
+		self.shardCount = 0
+		self.shardName = None
+		self.tar = None
+		self.lock = threading.Lock()
+		self.index = open(os.path.join(directory, self.prefix + self.indexExtension), "a")
+
+	def keyOf(self, path: str) -> str:
+		""" The key of a sound that would have been written to path, relative to the directory of the writer. """
+		return os.path.splitext(os.path.relpath(path, self.directory))[0].replace(os.sep, "/")
+
+	def rollOver(self):
+		if self.tar is not None:
+			self.tar.close()
+		self.shardName = "{0}-{1:06d}.tar".format(self.prefix, self.shardCount)
+		self.shardCount += 1
+		self.tar = tarfile.open(os.path.join(self.directory, self.shardName), "x", format=tarfile.PAX_FORMAT)
+
+	def addMember(self, name: str, fileobj, size: int) -> Tuple[int, int]:
+		info = tarfile.TarInfo(name)
+		info.size = size
+		info.mtime = time.time()
+		self.tar.addfile(info, fileobj)
+		# the data of the member ends the archive, padded to the tar block size
+		return self.tar.offset - tarfile.BLOCKSIZE * ((size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE), size
+
+	def add(self, key: str, members: Dict[str, Tuple[object, int]]):
+		""" Adds a record of (file object, size) members, keyed by their extension. """
+		size = sum(memberSize for _, memberSize in members.values())
+		with self.lock:
+			if self.tar is None or (self.tar.offset > 0 and self.tar.offset + size > self.maxShardSize):
+				self.rollOver()
+			offsets = {extension: self.addMember(key + "." + extension, fileobj, memberSize)
+					   for extension, (fileobj, memberSize) in members.items()}
+			self.tar.fileobj.flush()
+			self.index.write(json.dumps({"key": key, "shard": self.shardName, "members": offsets}) + "\n")
+			self.index.flush()
+
+	@staticmethod
+	def recipeMember(recipe: list) -> Tuple[object, int]:
+		data = dumps({"Steps": recipe}).encode("utf-8")
+		return io.BytesIO(data), len(data)
+
+	def addAudio(self, key: str, data: np.ndarray, samplingRate: int, recipe: list = None):
+		""" Adds the samples as a float wav, with the recipe next to them when it is given. """
+		buffer = io.BytesIO()
+		with instrumentation.recorder.stage("encode") as stage:
+			soundfile.write(buffer, data, samplingRate, format="WAV", subtype="FLOAT")
+			stage.add(samples=len(data), nbytes=buffer.tell())
+		members = {"wav": (io.BytesIO(buffer.getbuffer()), buffer.tell())}
+		if recipe is not None:
+			members["json"] = self.recipeMember(recipe)
+		self.add(key, members)
+
+	def addFile(self, key: str, path: str, recipe: list = None):
+		""" Adds a sound file that is already written, e.g. by streaming.stream_mix, without loading it. """
+		with open(path, "rb") as fp:
+			members = {os.path.splitext(path)[1][1:].lower(): (fp, os.path.getsize(path))}
+			if recipe is not None:
+				members["json"] = self.recipeMember(recipe)
+			self.add(key, members)
+
+	def close(self):
+		if self.tar is not None:
+			self.tar.close()
+			self.tar = None
+		self.index.close()
+
+	def __enter__(self) -> "ShardWriter":
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+class ShardReader:
+	""" Random access to the records of the ShardWriters of a directory through their indexes. """
+
+	def __init__(self, directory: str):
+		self.directory = directory
+		self.records = {}
+		for indexPath in sorted(glob.glob(os.path.join(directory, "*" + ShardWriter.indexExtension))):
+			with open(indexPath) as fp:
+				for line in fp:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						continue
+					self.records[record["key"]] = record
+		self.files = {}
+
+	def keys(self) -> List[str]:
+		return list(self.records)
+
+	def __len__(self) -> int:
+		return len(self.records)
+
+	def __contains__(self, key: str) -> bool:
+		return key in self.records
+
+	def read(self, key: str, extension: str = "wav") -> bytes:
+		record = self.records[key]
+		if record["shard"] not in self.files:
+			self.files[record["shard"]] = open(os.path.join(self.directory, record["shard"]), "rb")
+		fp = self.files[record["shard"]]
+		offset, size = record["members"][extension]
+		fp.seek(offset)
+		return fp.read(size)
+
+	def readAudio(self, key: str) -> Tuple[np.ndarray, int]:
+		extension = next(x for x in self.records[key]["members"] if x != "json")
+		return soundfile.read(io.BytesIO(self.read(key, extension)), dtype="float32")
+
+	def readRecipe(self, key: str) -> list:
+		return loads(self.read(key, "json").decode("utf-8"))["Steps"]
+
+	def close(self):
+		for fp in self.files.values():
+			fp.close()
+		self.files = {}
+
+	def __enter__(self) -> "ShardReader":
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,64 @@
+from typing import Tuple
+
+import numpy as np
+
+from Augmenter.Augmenter import Audio
+
+try:
+	from multiprocessing import shared_memory
+except ImportError:  # python < 3.8, every worker decodes its own copy of the noises then
+	shared_memory = None
+
+
+class SharedNoiseBank:
+	""" Concatenated noise samples of a single sampling rate in a multiprocessing.shared_memory segment. The parent
+	process creates the segment once, and the workers attach to it by its descriptor and read the samples through a
+	read-only NumPy view, so the noises take the same memory whatever the number of workers is.
+	"""
+
+	def __init__(self, segment, samplingRate: int, length: int, path: str, owner: bool):
+		self.segment = segment
+		self.samplingRate = samplingRate
+		self.length = length
+		self.path = path
+		self.owner = owner
+		self.array = np.ndarray((length,), dtype=np.float32, buffer=segment.buf)
+		if not owner:
+			self.array.flags.writeable = False
+
+	@staticmethod
+	def isAvailable() -> bool:
+		return shared_memory is not None
+
+	@classmethod
+	def create(cls, array: np.ndarray, samplingRate: int, path: str) -> "SharedNoiseBank":
+		""" Copies the samples into a new segment, which lives until the creator calls unlink. """
+		# a segment can not be empty
+		segment = shared_memory.SharedMemory(create=True, size=max(1, len(array) * np.dtype(np.float32).itemsize))
+		bank = cls(segment, samplingRate, len(array), path, owner=True)
+		bank.array[:] = array
+		return bank
+
+	def descriptor(self) -> Tuple[str, int, int, str]:
+		""" What a worker needs to attach to the segment, small enough to be sent as an initializer argument. """
+		return self.segment.name, self.samplingRate, self.length, self.path
+
+	@classmethod
+	def attach(cls, descriptor: Tuple[str, int, int, str]) -> "SharedNoiseBank":
+		name, samplingRate, length, path = descriptor
+		return cls(shared_memory.SharedMemory(name=name), samplingRate, length, path, owner=False)
+
+	def toAudio(self) -> Audio:
+		# the samples were validated when the parent decoded them
+		return Audio(data=Audio.AudioImpl(array=self.array, samplingRate=self.samplingRate, path=self.path,
+										  validate=False))
+
+	def close(self):
+		# the views on the buffer have to be released before the segment can be closed
+		self.array = None
+		self.segment.close()
+
+	def unlink(self):
+		self.close()
+		if self.owner:
+			self.segment.unlink()
@@ -0,0 +1,145 @@
+import os
+import tempfile
+
+import numpy as np
+import soundfile
+from json_tricks import dump
+
+from Augmenter import instrumentation
+from Augmenter.Augmenter import Audio
+
+
+def _mono_blocks(path, block_size):
+    """ Yields the samples of a sound file as float32 mono blocks, the same values librosa.load(sr=None) returns. """
+    for block in soundfile.blocks(path, blocksize=block_size, dtype="float32", always_2d=True):
+        yield block.mean(axis=1, dtype=np.float32) if block.shape[1] > 1 else block[:, 0]
+
+
+def _raw_blocks(path, block_size):
+    """ Yields the float32 samples of a raw temporary file written by a previous pass. """
+    with open(path, "rb") as fp:
+        while True:
+            block = np.fromfile(fp, dtype=np.float32, count=block_size)
+            if len(block) == 0:
+                return
+            yield block
+
+
+def _apply(block, operations):
+    for operation, operand in operations:
+        block = operation(block, operand)
+    return block
+
+
+def _peak(operations, highest):
+    """ The peak of the data after the operations, see Audio.AudioImpl.getPeak. """
+    return _apply(np.array([highest], dtype=np.float32), operations)[0]
+
+
+def _remove_temporary(path, temporary_files):
+    if path in temporary_files:
+        temporary_files.remove(path)
+        os.remove(path)
+
+
+def can_stream(path):
+    """ Streaming needs a format libsndfile can read block by block, e.g. wav or flac, but not mp3. """
+    try:
+        soundfile.info(path)
+        return True
+    except RuntimeError:
+        return False
+
+
+@instrumentation.recorder.timed("stream_mix")
+def stream_mix(sound_path, noise_data, noise_peak, sampling_rate, windows, save_dir, noise_name=None,
+               block_size=65536, weight_of_me=0.5, weight_of_other=0.5, description=True):
+    """ Block based counterpart of applying Audio.mix once per window and writing the result with Audio.write. Speech
+    and noise are read in blocks of block_size samples, so the memory in use does not depend on the length of the
+    recording. Every window takes one pass over the data, which is kept in a raw float32 file next to the output
+    between passes, and the pass of the last window writes the wav file. Like the pipeBuffer Audio.write writes, the
+    result of the last mix is not normalized.
+
+    :param sound_path: the sound file to noise, in a format libsndfile can read
+    :param noise_data: concatenated noises at the sampling rate of the sound, e.g. the memory-mapped NoiseBank array
+    :param noise_peak: np.max of noise_data, the opponent of Audio.mix is normalized by it
+    :param sampling_rate: sampling rate of the sound file
+    :param windows: (sound begin, noise begin, length) windows in seconds, mixed one after the other
+    :param save_dir: the directory the noised sound and its recipe are written to
+    :param noise_name: the opponent path written into the recipe
+    :param block_size: number of samples read, mixed and written at once
+    :param weight_of_me: weightOfMe of Audio.mix
+    :param weight_of_other: weightOfOther of Audio.mix
+    :param description: whether the json recipe is written next to the sound, like Audio.write does
+    :return: path of the written sound, a .wav file
+    """
+    name = os.path.splitext(os.path.basename(sound_path))[0]
+    pipe_suffix = "|" + Audio.AugmentationStep.Steps.Mix.value
+    # the samples are always written as a float wav, whatever the format of the source is
+    audio_path = os.path.join(save_dir, name + pipe_suffix + ".wav")
+
+    # peak of the speech, the first operand of the first mix
+    highest = None
+    for block in _mono_blocks(sound_path, block_size):
+        if len(block):
+            highest = np.max(block) if highest is None else max(highest, np.max(block))
+    # operations which are still pending on the data of the current pass, like a normalized Audio
+    operations = []
+    source = sound_path
+    blocks = _mono_blocks
+
+    temporary_files = []
+    try:
+        for index, (start_at, noise_start_at, duration) in enumerate(windows):
+            # the same sample bounds as the segments Audio.mix is given
+            begin = Audio.AudioSegment.toSamples(start_at, sampling_rate)
+            length = Audio.AudioSegment.toSamples(start_at + duration, sampling_rate) - begin
+            noise_begin = Audio.AudioSegment.toSamples(noise_start_at, sampling_rate)
+            noise_length = min(Audio.AudioSegment.toSamples(noise_start_at + duration, sampling_rate) - noise_begin,
+                               Audio.AudioSegment.toSamples(duration, sampling_rate))
+            noise_window = noise_data[noise_begin:noise_begin + noise_length]
+            # normalize me, then gain, exactly like Audio.mix does
+            operations = operations + [(np.true_divide, _peak(operations, highest)),
+                                       (np.multiply, weight_of_me)]
+
+            last = index == len(windows) - 1
+            if last:
+                target = audio_path
+                output = soundfile.SoundFile(audio_path, "w", samplerate=sampling_rate, channels=1, format="WAV",
+                                             subtype="FLOAT")
+            else:
+                handle, target = tempfile.mkstemp(suffix=".f32", dir=save_dir)
+                temporary_files.append(target)
+                output = os.fdopen(handle, "wb")
+            highest = None
+            position = 0
+            with output as fp:
+                for block in blocks(source, block_size):
+                    me = _apply(block, operations)
+                    window_begin = max(position, begin)
+                    window_end = min(position + len(block), begin + length)
+                    if window_begin < window_end:
+                        # looping the noise window over the segment is only index arithmetic
+                        indices = np.arange(window_begin - begin, window_end - begin) % len(noise_window)
+                        noise = (noise_window[indices] / noise_peak) * weight_of_other
+                        part = me[window_begin - position:window_end - position]
+                        np.add(part, part + noise, out=part)
+                    if len(me):
+                        highest = np.max(me) if highest is None else max(highest, np.max(me))
+                    fp.write(me if last else me.tobytes())
+                    position += len(block)
+            # the previous pass is consumed, so at most the pass read and the pass written are on disk
+            _remove_temporary(source, temporary_files)
+            source = target
+            blocks = _raw_blocks
+            # the mix result is normalized before it is mixed again
+            operations = [(np.true_divide, highest)]
+    finally:
+        for temporary_file in temporary_files:
+            os.remove(temporary_file)
+
+    if description:
+        step = (noise_name, Audio.AugmentationStep.Steps.Mix.value, {})
+        with open(os.path.join(save_dir, name + pipe_suffix + ".json"), 'w') as fp:
+            dump(obj={"Steps": [step]}, fp=fp)
+    return audio_path
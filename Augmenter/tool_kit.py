@@ -1,6 +1,8 @@
 from pydub import AudioSegment
 from pysndfx import AudioEffectsChain
 
+from Augmenter import dsp
+
 
 def wav_file_save_helper(sound_data, save_path, save_sampling_rate):
     """ saves the given sound file to given path by applying given sampling rate.
@@ -16,7 +18,8 @@ def wav_file_save_helper(sound_data, save_path, save_sampling_rate):
 
     """
     if save_path is not None and save_sampling_rate is not None:
-        librosa.output.write_wav(save_path, sound_data, save_sampling_rate)
+        soundfile.write(save_path, sound_data, save_sampling_rate, format="WAV",
+                        subtype="DOUBLE" if sound_data.dtype == np.float64 else "FLOAT")
     elif save_path is not None:
         raise ValueError('if save_path is not None, save_sampling_rate must be specified')
 
@@ -69,12 +72,8 @@ def mix_librosa(sound1_data, sound2_data, save_path=None, save_sampling_rate=Non
     :param save_sampling_rate:  eğer oluşan ses kaydedilecekse, hangi sampling_rate ile kaydedilecegi bilgisi girilir
     :return: karıştırılmış librosa data array'i sonuç olarak döndürülür.
     """
-    # ikinci ses birinci ses'den daha kısa ise kendini tekrarlayarak uzatılır.
-    if len(sound1_data) >= len(sound2_data):
-        while len(sound1_data) >= len(sound2_data):
-            sound2_data = np.append(sound2_data, sound2_data)
-    # uzatılan ikinci ses verisi birinci ses verisi ile eşit uzunluğa getirilir.
-    sound2_cropped = sound2_data[0: len(sound1_data)]
+    # ikinci ses birinci ses'den daha kısa ise kendini tekrarlayarak birinci ses ile eşit uzunluğa getirilir.
+    sound2_cropped = looped_window(sound2_data, 0, len(sound1_data))
 
     # iki sesin overlap işlemleri
     sound1_power = np.sum(sound1_data ** 2)
@@ -93,6 +92,104 @@ def mix_librosa(sound1_data, sound2_data, save_path=None, save_sampling_rate=Non
 # mix_librosa(orig, noise, save_path='./mixed.wav', save_sampling_rate=sr)
 
 
+def looped_window(sound_data, begin, length):
+    """ Returns length samples of the sound starting at begin, looping the sound when it is shorter. The loop is
+    index arithmetic, the sound itself is never grown.
+
+    Parameters
+    ----------
+    sound_data: sound file that is represented as array
+    begin: index of the first sample, may be beyond the end of the sound
+    length: number of samples to return
+
+    Returns
+    -------
+
+    """
+    return np.take(sound_data, np.arange(begin, begin + length), mode='wrap')
+
+
+def energy_index(sound_data):
+    """ Builds the cumulative energy of a sound, index[i] being the sum of the squares of the first i samples, so the
+    energy of any window is a subtraction.
+
+    Parameters
+    ----------
+    sound_data: sound file that is represented as array
+
+    Returns
+    -------
+    float64 array of len(sound_data) + 1 elements
+    """
+    index = np.zeros(len(sound_data) + 1)
+    np.cumsum(np.square(sound_data, dtype=np.float64), out=index[1:])
+    return index
+
+
+def window_energy(index, begin, length):
+    """ Energy of looped_window(sound_data, begin, length) from the energy_index of the sound, in O(1).
+
+    Parameters
+    ----------
+    index: energy_index of the sound
+    begin: index of the first sample of the window
+    length: number of samples in the window
+
+    Returns
+    -------
+
+    """
+    size = len(index) - 1
+    if size == 0:
+        raise ValueError("the energy index is of an empty sound")
+    loops, rest = divmod(length, size)
+    begin %= size
+    end = begin + rest
+    if end <= size:
+        partial = index[end] - index[begin]
+    else:
+        partial = (index[size] - index[begin]) + index[end - size]
+    return loops * index[size] + partial
+
+
+def mix_snr_librosa(sound1_data, sound2_data, snr_db=0.0, sound2_begin=0, sound1_index=None, sound2_index=None,
+                    save_path=None, save_sampling_rate=None):
+    """ Mixes the second sound (noise) into the first one so that the result has the given signal to noise ratio. The
+    powers come from energy indexes, which can be built once per utterance and once per noise bank and passed in, so
+    the only work left for a mix is the final multiply-add.
+
+    :param sound1_data: ilk sesin librosa ile çıkartılmış data array'i
+    :param sound2_data: ikinci sesin (noise) librosa ile çıkartılmış data array'i
+    :param snr_db: hedeflenen signal to noise oranı (dB)
+    :param sound2_begin: ikinci sesin kullanılmaya başlanacağı index, ses bitince başa dönülür
+    :param sound1_index: ilk sesin energy_index'i, verilmezse hesaplanır
+    :param sound2_index: ikinci sesin energy_index'i, verilmezse hesaplanır
+    :param save_path: eğer olusan ses herhangi bir dizine kaydedilecekse dizin girilir, yoksa boş bırakılır.
+    :param save_sampling_rate:  eğer oluşan ses kaydedilecekse, hangi sampling_rate ile kaydedilecegi bilgisi girilir
+    :return: karıştırılmış librosa data array'i, noise penceresi sessizse ilk ses değişmeden döner
+    """
+    if len(sound2_data) == 0:
+        raise ValueError("the noise is empty")
+    if sound1_index is None:
+        sound1_index = energy_index(sound1_data)
+    if sound2_index is None:
+        sound2_index = energy_index(sound2_data)
+
+    sound1_power = sound1_index[-1]
+    sound2_power = window_energy(sound2_index, sound2_begin, len(sound1_data))
+    if sound2_power <= 0:
+        # a silent noise window can not be scaled to any ratio, and adding it changes nothing
+        overlaid_sound = np.array(sound1_data)
+    else:
+        scale = np.asarray(np.sqrt(sound1_power / (sound2_power * 10 ** (snr_db / 10.0))), dtype=sound1_data.dtype)
+        overlaid_sound = sound1_data + scale * looped_window(sound2_data, sound2_begin, len(sound1_data))
+
+    # if specified, saves the wav file
+    wav_file_save_helper(overlaid_sound, save_path, save_sampling_rate)
+
+    return overlaid_sound
+
+
 def reverb_librosa(sound_data, save_path=None, save_sampling_rate=None, reverberance=50, hf_damping=50, room_scale=100,
                    stereo_depth=100, pre_delay=20, wet_gain=0, wet_only=False):
     """ Bu fonksiyon librosa ses datalarını alarak reverb (yankı) ekleme işlemi yapmaktadır.
@@ -136,12 +233,33 @@ def reverb_librosa(sound_data, save_path=None, save_sampling_rate=None, reverber
 # reverb_librosa(orig, save_path='./reverbed1.wav', save_sampling_rate=sr)
 
 
-def equalizer_librosa(sound_data, frequency, save_path=None, save_sampling_rate=None, q=1.0, db=-3.0):
-    equalizer = (
-        AudioEffectsChain().equalizer(frequency, q=q, db=db)
-    )
+def equalizer_librosa(sound_data, frequency, save_path=None, save_sampling_rate=None, q=1.0, db=-3.0, sr=44100,
+                      backend="sox"):
+    """ Applies the equalizer (peaking filter) on the given sound file.
+
+    Parameters
+    ----------
+    sound_data
+    frequency
+    save_path
+    save_sampling_rate
+    q
+    db
+    sr: sampling rate of sound_data
+    backend: "sox" runs the filter in a sox subprocess, "native" runs the same biquad in process
+
+    Returns
+    -------
 
-    equalized_sound_data = equalizer(sound_data, frequency)
+    """
+    if backend == "native":
+        equalized_sound_data = dsp.apply_effect(sound_data, sr, "equalizer", frequency=frequency, q=q, db=db)
+    else:
+        equalizer = (
+            AudioEffectsChain().equalizer(frequency, q=q, db=db)
+        )
+
+        equalized_sound_data = equalizer(sound_data, sample_in=sr)
 
     # if specified, saves the wav file
     wav_file_save_helper(equalized_sound_data, save_path, save_sampling_rate)
@@ -154,7 +272,7 @@ def equalizer_librosa(sound_data, frequency, save_path=None, save_sampling_rate=
 # equalizer_librosa(orig, 1, save_path='./equalized.wav', save_sampling_rate=sr)
 
 
-def bandpass_librosa(sound_data, frequency, save_path=None, save_sampling_rate=None, q=1.0):
+def bandpass_librosa(sound_data, frequency, save_path=None, save_sampling_rate=None, q=1.0, sr=44100, backend="sox"):
     """ Applies the band pass filter on the given sound file.
 
     Parameters
@@ -164,16 +282,21 @@ def bandpass_librosa(sound_data, frequency, save_path=None, save_sampling_rate=N
     save_path
     save_sampling_rate
     q
+    sr: sampling rate of sound_data
+    backend: "sox" runs the filter in a sox subprocess, "native" runs the same biquad in process
 
     Returns
     -------
 
     """
-    bandpasser = (
-        AudioEffectsChain().bandpass(frequency, q=q)
-    )
+    if backend == "native":
+        bandpassed_sound_data = dsp.apply_effect(sound_data, sr, "bandpass", frequency=frequency, q=q)
+    else:
+        bandpasser = (
+            AudioEffectsChain().bandpass(frequency, q=q)
+        )
 
-    bandpassed_sound_data = bandpasser(sound_data, frequency)
+        bandpassed_sound_data = bandpasser(sound_data, sample_in=sr)
 
     # if specified, saves the wav file
     wav_file_save_helper(bandpassed_sound_data, save_path, save_sampling_rate)
@@ -224,7 +347,7 @@ def pitch_shift_librosa(sound_data, sr, n_steps=2, save_path=None, save_sampling
     :param save_sampling_rate:
     :return:
     """
-    sound_data = librosa.effects.pitch_shift(sound_data, sr, n_steps=n_steps)
+    sound_data = librosa.effects.pitch_shift(sound_data, sr=sr, n_steps=n_steps)
 
     # if specified, saves the wav file
     wav_file_save_helper(sound_data, save_path, save_sampling_rate)
@@ -240,23 +363,83 @@ def pitch_shift_librosa(sound_data, sr, n_steps=2, save_path=None, save_sampling
 # pitch_shift_librosa(orig, sr, n_steps=4, save_path='./pitch_shift4.wav', save_sampling_rate=sr)
 # pitch_shift_librosa(orig, sr, n_steps=5, save_path='./pitch_shift5.wav', save_sampling_rate=sr)
 # pitch_shift_librosa(orig, sr, n_steps=6, save_path='./pitch_shift6.wav', save_sampling_rate=sr)
+#
+# ya da hepsi tek bir STFT ile
+# pitch_shift_multi_librosa(orig, sr, [1, 2, 3, 4, 5, 6], quality="fast", n_jobs=6)
+
+# resampling filters of the pitch_shift_multi_librosa quality tiers. "high" is soxr_hq, the default filter of
+# librosa.effects.pitch_shift, so it gives the same samples, and neither tier needs resampy
+PITCH_SHIFT_QUALITY = {"high": "soxr_hq", "fast": "soxr_lq"}
+
+
+def _pitch_synthesis(stft, sound_data, sr, n_steps, bins_per_octave, res_type):
+    """ Synthesizes a single pitch shift from the stft of the sound, the same way librosa.effects.pitch_shift does. """
+    rate = 2.0 ** (-float(n_steps) / bins_per_octave)
+    stretched = librosa.istft(librosa.phase_vocoder(stft, rate=rate), dtype=sound_data.dtype,
+                              length=int(round(len(sound_data) / rate)))
+    shifted = librosa.resample(stretched, orig_sr=float(sr) / rate, target_sr=sr, res_type=res_type)
+    return librosa.util.fix_length(shifted, size=len(sound_data))
+
+
+def pitch_shift_multi_librosa(sound_data, sr, n_steps_list, quality="high", res_type=None, bins_per_octave=12,
+                              n_jobs=1, save_paths=None, save_sampling_rate=None):
+    """ pitch_shift_librosa'nın birden fazla n_steps degeri için olan hali. Sesin STFT analizi bir kere yapılıyor ve
+    bütün pitch varyantları aynı analizden üretiliyor, librosa.effects.pitch_shift ise her çagrıda analizi yeniden
+    yapıyor. Varyantların sentezi n_jobs thread'e dagıtılabiliyor.
+
+    :param sound_data: librosa data array (mono)
+    :param sr: ilgili data array'in sampling rate degeri
+    :param n_steps_list: uygulanacak n_steps (yarım ton) degerleri
+    :param quality: "high" pitch_shift_librosa ile aynı sonucu verir, "fast" toplu augmentation için daha hızlı
+                    bir resampling filtresi kullanır
+    :param res_type: verilirse quality'nin resampling filtresinin yerine kullanılır
+    :param bins_per_octave: bir oktavdaki adım sayısı
+    :param n_jobs: sentezi paralel yapan thread sayısı
+    :param save_paths: verilirse her varyant sırasıyla bu path'lere kaydedilir
+    :param save_sampling_rate:
+    :return: n_steps_list ile aynı sırada pitch'lenmiş data array'lerinin listesi
+    """
+    if res_type is None:
+        res_type = PITCH_SHIFT_QUALITY[quality]
+    stft = librosa.stft(sound_data)
+
+    def synthesize(n_steps):
+        return _pitch_synthesis(stft, sound_data, sr, n_steps, bins_per_octave, res_type)
+
+    if n_jobs is not None and n_jobs > 1 and len(n_steps_list) > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            shifted = list(executor.map(synthesize, n_steps_list))
+    else:
+        shifted = [synthesize(n_steps) for n_steps in n_steps_list]
+
+    # if specified, saves the wav files
+    if save_paths is not None:
+        for sound, save_path in zip(shifted, save_paths):
+            wav_file_save_helper(sound, save_path, save_sampling_rate)
 
-def reverse_librosa(sound_data, save_path=None, save_sampling_rate=None):
+    return shifted
+
+
+def reverse_librosa(sound_data, save_path=None, save_sampling_rate=None, backend="sox"):
     """ Bu fonksiyon librosa ses datalarını alarak reverse (sesi ters çevirme)  işlemi yapmaktadır.
     Eğer save_path ve sampling rate degerleri verilmiş ise ilgili bilgiler ile oluşan yeni dosyayı kaydeder.
 
     :param sound_data: reverb eklenecek sesin librosa ile çıkartılmış data array degerleri.
     :param save_path: eğer olusan ses herhangi bir dizine kaydedilecekse dizin girilir, yoksa boş bırakılır.
     :param save_sampling_rate: eğer oluşan ses kaydedilecekse, hangi sampling_rate ile kaydedilecegi bilgisi girilir
+    :param backend: "sox" ise sox ile, "native" ise sox çalıştırılmadan numpy ile ters çevrilir
     :return:
     """
-    # reverse işlemi için gereken chain yapılı nesne oluşturulur.
-    reverser = (
-        AudioEffectsChain().reverse()
-    )
+    if backend == "native":
+        reversed_sound_data = sound_data[::-1].copy()
+    else:
+        # reverse işlemi için gereken chain yapılı nesne oluşturulur.
+        reverser = (
+            AudioEffectsChain().reverse()
+        )
 
-    # ilgili ses dosyası için reverse işlemi yapılır.
-    reversed_sound_data = reverser(sound_data)
+        # ilgili ses dosyası için reverse işlemi yapılır.
+        reversed_sound_data = reverser(sound_data)
 
     # if specified, saves the wav file
     wav_file_save_helper(reversed_sound_data, save_path, save_sampling_rate)
@@ -302,23 +485,72 @@ def change_speed_librosa(sound_data, save_path=None, save_sampling_rate=None,
 # change_speed_librosa(orig, factor=300,use_semitones=True,save_path='./faster.wav', save_sampling_rate=sr)
 
 
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
 import librosa
 import numpy as np
-from scipy.signal import butter, lfilter
+import soundfile
+from scipy.signal import butter, sosfilt, sosfilt_zi, sosfiltfilt
+
+
+@functools.lru_cache(maxsize=256)
+def butter_sos(btype, cutoffs, sr, order=5):
+    """ Designs a Butterworth filter in second-order sections form. Designs are cached per
+    (type, cutoffs, sampling rate, order), so a filter is designed once however many sounds it is applied to.
+
+    Parameters
+    ----------
+    btype: 'lowpass', 'highpass', 'bandpass' or 'bandstop'
+    cutoffs: cutoff frequency, or (low, high) tuple of cutoff frequencies for the band filters
+    sr: sampling rate
+    order: order of the filter
+
+    Returns
+    -------
+    sos array, shared by every caller asking for the same design, so it must not be modified
+    """
+    nyq = 0.5 * sr
+    normal_cutoffs = [cutoff / nyq for cutoff in cutoffs] if isinstance(cutoffs, tuple) else cutoffs / nyq
+    return butter(order, normal_cutoffs, btype=btype, output='sos')
+
+
+def sos_filter(sound_data, sos, zero_phase=False, axis=-1):
+    """ Applies second-order sections to the sound data, forward and backward (zero phase) if asked. """
+    if zero_phase:
+        return sosfiltfilt(sos, sound_data, axis=axis)
+    return sosfilt(sos, sound_data, axis=axis)
+
 
+def sos_filter_chunks(chunks, sos, zi=None):
+    """ Filters a stream of chunks of a single sound, carrying the filter state from one chunk to the next, so a long
+    file can stream through the filter without holding the full signal. The output is the same as filtering the whole
+    sound at once with sos_filter. Zero phase filtering needs the whole signal, so it is not available here.
 
-def butter_lowpass(cutoff, fs, order=5):
-    #  Cutoff: cutoff frequency
-    #  Fs sampling rate
-    nyq = 0.5 * fs  # Signal frequency
-    normal_cutoff = cutoff / nyq  # Normal cutoff frequency = cutoff frequency / signal frequency
-    b, a = butter(order, normal_cutoff, btype='lowpass', analog=False)
-    return b, a
+    Parameters
+    ----------
+    chunks: iterable of 1-D sound arrays
+    sos: second-order sections, e.g. from butter_sos
+    zi: initial filter state, zeros (a filter at rest) by default
 
+    Returns
+    -------
+    generator of filtered chunks
+    """
+    if zi is None:
+        zi = np.zeros((sos.shape[0], 2))
+    for chunk in chunks:
+        filtered, zi = sosfilt(sos, chunk, zi=zi)
+        yield filtered
 
-def butter_lowpass_filter(data, cutoff, fs, order=5):
-    b, a = butter_lowpass(cutoff, fs, order=order)
-    y = lfilter(b, a, data)
+
+def steady_state_zi(sos, first_sample):
+    """ Filter state that starts sos_filter_chunks in steady state for a signal starting at first_sample. """
+    return sosfilt_zi(sos) * first_sample
+
+
+def butter_lowpass_filter(data, cutoff, fs, order=5, zero_phase=False):
+    y = sos_filter(data, butter_sos('lowpass', cutoff, fs, order=order), zero_phase=zero_phase)
     return y  # Filter requirements.
 
 
@@ -336,17 +568,8 @@ def low_pass_filter_librosa(sound_data, sr, cutoff=1000, order=5, save_path=None
 # low_pass_filter_librosa(data, sr, cutoff=500, order=5, save_path='./5order_500cutoff.wav', save_sampling_rate=sr)
 
 
-def butter_bandpass(low_cut, high_cut, sr, order=5):
-    nyq = 0.5 * sr
-    low = low_cut / nyq
-    high = high_cut / nyq
-    b, a = butter(order, [low, high], btype='band')
-    return b, a
-
-
-def butter_bandpass_filter(sound_data, sr, low_cut, high_cut, order=5):
-    b, a = butter_bandpass(low_cut, high_cut, sr, order=order)
-    y = lfilter(b, a, sound_data)
+def butter_bandpass_filter(sound_data, sr, low_cut, high_cut, order=5, zero_phase=False):
+    y = sos_filter(sound_data, butter_sos('bandpass', (low_cut, high_cut), sr, order=order), zero_phase=zero_phase)
     return y
 
 
@@ -364,3 +587,116 @@ def band_pass_filter_librosa(sound_data, sr, low_cut=1024, high_cut=7000, order=
 # band_pass_filter_librosa(data, sr, low_cut=2000,high_cut=2000, order=5, save_path='./5order_low_high.wav', save_sampling_rate=sr)
 # band_pass_filter_librosa(data, sr, low_cut=1000,high_cut=1000, order=5, save_path='./5order_low_high.wav', save_sampling_rate=sr)
 # band_pass_filter_librosa(data, sr, low_cut=500, high_cut=500, order=5, save_path='./5order_low_high.wav', save_sampling_rate=sr)
+
+
+# Batch variants of the functions above. A batch is a 2-D array that holds one clip per row, padded with zeros on the
+# right, and a lengths vector that holds the real length of every clip. The work is done along axis 1 for the whole
+# batch at once, the result of every row is the same as the result of the single clip function, and the padding of the
+# result is zero again.
+
+
+def pad_batch(sounds, dtype=np.float32):
+    """ Packs a list of 1-D sound arrays into a zero padded batch.
+
+    Parameters
+    ----------
+    sounds: list of sound arrays
+    dtype: dtype of the batch
+
+    Returns
+    -------
+    (batch, lengths)
+    """
+    lengths = np.array([len(sound) for sound in sounds], dtype=np.int64)
+    batch = np.zeros((len(sounds), lengths.max() if len(sounds) else 0), dtype=dtype)
+    batch[_batch_mask(lengths, batch.shape[1])] = np.concatenate(sounds) if len(sounds) else []
+    return batch, lengths
+
+
+def unpad_batch(batch, lengths):
+    """ Splits a batch back into a list of 1-D sound arrays. """
+    return [row[:length] for row, length in zip(batch, lengths)]
+
+
+def _batch_mask(lengths, width):
+    return np.arange(width)[np.newaxis, :] < np.asarray(lengths)[:, np.newaxis]
+
+
+def mix_librosa_batch(sound1_batch, sound1_lengths, sound2_batch, sound2_lengths):
+    """ Batch variant of mix_librosa. Every noise row is looped to the length of the matching sound row and mixed with
+    the same power as the sound.
+
+    Parameters
+    ----------
+    sound1_batch: padded batch of sounds
+    sound1_lengths: lengths of the sounds
+    sound2_batch: padded batch of noises, one for each sound
+    sound2_lengths: lengths of the noises
+
+    Returns
+    -------
+    padded batch of mixed sounds
+    """
+    mask = _batch_mask(sound1_lengths, sound1_batch.shape[1])
+    # looping the noise with np.append in mix_librosa is the same as indexing it modulo its length
+    indices = np.arange(sound1_batch.shape[1])[np.newaxis, :] % np.asarray(sound2_lengths)[:, np.newaxis]
+    sound2_cropped = np.take_along_axis(sound2_batch, indices, axis=1) * mask
+
+    sound1_power = np.sum(sound1_batch ** 2, axis=1, keepdims=True)
+    sound2_power = np.sum(sound2_cropped ** 2, axis=1, keepdims=True)
+    return (sound1_batch + np.sqrt(sound1_power / sound2_power) * sound2_cropped) * mask
+
+
+def white_noise_librosa_batch(sound_batch, lengths, mean=0, std=1, noise_factor=0.009):
+    """ Batch variant of white_noise_librosa. The noise is drawn with a single call, in the same order the single
+    clip function would draw it row after row.
+
+    Parameters
+    ----------
+    sound_batch: padded batch of sounds
+    lengths: lengths of the sounds
+    mean
+    std
+    noise_factor
+
+    Returns
+    -------
+    padded batch of noised sounds
+    """
+    mask = _batch_mask(lengths, sound_batch.shape[1])
+    noise = np.zeros(sound_batch.shape)
+    noise[mask] = np.random.normal(mean, std, int(np.sum(lengths)))
+    return sound_batch + noise_factor * noise
+
+
+def _sos_filter_batch(sound_batch, lengths, sos, zero_phase=False):
+    if not zero_phase:
+        return sos_filter(sound_batch, sos, axis=1) * _batch_mask(lengths, sound_batch.shape[1])
+    # the backward pass and the edge padding of sosfiltfilt must start at the end of every sound, not at the end of
+    # the padded row, so zero phase filtering goes row by row
+    filtered = np.zeros(sound_batch.shape)
+    for row, length in enumerate(lengths):
+        filtered[row, :length] = sos_filter(sound_batch[row, :length], sos, zero_phase=True)
+    return filtered
+
+
+def butter_lowpass_filter_batch(sound_batch, lengths, cutoff, fs, order=5, zero_phase=False):
+    """ Batch variant of butter_lowpass_filter, the filter runs over every row at once, or row by row when it is
+    zero phase.
+    """
+    return _sos_filter_batch(sound_batch, lengths, butter_sos('lowpass', cutoff, fs, order=order), zero_phase)
+
+
+def butter_bandpass_filter_batch(sound_batch, lengths, sr, low_cut, high_cut, order=5, zero_phase=False):
+    """ Batch variant of butter_bandpass_filter, the filter runs over every row at once, or row by row when it is
+    zero phase.
+    """
+    return _sos_filter_batch(sound_batch, lengths, butter_sos('bandpass', (low_cut, high_cut), sr, order=order),
+                             zero_phase)
+
+
+def reverse_librosa_batch(sound_batch, lengths):
+    """ Batch variant of reverse_librosa, every row is reversed within its own length. """
+    mask = _batch_mask(lengths, sound_batch.shape[1])
+    indices = np.asarray(lengths)[:, np.newaxis] - 1 - np.arange(sound_batch.shape[1])[np.newaxis, :]
+    return np.take_along_axis(sound_batch, np.where(mask, indices, 0), axis=1) * mask
@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import soundfile
+from scipy.signal import lfilter
+
+# the parameters a corpus is generated from, written next to it so an existing corpus is reused only when they match
+CORPUS_FILE = "corpus.json"
+
+
+def _speech(rng, duration, sr):
+    """ A voiced, syllabic signal: harmonics of a wandering pitch under a 4 Hz syllable envelope, with some breath. """
+    t = np.arange(int(duration * sr)) / sr
+    f0 = rng.uniform(90, 240) * (1 + 0.05 * np.sin(2 * np.pi * rng.uniform(0.2, 1.0) * t))
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voice = sum(np.sin(k * phase) / k for k in range(1, 12) if k * f0.max() < sr / 2)
+    envelope = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * t + rng.uniform(0, np.pi)), 0, None) ** 2
+    breath = 0.02 * rng.standard_normal(len(t))
+    sound = envelope * voice + breath
+    return (0.3 * sound / np.max(np.abs(sound))).astype(np.float32)
+
+
+def _noise(rng, duration, sr):
+    """ Pink-ish noise, white noise through a one pole low pass. """
+    white = rng.standard_normal(int(duration * sr))
+    noise = lfilter([1.0], [1.0, -0.95], white)
+    return (0.3 * noise / np.max(np.abs(noise))).astype(np.float32)
+
+
+def generate_corpus(root, speakers=4, files_per_speaker=8, min_duration=1.0, max_duration=6.0,
+                    sampling_rates=(16000,), formats=("wav",), noise_files=3, noise_duration=20.0, seed=0):
+    """ Writes a reproducible synthetic corpus laid out like the datasets of advanced_noise_injection and
+    pitch_script.pitch: root/sounds/<speaker>/<utterance> and root/noise/<noise>. The same parameters always give the
+    same samples, so results of different machines and commits are comparable. A corpus which was already generated
+    with the same parameters is reused.
+
+    :param root: the directory of the corpus
+    :param speakers: number of speaker directories
+    :param files_per_speaker: number of utterances of every speaker
+    :param min_duration: shortest utterance in seconds
+    :param max_duration: longest utterance in seconds
+    :param sampling_rates: the utterances cycle through these sampling rates
+    :param formats: the utterances cycle through these soundfile formats, e.g. wav, flac or ogg
+    :param noise_files: number of noise files, written as wav at the first sampling rate
+    :param noise_duration: duration of every noise file in seconds
+    :param seed: seed of the generator
+    :return: the parameters of the corpus, with the total duration of its utterances in seconds
+    """
+    parameters = {"speakers": speakers, "files_per_speaker": files_per_speaker, "min_duration": min_duration,
+                  "max_duration": max_duration, "sampling_rates": list(sampling_rates), "formats": list(formats),
+                  "noise_files": noise_files, "noise_duration": noise_duration, "seed": seed}
+    for extension in formats:
+        if extension.upper() not in soundfile.available_formats():
+            raise ValueError("libsndfile can not write {0} files".format(extension))
+    corpus_file = os.path.join(root, CORPUS_FILE)
+    if os.path.exists(corpus_file):
+        with open(corpus_file) as fp:
+            existing = json.load(fp)
+        if {key: existing.get(key) for key in parameters} == parameters:
+            return existing
+
+    rng = np.random.default_rng(seed)
+    audio_seconds = 0.0
+    for speaker in range(speakers):
+        speaker_dir = os.path.join(root, "sounds", "speaker_{0:02d}".format(speaker))
+        os.makedirs(speaker_dir, exist_ok=True)
+        for utterance in range(files_per_speaker):
+            index = speaker * files_per_speaker + utterance
+            sr = sampling_rates[index % len(sampling_rates)]
+            extension = formats[index % len(formats)]
+            duration = rng.uniform(min_duration, max_duration)
+            audio_seconds += duration
+            soundfile.write(os.path.join(speaker_dir, "utterance_{0:03d}.{1}".format(utterance, extension)),
+                            _speech(rng, duration, sr), sr)
+    noise_dir = os.path.join(root, "noise")
+    os.makedirs(noise_dir, exist_ok=True)
+    for noise in range(noise_files):
+        soundfile.write(os.path.join(noise_dir, "noise_{0:02d}.wav".format(noise)),
+                        _noise(rng, noise_duration, sampling_rates[0]), sampling_rates[0])
+
+    parameters["audio_seconds"] = audio_seconds
+    with open(corpus_file, "w") as fp:
+        json.dump(parameters, fp, indent=2)
+    return parameters
+
+
+def add_corpus_arguments(ap):
+    ap.add_argument("-cr", "--corpus", required=True, help="the directory of the synthetic corpus")
+    ap.add_argument("-cs", "--speakers", required=False, type=int, default=4, help="number of speakers")
+    ap.add_argument("-cf", "--files-per-speaker", required=False, type=int, default=8,
+                    help="number of utterances of every speaker")
+    ap.add_argument("-cd", "--durations", required=False, default="1,6",
+                    help="shortest and longest utterance in seconds, separated by ,")
+    ap.add_argument("-csr", "--sampling-rates", required=False, default="16000",
+                    help="sampling rates separated by , the utterances cycle through")
+    ap.add_argument("-cfo", "--formats", required=False, default="wav",
+                    help="file formats separated by , the utterances cycle through, e.g. wav,flac,ogg")
+    ap.add_argument("-cn", "--noise-files", required=False, type=int, default=3, help="number of noise files")
+    ap.add_argument("-cse", "--corpus-seed", required=False, type=int, default=0, help="seed of the corpus")
+
+
+def corpus_from_arguments(args):
+    min_duration, max_duration = (float(x) for x in args["durations"].split(","))
+    return generate_corpus(args["corpus"], speakers=args["speakers"], files_per_speaker=args["files_per_speaker"],
+                           min_duration=min_duration, max_duration=max_duration,
+                           sampling_rates=[int(x) for x in args["sampling_rates"].split(",")],
+                           formats=args["formats"].split(","), noise_files=args["noise_files"],
+                           seed=args["corpus_seed"])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="generates a synthetic speaker and noise corpus for the benchmarks")
+    add_corpus_arguments(ap)
+    args = vars(ap.parse_args())
+    parameters = corpus_from_arguments(args)
+    print("{0} utterances, {1:.1f}s of audio in {2}".format(
+        parameters["speakers"] * parameters["files_per_speaker"], parameters["audio_seconds"], args["corpus"]))
+
+
+if __name__ == "__main__":
+    main()
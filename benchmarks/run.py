@@ -0,0 +1,366 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import platform
+import re
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+import soundfile
+
+from benchmarks.corpus import add_corpus_arguments, corpus_from_arguments
+
+try:
+    import resource
+except ImportError:  # windows, the peak memory is not measured then
+    resource = None
+
+# the pitches of the pitch_script.pitch cases, in cents
+PITCH_LIST = ["100", "-200"]
+# metrics where a higher value is better, the others are better lower
+HIGHER_IS_BETTER = {"files_per_second"}
+
+
+def _sound_paths(corpus):
+    return sorted(glob.glob(os.path.join(corpus, "sounds", "*", "*")))
+
+
+def _noise_paths(corpus):
+    return sorted(glob.glob(os.path.join(corpus, "noise", "*")))
+
+
+def _count_outputs(directory):
+    return sum(1 for _, _, files in os.walk(directory) for name in files
+               if os.path.splitext(name)[1][1:].upper() in soundfile.available_formats())
+
+
+def _setup_corpus(corpus, options):
+    return {"corpus": corpus, "workers": options["workers"],
+            "audio_seconds": sum(soundfile.info(path).duration for path in _sound_paths(corpus))}
+
+
+def _setup_sounds(corpus, options):
+    """ The utterances and the first noise decoded into memory, so a tool_kit case only measures the function. """
+    sounds = []
+    for path in _sound_paths(corpus):
+        data, sr = soundfile.read(path, dtype="float32")
+        sounds.append((data, sr, path))
+    noise_path = _noise_paths(corpus)[0]
+    noise, _ = soundfile.read(noise_path, dtype="float32")
+    groups = OrderedDict()
+    for data, sr, _ in sounds:
+        groups.setdefault(sr, []).append(data)
+    return {"sounds": sounds, "noise": noise, "noise_path": noise_path, "groups": groups,
+            "audio_seconds": sum(len(data) / sr for data, sr, _ in sounds)}
+
+
+def _noise_injection(worker_count):
+    def run(state):
+        from AddNoise import advanced_noise_injection
+        with tempfile.TemporaryDirectory() as save_path:
+            advanced_noise_injection(os.path.join(state["corpus"], "sounds"), os.path.join(state["corpus"], "noise"),
+                                     save_path, percentage=30, worker_count=worker_count or state["workers"], seed=0)
+            return _count_outputs(save_path)
+    return run
+
+
+def _pitch(engine, worker_count):
+    def run(state):
+        from Augmenter.pitch_script import pitch
+        with tempfile.TemporaryDirectory() as save_path:
+            pitch(os.path.join(state["corpus"], "sounds"), save_path, PITCH_LIST,
+                  worker_count=worker_count or state["workers"], engine=engine)
+            # a sound that failed is reported and skipped by pitch, so only the written variants are counted
+            return _count_outputs(save_path) // len(PITCH_LIST)
+    return run
+
+
+def _per_sound(function):
+    """ A case that runs function(data, sr, noise, path, noise_path) on every utterance. """
+    def run(state):
+        for data, sr, path in state["sounds"]:
+            function(data, sr, state["noise"], path, state["noise_path"])
+        return len(state["sounds"])
+    return run
+
+
+def _per_batch(function):
+    """ A case that runs function(batch, lengths, sr, noise) once for the utterances of every sampling rate. """
+    def run(state):
+        from Augmenter.tool_kit import pad_batch
+        for sr, sounds in state["groups"].items():
+            batch, lengths = pad_batch(sounds)
+            function(batch, lengths, sr, state["noise"])
+        return len(state["sounds"])
+    return run
+
+
+def _tool_kit():
+    from Augmenter import tool_kit
+    return tool_kit
+
+
+def _mix_batch(batch, lengths, sr, noise):
+    tool_kit = _tool_kit()
+    noise_batch, noise_lengths = tool_kit.pad_batch([noise] * len(batch))
+    return tool_kit.mix_librosa_batch(batch, lengths, noise_batch, noise_lengths)
+
+
+# name: (setup, run, whether sox is needed), every case is run in a process of its own
+CASES = OrderedDict([
+    ("advanced_noise_injection", (_setup_corpus, _noise_injection(1), False)),
+    ("advanced_noise_injection[workers]", (_setup_corpus, _noise_injection(None), False)),
+    ("pitch[librosa]", (_setup_corpus, _pitch("librosa", 1), False)),
+    ("pitch[sox]", (_setup_corpus, _pitch("sox", 1), True)),
+    ("mix_pydub", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().mix_pydub([path, noise_path])), False)),
+    ("mix_librosa", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().mix_librosa(data, noise)), False)),
+    ("mix_snr_librosa", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().mix_snr_librosa(data, noise, snr_db=10.0)), False)),
+    ("white_noise_librosa", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().white_noise_librosa(data)), False)),
+    ("reverb_librosa", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().reverb_librosa(data)), True)),
+    ("equalizer_librosa[native]", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().equalizer_librosa(data, 1000, sr=sr,
+                                                                               backend="native")), False)),
+    ("equalizer_librosa[sox]", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().equalizer_librosa(data, 1000, sr=sr)), True)),
+    ("bandpass_librosa[native]", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().bandpass_librosa(data, 1000, sr=sr,
+                                                                              backend="native")), False)),
+    ("bandpass_librosa[sox]", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().bandpass_librosa(data, 1000, sr=sr)), True)),
+    ("pitch_shift_librosa", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().pitch_shift_librosa(data, sr, n_steps=2)), False)),
+    ("pitch_shift_multi_librosa", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().pitch_shift_multi_librosa(data, sr, [-2, 2])), False)),
+    ("reverse_librosa[native]", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().reverse_librosa(data, backend="native")), False)),
+    ("reverse_librosa[sox]", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().reverse_librosa(data)), True)),
+    ("change_speed_librosa", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().change_speed_librosa(data)), True)),
+    ("low_pass_filter_librosa", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().low_pass_filter_librosa(data, sr, cutoff=1000)),
+        False)),
+    ("band_pass_filter_librosa", (_setup_sounds, _per_sound(
+        lambda data, sr, noise, path, noise_path: _tool_kit().band_pass_filter_librosa(
+            data, sr, low_cut=300, high_cut=min(7000, int(sr * 0.45)))), False)),
+    ("mix_librosa_batch", (_setup_sounds, _per_batch(_mix_batch), False)),
+    ("white_noise_librosa_batch", (_setup_sounds, _per_batch(
+        lambda batch, lengths, sr, noise: _tool_kit().white_noise_librosa_batch(batch, lengths)), False)),
+    ("butter_lowpass_filter_batch", (_setup_sounds, _per_batch(
+        lambda batch, lengths, sr, noise: _tool_kit().butter_lowpass_filter_batch(batch, lengths, 1000, sr)), False)),
+    ("butter_bandpass_filter_batch", (_setup_sounds, _per_batch(
+        lambda batch, lengths, sr, noise: _tool_kit().butter_bandpass_filter_batch(
+            batch, lengths, sr, 300, min(7000, int(sr * 0.45)))), False)),
+    ("reverse_librosa_batch", (_setup_sounds, _per_batch(
+        lambda batch, lengths, sr, noise: _tool_kit().reverse_librosa_batch(batch, lengths)), False)),
+])
+
+
+def _peak_rss_mb():
+    """ Peak resident memory of this process and of the largest of its finished children, e.g. pool workers. """
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # kilobytes on linux, bytes on macos
+    return peak / 2 ** 20 if platform.system() == "Darwin" else peak / 2 ** 10
+
+
+def _measure(name, corpus, options, connection):
+    """ Runs a case in the current process: the setup, the warm up runs, the timed runs and, when asked, one more run
+    under tracemalloc, which slows the code down and is therefore never timed.
+    """
+    setup, run, _ = CASES[name]
+    # the pools of the entry points start their workers the way they would outside of the benchmark
+    multiprocessing.set_start_method(options["start_method"], force=True)
+    # the progress bars and reports of the entry points are not part of the results
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            state = setup(corpus, options)
+            for _ in range(options["warmup"]):
+                run(state)
+            times = []
+            files = 0
+            for _ in range(options["repeat"]):
+                begin = time.perf_counter()
+                files = run(state)
+                times.append(time.perf_counter() - begin)
+            if not files:
+                raise RuntimeError("no file was processed")
+            seconds = statistics.median(times)
+            result = {"files": files, "audio_seconds": state["audio_seconds"], "seconds": seconds,
+                      "seconds_min": min(times), "files_per_second": files / seconds,
+                      "rtf": seconds / state["audio_seconds"], "peak_rss_mb": _peak_rss_mb()}
+            if options["trace"]:
+                tracemalloc.start()
+                run(state)
+                # tracemalloc has no count of the allocations a run made, only of the blocks it allocated that are
+                # still alive after it, where a leak shows up as a growing count
+                result["traced_live_blocks"] = len(tracemalloc.take_snapshot().traces)
+                result["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+    except Exception as e:
+        result = {"error": "{0}: {1}".format(type(e).__name__, str(e).strip().split("\n")[0])}
+    connection.send(result)
+    connection.close()
+
+
+def run_cases(corpus, names, workers=None, repeat=3, warmup=1, trace=False):
+    """ Runs every case in a fresh process, so the peak memory of a case is not inherited from the ones before it.
+
+    :param corpus: the directory of a corpus written by corpus.generate_corpus
+    :param names: the names of the cases to run, see CASES
+    :param workers: worker_count of the [workers] cases, defaults to the logical cpu count
+    :param repeat: number of timed runs of every case, the median one is reported
+    :param warmup: number of untimed runs before them, e.g. for the caches of librosa
+    :param trace: whether the allocations of one more run are traced
+    :return: {case: metrics}, a case that could not run has an error or skipped entry instead
+    """
+    options = {"workers": workers or multiprocessing.cpu_count(), "repeat": repeat, "warmup": warmup,
+               "trace": trace, "start_method": multiprocessing.get_start_method()}
+    context = multiprocessing.get_context("spawn")
+    results = OrderedDict()
+    for name in names:
+        if CASES[name][2] and shutil.which("sox") is None:
+            results[name] = {"skipped": "sox is not installed"}
+        else:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_measure, args=(name, corpus, options, sender))
+            process.start()
+            sender.close()
+            try:
+                results[name] = receiver.recv()
+            except EOFError:
+                results[name] = {"error": "the benchmark process exited with {0}".format(process.exitcode)}
+            process.join()
+        _print_result(name, results[name])
+    return results
+
+
+def _print_result(name, result):
+    if "skipped" in result or "error" in result:
+        print("{0}: {1}".format(name, result.get("skipped", result.get("error"))))
+        return
+    line = "{0}: {1:.2f} files/s, rtf {2:.4f}, peak rss {3:.1f} MB".format(
+        name, result["files_per_second"], result["rtf"], result["peak_rss_mb"] or 0)
+    if "traced_peak_mb" in result:
+        line += ", traced peak {0:.1f} MB, {1} blocks alive after the run".format(result["traced_peak_mb"],
+                                                                                  result["traced_live_blocks"])
+    print(line)
+
+
+def environment():
+    import librosa
+    import scipy
+    return {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine(),
+            "processor": platform.processor(), "cpu_count": multiprocessing.cpu_count(), "numpy": np.__version__,
+            "scipy": scipy.__version__, "librosa": librosa.__version__}
+
+
+def compare(results, baseline, tolerance=0.1, memory_tolerance=0.2):
+    """ The regressions of results against baseline["results"]: a case which ran in the baseline and fails now, a
+    files/s drop of more than tolerance, or a peak memory growth of more than memory_tolerance, as a fraction of the
+    baseline.
+
+    :return: list of (case, metric, baseline value, current value) regressions, the metric of a failing case is
+             "error" and its current value the error
+    """
+    checks = [("files_per_second", tolerance), ("peak_rss_mb", memory_tolerance),
+              ("traced_peak_mb", memory_tolerance)]
+    regressions = []
+    for name, result in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None or "files_per_second" not in previous:
+            continue
+        if "error" in result:
+            regressions.append((name, "error", previous["files_per_second"], result["error"]))
+            continue
+        if "files_per_second" not in result:
+            continue
+        for metric, allowed in checks:
+            if result.get(metric) is None or not previous.get(metric):
+                continue
+            change = result[metric] / previous[metric] - 1
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > allowed:
+                regressions.append((name, metric, previous[metric], result[metric]))
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="benchmarks the entry points and the tool_kit functions on a synthetic "
+                                             "corpus, and compares the results with a stored baseline")
+    add_corpus_arguments(ap)
+    ap.add_argument("-k", "--cases", required=False,
+                    help="a regular expression, only the cases whose name it matches are run")
+    ap.add_argument("-r", "--repeat", required=False, type=int, default=3,
+                    help="number of timed runs of every case, the median one is reported")
+    ap.add_argument("-wu", "--warmup", required=False, type=int, default=1, help="number of untimed runs first")
+    ap.add_argument("-wo", "--worker-count", required=False, type=int,
+                    help="worker_count of the [workers] cases, defaults to the logical cpu count")
+    ap.add_argument("-ta", "--trace-allocations", required=False, action="store_true",
+                    help="traces the allocations of one more run of every case with tracemalloc")
+    ap.add_argument("-o", "--output", required=False, help="writes the results to this json file")
+    ap.add_argument("-b", "--baseline", required=False,
+                    help="the json file of a previous run, regressions against it fail the benchmark")
+    ap.add_argument("-sb", "--save-baseline", required=False, action="store_true",
+                    help="stores the results as the new --baseline instead of comparing with it")
+    ap.add_argument("-tl", "--tolerance", required=False, type=float, default=0.1,
+                    help="the largest files/s drop, as a fraction of the baseline, that is not a regression")
+    ap.add_argument("-mt", "--memory-tolerance", required=False, type=float, default=0.2,
+                    help="the largest peak memory growth, as a fraction of the baseline, that is not a regression")
+    args = vars(ap.parse_args())
+
+    corpus = corpus_from_arguments(args)
+    names = [name for name in CASES if args["cases"] is None or re.search(args["cases"], name)]
+    results = run_cases(args["corpus"], names, workers=args["worker_count"], repeat=args["repeat"],
+                        warmup=args["warmup"], trace=args["trace_allocations"])
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(), "corpus": corpus,
+              "repeat": args["repeat"], "results": results}
+    if args["output"] is not None:
+        with open(args["output"], "w") as fp:
+            json.dump(report, fp, indent=2)
+
+    if args["baseline"] is None:
+        return
+    if args["save_baseline"]:
+        with open(args["baseline"], "w") as fp:
+            json.dump(report, fp, indent=2)
+        print("baseline saved to {0}".format(args["baseline"]))
+        return
+    with open(args["baseline"]) as fp:
+        baseline = json.load(fp)
+    if baseline["corpus"] != corpus:
+        print("warning: the baseline was measured on another corpus")
+    if baseline["environment"] != report["environment"]:
+        print("warning: the baseline was measured in another environment")
+    regressions = compare(results, baseline, args["tolerance"], args["memory_tolerance"])
+    for name, metric, previous, current in regressions:
+        if metric == "error":
+            print("REGRESSION {0}: ran at {1:.4g} files/s in the baseline, fails now with {2}".format(
+                name, previous, current))
+        else:
+            print("REGRESSION {0}: {1} {2:.4g} -> {3:.4g}".format(name, metric, previous, current))
+    if regressions:
+        raise SystemExit(1)
+    print("no regression against {0}".format(args["baseline"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import soundfile
+
+import AddNoise
+from Augmenter.Augmenter import Audio
+from Augmenter.journal import CompletionJournal
+from benchmarks.corpus import generate_corpus
+
+
+def _noise_injection(*args, **kwargs):
+    # the progress bar and the reports of a run are not part of the tests
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        return AddNoise.advanced_noise_injection(*args, **kwargs)
+
+
+def _read_outputs(directory):
+    """ {path relative to directory: samples or text} of every file written by a run. """
+    outputs = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(".wav"):
+                outputs[os.path.relpath(path, directory)] = soundfile.read(path)[0]
+            else:
+                with open(path) as fp:
+                    outputs[os.path.relpath(path, directory)] = fp.read()
+    return outputs
+
+
+class NoiseInjectionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        # 22050 Hz, where sample positions are rarely whole numbers of seconds
+        generate_corpus(cls.directory.name, speakers=3, files_per_speaker=3, min_duration=0.5, max_duration=1.5,
+                        sampling_rates=(22050,), noise_files=2, noise_duration=2.0, seed=0)
+        cls.soundPath = os.path.join(cls.directory.name, "sounds")
+        cls.noisePath = os.path.join(cls.directory.name, "noise")
+        cls.soundCount = 9
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def outputDir(self, name):
+        return os.path.join(self.directory.name, "outputs", self.id(), name)
+
+    def assertSameOutputs(self, expected, actual):
+        self.assertEqual(sorted(expected), sorted(actual))
+        for name in expected:
+            if isinstance(expected[name], str):
+                self.assertEqual(expected[name], actual[name], name)
+            else:
+                np.testing.assert_array_equal(expected[name], actual[name], name)
+
+    def test_every_seed_noises_every_sound(self):
+        for seed in (None, 1, 3, 7, 11, 12345):
+            with self.subTest(seed=seed):
+                savePath = self.outputDir(str(seed))
+                _noise_injection(self.soundPath, self.noisePath, savePath, percentage=30, seed=seed)
+                sounds = [name for name in _read_outputs(savePath) if name.endswith(".wav")]
+                self.assertEqual(len(sounds), self.soundCount)
+
+    def test_windows_are_whole_samples_within_the_sound(self):
+        for seed in (None, 1, 7, 12345):
+            for task in AddNoise.plan_noise_injection(self.soundPath, self.noisePath, "", percentage=60, seed=seed):
+                length = Audio.AudioImpl.readHeader(task.path)[1]
+                self.assertTrue(task.windows)
+                for startAt, noiseStartAt, duration in task.windows:
+                    for seconds in (startAt, noiseStartAt, duration):
+                        samples = seconds * task.samplingRate
+                        self.assertAlmostEqual(samples, round(samples), places=6)
+                    self.assertLessEqual(Audio.AudioSegment.toSamples(startAt + duration, task.samplingRate), length)
+
+    def test_snr_mode_names_outputs_like_the_default_mode(self):
+        # most of every sound is noised, so some noise windows wrap around the end of the noises
+        _noise_injection(self.soundPath, self.noisePath, self.outputDir("default"), percentage=90, seed=3)
+        _noise_injection(self.soundPath, self.noisePath, self.outputDir("snr"), percentage=90, seed=3, snr_db=5.0)
+        self.assertTrue(any(len(task.windows) > 1 for task in AddNoise.plan_noise_injection(
+            self.soundPath, self.noisePath, "", percentage=90, seed=3)))
+        self.assertEqual(sorted(_read_outputs(self.outputDir("default"))), sorted(_read_outputs(self.outputDir("snr"))))
+
+    def test_resumed_run_equals_an_uninterrupted_one(self):
+        journalPath = os.path.join(self.outputDir("resumed"), "run.journal")
+        savePath = self.outputDir("resumed")
+        inject = AddNoise._inject_noise_into_file
+        injected = []
+
+        def interrupted(task):
+            if len(injected) == 4:
+                raise KeyboardInterrupt
+            injected.append(task.path)
+            return inject(task)
+
+        # the run is stopped in the middle, after a few sounds are written and journaled
+        with mock.patch.object(AddNoise, "_inject_noise_into_file", side_effect=interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                _noise_injection(self.soundPath, self.noisePath, savePath, percentage=30, journal_path=journalPath)
+
+        resumed = []
+
+        def counted(task):
+            resumed.append(task.path)
+            return inject(task)
+
+        with mock.patch.object(AddNoise, "_inject_noise_into_file", side_effect=counted):
+            _noise_injection(self.soundPath, self.noisePath, savePath, percentage=30, journal_path=journalPath)
+        # the sounds of the batch the interruption cut short are not journaled, and only those are noised twice
+        self.assertLess(len(resumed), self.soundCount)
+        self.assertEqual(len(set(resumed) | set(injected)), self.soundCount)
+
+        # the journal drew the seed of the run, an uninterrupted run with it writes the same sounds
+        seed = CompletionJournal(journalPath).getSeed()
+        _noise_injection(self.soundPath, self.noisePath, self.outputDir("uninterrupted"), percentage=30, seed=seed)
+        outputs = _read_outputs(savePath)
+        del outputs["run.journal"]
+        self.assertSameOutputs(_read_outputs(self.outputDir("uninterrupted")), outputs)
+
+    def test_shards_together_equal_the_full_run(self):
+        _noise_injection(self.soundPath, self.noisePath, self.outputDir("full"), percentage=30, seed=7)
+        shardCount = 3
+        for shardIndex in range(shardCount):
+            _noise_injection(self.soundPath, self.noisePath, self.outputDir("shards"), percentage=30, seed=7,
+                             shard_index=shardIndex, shard_count=shardCount)
+        self.assertSameOutputs(_read_outputs(self.outputDir("full")), _read_outputs(self.outputDir("shards")))
+        # and every sound belongs to exactly one shard
+        planned = [len(AddNoise.plan_noise_injection(self.soundPath, self.noisePath, "", percentage=30, seed=7,
+                                                     shard_index=shardIndex, shard_count=shardCount))
+                   for shardIndex in range(shardCount)]
+        self.assertEqual(sum(planned), self.soundCount)
+        self.assertTrue(all(planned))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+
+import numpy as np
+
+from Augmenter.Augmenter import Audio
+
+
+def _audio(length=16000, sr=16000, seed=0):
+    data = (0.5 * np.random.RandomState(seed).uniform(-1, 1, length)).astype(np.float32)
+    return Audio(data=Audio.AudioImpl(array=data, samplingRate=sr, path="sound.wav"))
+
+
+class CopyOnWriteTest(unittest.TestCase):
+
+    def test_clone_and_slice_share_the_buffer(self):
+        audio = _audio()
+        clone = audio.clone()
+        self.assertTrue(np.shares_memory(audio.impl.getData(), clone.impl.getData()))
+        sliced = audio.slice(Audio.AudioSegment(begin=0.25, end=0.5))
+        self.assertEqual(sliced.getLength(), 4000)
+        self.assertTrue(np.shares_memory(audio.impl.getData(), sliced.impl.getData()))
+        np.testing.assert_array_equal(sliced.impl.getData(), audio.impl.getData()[4000:8000])
+
+    def test_writes_to_a_clone_do_not_reach_the_origin(self):
+        audio = _audio()
+        original = audio.impl.getData().copy()
+        clone = audio.clone()
+        clone.impl.getWritableData()[:100] = 1.0
+        np.testing.assert_array_equal(audio.impl.getData(), original)
+        self.assertTrue(np.all(clone.impl.getData()[:100] == 1.0))
+        # and the other way around
+        audio.impl.getWritableData()[100:200] = -1.0
+        self.assertFalse(np.any(clone.impl.getData()[100:200] == -1.0))
+
+    def test_writes_to_a_slice_do_not_reach_the_origin(self):
+        audio = _audio()
+        original = audio.impl.getData().copy()
+        sliced = audio.slice(Audio.AudioSegment(begin=0.25, end=0.5))
+        sliced.impl.getWritableData()[:] = 0.0
+        np.testing.assert_array_equal(audio.impl.getData(), original)
+
+    def test_read_only_buffers_are_copied_before_writes(self):
+        data = np.linspace(-0.5, 0.5, 1000, dtype=np.float32)
+        data.flags.writeable = False
+        audio = Audio(data=Audio.AudioImpl(array=data, samplingRate=1000, path="sound.wav", validate=False))
+        audio.impl.getWritableData()[0] = 1.0
+        self.assertEqual(data[0], np.float32(-0.5))
+
+    def test_pending_operations_match_eager_ones(self):
+        audio = _audio()
+        original = audio.impl.getData().copy()
+        processed = audio.gain(ratio=0.3).normalize().gain(ratio=0.5)
+        # nothing is computed or written until the data is asked for
+        self.assertEqual(len(processed.impl.pending), 3)
+        gained = original * np.float32(0.3)
+        expected = gained / np.max(gained) * 0.5
+        np.testing.assert_allclose(processed.impl.getData(), expected, rtol=1e-6)
+        np.testing.assert_array_equal(audio.impl.getData(), original)
+        self.assertAlmostEqual(float(audio.normalize().impl.getPeak()), 1.0, places=6)
+
+
+class SegmentMixTest(unittest.TestCase):
+    sr = 16000
+
+    def stepByStep(self, audio, noise, segments):
+        """ The unfused form of the segment path of Audio.mix: (me + (mySlice + other).align(segment)).normalize() """
+        me = audio.normalize().gain(ratio=0.5)
+        mySlice = me.slice(segment=segments[0])
+        normalizedSlice = noise.impl.getSlicedData(segments[1]) / np.max(noise.impl.getData())
+        othersSlice = Audio(data=Audio.AudioImpl(array=normalizedSlice, samplingRate=self.sr,
+                                                 path=noise.impl.getPath()))
+        othersFit = othersSlice.fitLength(length=segments[0].getRange(),
+                                          fittingMethod=Audio.AudioImpl.FittingMethod.Looping).gain(ratio=0.5)
+        mixOfUs = mySlice + othersFit
+        alignedMix = mixOfUs.align(Audio.AudioSegment(begin=segments[0].begin, end=me.getDuration()))
+        return (me + alignedMix).normalize()
+
+    def assertFusedEqualsStepByStep(self, begin, end, noiseBegin, noiseEnd):
+        audio = _audio(3 * self.sr, self.sr, seed=1)
+        noise = _audio(2 * self.sr, self.sr, seed=2)
+        original = audio.impl.getData().copy()
+        expected = self.stepByStep(audio, noise, [Audio.AudioSegment(begin=begin, end=end),
+                                                  Audio.AudioSegment(begin=noiseBegin, end=noiseEnd)])
+        mixed = audio.mix(other=noise, segmentsAsSeconds=[Audio.AudioSegment(begin=begin, end=end),
+                                                          Audio.AudioSegment(begin=noiseBegin, end=noiseEnd)])
+        np.testing.assert_array_equal(mixed.impl.getData(), expected.impl.getData())
+        # the pipeBuffer, which Audio.write writes, is the sum before the normalization
+        np.testing.assert_array_equal(mixed.pipeBuffer.impl.getData(), expected.pipeBuffer.impl.getData())
+        np.testing.assert_array_equal(audio.impl.getData(), original)
+
+    def test_window_inside_the_sound(self):
+        self.assertFusedEqualsStepByStep(0.5, 1.5, 0.25, 1.25)
+
+    def test_window_at_the_end_of_the_sound(self):
+        self.assertFusedEqualsStepByStep(2.0, 3.0, 1.0, 2.0)
+
+    def test_looped_noise(self):
+        # a quarter second of noise is looped over the whole window
+        self.assertFusedEqualsStepByStep(0.5, 2.0, 1.5, 1.75)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import shutil
+import unittest
+
+import numpy as np
+from pysndfx import AudioEffectsChain
+from scipy.signal import freqz, lfilter
+
+from Augmenter import dsp, tool_kit
+from Augmenter.Augmenter import Audio
+
+# the largest difference allowed between a native step and sox, relative to the peak of the input. sox works on 32 bit
+# integer samples and rounds its biquad coefficients, so the outputs are close but not bit-identical
+TOLERANCE = 1e-3
+
+# parameters of every step of Audio.Effect.nativeSteps, as they are given to Audio.Effect
+STEP_OPTIONS = {
+    "Equalizer": {"frequency": 1000, "q": 1.0, "db": -6.0},
+    "BandPass": {"frequency": 1000, "q": 1.0},
+    "BandReject": {"frequency": 1000, "q": 1.0},
+    "LowShelf": {"slope": 0.5, "gain": 6.0, "frequency": 300},
+    "HighShelf": {"slope": 0.5, "gain": -6.0, "frequency": 3000},
+    "HighPass": {"frequency": 500, "q": 0.707},
+    "LowPass": {"frequency": 2000, "q": 0.707},
+}
+
+
+def _test_signal(sr=16000, duration=1.0):
+    rng = np.random.RandomState(0)
+    t = np.arange(int(sr * duration)) / sr
+    tones = sum(np.sin(2 * np.pi * frequency * t) for frequency in (110, 440, 1000, 3100, 6000))
+    return (0.1 * tones + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+@unittest.skipIf(shutil.which("sox") is None, "sox is not installed")
+class NativeEffectsTest(unittest.TestCase):
+    sr = 16000
+
+    def assertClose(self, native, sox, data):
+        self.assertEqual(native.shape, sox.shape)
+        self.assertLess(np.max(np.abs(native - sox)), TOLERANCE * np.max(np.abs(data)))
+
+    def test_every_native_step_matches_sox(self):
+        data = _test_signal(self.sr)
+        for stepValue, options in STEP_OPTIONS.items():
+            with self.subTest(step=stepValue):
+                step = Audio.AugmentationStep.Steps(stepValue)
+                effect, conversions = Audio.Effect.nativeSteps[stepValue]
+                native = dsp.apply_effect(data, self.sr, effect,
+                                          **{name: convert(options[name]) for name, convert in conversions.items()})
+                sox = Audio.Effect.appendStep(AudioEffectsChain(), step, **options)(data, sample_in=self.sr)
+                self.assertClose(native, sox, data)
+
+    def test_tool_kit_backends_match(self):
+        data = _test_signal(self.sr)
+        self.assertClose(tool_kit.equalizer_librosa(data, 1000, sr=self.sr, backend="native"),
+                         tool_kit.equalizer_librosa(data, 1000, sr=self.sr), data)
+        self.assertClose(tool_kit.bandpass_librosa(data, 1000, sr=self.sr, backend="native"),
+                         tool_kit.bandpass_librosa(data, 1000, sr=self.sr), data)
+        self.assertClose(tool_kit.reverse_librosa(data, backend="native"), tool_kit.reverse_librosa(data), data)
+
+
+class BiquadResponseTest(unittest.TestCase):
+    """ The native designs against the gains the Audio EQ Cookbook promises, which needs no sox. """
+    sr = 16000
+    frequency = 1000
+
+    def gainDb(self, effect, frequency, **parameters):
+        b, a = dsp.biquad_coefficients(effect, self.sr, self.frequency, **parameters)
+        _, response = freqz(b, a, worN=[frequency], fs=self.sr)
+        return 20 * np.log10(np.abs(response[0]))
+
+    def assertGainDb(self, expected, effect, frequency, **parameters):
+        self.assertAlmostEqual(self.gainDb(effect, frequency, **parameters), expected, places=2,
+                               msg="{0} at {1} Hz".format(effect, frequency))
+
+    def test_equalizer(self):
+        for db in (-12.0, -6.0, 3.0, 9.0):
+            self.assertGainDb(db, "equalizer", self.frequency, q=1.0, db=db)
+            self.assertGainDb(0.0, "equalizer", 0, q=1.0, db=db)
+            self.assertGainDb(0.0, "equalizer", self.sr / 2, q=1.0, db=db)
+
+    def test_pass_and_reject(self):
+        self.assertGainDb(0.0, "bandpass", self.frequency, q=1.0)
+        self.assertLess(self.gainDb("bandpass", 10, q=1.0), -30)
+        self.assertLess(self.gainDb("bandreject", self.frequency, q=1.0), -100)
+        self.assertGainDb(0.0, "bandreject", 0, q=1.0)
+        for q in (0.5, 0.707, 2.0):
+            # the gain of the cookbook low and high passes at their corner is q
+            self.assertGainDb(20 * np.log10(q), "lowpass", self.frequency, q=q)
+            self.assertGainDb(20 * np.log10(q), "highpass", self.frequency, q=q)
+        self.assertGainDb(0.0, "lowpass", 0)
+        self.assertLess(self.gainDb("lowpass", self.sr / 2 * 0.999), -60)
+        self.assertGainDb(0.0, "highpass", self.sr / 2)
+        self.assertLess(self.gainDb("highpass", 1), -60)
+
+    def test_shelves(self):
+        for gain in (-6.0, 6.0):
+            self.assertGainDb(gain, "lowshelf", 0, gain=gain)
+            self.assertGainDb(0.0, "lowshelf", self.sr / 2, gain=gain)
+            self.assertGainDb(gain / 2, "lowshelf", self.frequency, gain=gain)
+            self.assertGainDb(gain, "highshelf", self.sr / 2, gain=gain)
+            self.assertGainDb(0.0, "highshelf", 0, gain=gain)
+            self.assertGainDb(gain / 2, "highshelf", self.frequency, gain=gain)
+
+    def test_unknown_effect(self):
+        with self.assertRaises(ValueError):
+            dsp.biquad_coefficients("reverb", self.sr, self.frequency)
+
+    def test_sections_apply_the_chain(self):
+        data = _test_signal(self.sr)
+        effects = [("highpass", {"frequency": 300}), ("equalizer", {"frequency": 1000, "q": 1.0, "db": -6.0})]
+        expected = data.astype(np.float64)
+        for effect, parameters in effects:
+            expected = lfilter(*dsp.biquad_coefficients(effect, self.sr, **parameters), expected)
+            np.testing.assert_allclose(dsp.apply_effect(data, self.sr, effect, **parameters),
+                                       lfilter(*dsp.biquad_coefficients(effect, self.sr, **parameters), data),
+                                       rtol=0, atol=1e-6)
+        chained = dsp.apply_sections(data, dsp.biquad_sections(effects, self.sr))
+        self.assertEqual(chained.dtype, data.dtype)
+        np.testing.assert_allclose(chained, expected, rtol=0, atol=1e-5)
+
+
+
+class EffectRecipeTest(unittest.TestCase):
+    """ How steps are turned into sox commands and compiled recipes, which needs no sox either. """
+    sr = 16000
+
+    def step(self, stepValue, parameters):
+        audio = Audio(data=Audio.AudioImpl(array=_test_signal(self.sr), samplingRate=self.sr, path="sound.wav"))
+        return Audio.AugmentationStep(audio=audio, step=Audio.AugmentationStep.Steps(stepValue),
+                                      parameters=parameters)()
+
+    def test_sox_commands(self):
+        for stepValue, options in STEP_OPTIONS.items():
+            with self.subTest(step=stepValue):
+                chain = Audio.Effect.appendStep(AudioEffectsChain(), Audio.AugmentationStep.Steps(stepValue), **options)
+                # pysndfx runs the shelves as the bass and treble effects of sox
+                self.assertEqual(chain.command[0], {"LowShelf": "bass", "HighShelf": "treble"}.get(
+                    stepValue, Audio.Effect.nativeSteps[stepValue][0]))
+        reverb = self.step("Reverb", {})[2]
+        chain = Audio.Effect.appendStep(AudioEffectsChain(), Audio.AugmentationStep.Steps.Reverb, **reverb)
+        self.assertEqual(chain.command, AudioEffectsChain().reverb().command)
+
+    def test_other_steps_are_not_effects(self):
+        for step in (Audio.AugmentationStep.Steps.Mix, Audio.AugmentationStep.Steps.Nothing):
+            with self.assertRaises(ValueError):
+                Audio.Effect.appendStep(AudioEffectsChain(), step)
+
+    def test_pipe_recipe_skips_mixes(self):
+        effects = [self.step("HighPass", STEP_OPTIONS["HighPass"]), self.step("Equalizer", STEP_OPTIONS["Equalizer"])]
+        pipeRecipe = [self.step("Raw", {}), effects[0], self.step("Mix", {}), effects[1], self.step("Mix", {})]
+        recipe = Audio.EffectRecipe.compile(pipeRecipe, backend="native")
+        self.assertEqual(recipe.steps, effects)
+        data = _test_signal(self.sr)
+        np.testing.assert_array_equal(recipe(data, self.sr),
+                                      Audio.EffectRecipe.compile(effects, backend="native")(data, self.sr))
+        # with sox the effects become a single chain
+        recipe = Audio.EffectRecipe.compile(pipeRecipe + [self.step("Reverb", {})], backend="sox")
+        self.assertEqual(len(recipe.stages), 1)
+        self.assertEqual(recipe.stages[0][1].command[0], "highpass")
+        self.assertEqual(recipe.stages[0][1].command[-7], "reverb")
+
+
+if __name__ == "__main__":
+    unittest.main()
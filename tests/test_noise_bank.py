@@ -0,0 +1,60 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from Augmenter.Augmenter import Audio
+from Augmenter.noise_bank import NoiseBank
+from benchmarks.corpus import generate_corpus
+
+
+class NoiseBankBuildTest(unittest.TestCase):
+    sr = 16000
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        generate_corpus(self.directory.name, speakers=1, files_per_speaker=1, min_duration=0.5, max_duration=0.5,
+                        sampling_rates=(self.sr,), noise_files=3, noise_duration=1.0, seed=0)
+        self.noisePath = os.path.join(self.directory.name, "noise")
+        self.bankDir = os.path.join(self.directory.name, "bank")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertNoTemporaryFiles(self):
+        self.assertFalse([name for name in os.listdir(self.bankDir) if name.endswith(".tmp")])
+
+    def test_concurrent_builds(self):
+        expected = np.array(NoiseBank.build(self.noisePath, os.path.join(self.directory.name, "single"), self.sr).array)
+        errors = []
+
+        def build():
+            try:
+                NoiseBank.build(self.noisePath, self.bankDir, self.sr)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=build) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertNoTemporaryFiles()
+        self.assertTrue(NoiseBank.isUpToDate(self.noisePath, self.bankDir, self.sr))
+        np.testing.assert_array_equal(NoiseBank.open(self.bankDir, self.sr).array, expected)
+
+    def test_failed_build_keeps_the_previous_bank(self):
+        expected = np.array(NoiseBank.build(self.noisePath, self.bankDir, self.sr).array)
+        with mock.patch.object(Audio.AudioImpl, "decode", side_effect=IOError("unreadable")):
+            with self.assertRaises(IOError):
+                NoiseBank.build(self.noisePath, self.bankDir, self.sr)
+        self.assertNoTemporaryFiles()
+        np.testing.assert_array_equal(NoiseBank.open(self.bankDir, self.sr).array, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
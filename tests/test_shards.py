@@ -0,0 +1,125 @@
+import contextlib
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+import numpy as np
+import soundfile
+from json_tricks import loads
+
+import AddNoise
+from Augmenter.shards import ShardReader, ShardWriter
+from benchmarks.corpus import generate_corpus
+
+
+class ShardRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        rng = np.random.RandomState(0)
+        self.sounds = {"speaker{0}/sound{1}".format(index % 2, index): (0.5 * rng.uniform(-1, 1, 4000 + 1000 * index))
+                       .astype(np.float32) for index in range(5)}
+        self.recipe = [{"Name": "Raw", "Parameters": {}}, {"Name": "Mix", "Parameters": {"other": "noise.wav"}}]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_audio_and_recipes(self):
+        with ShardWriter(self.directory.name) as writer:
+            for key, data in self.sounds.items():
+                writer.addAudio(key, data, 16000, recipe=self.recipe)
+            writer.addAudio("bare", self.sounds["speaker0/sound0"], 8000)
+        with ShardReader(self.directory.name) as reader:
+            self.assertEqual(len(reader), len(self.sounds) + 1)
+            self.assertEqual(sorted(reader.keys()), sorted(list(self.sounds) + ["bare"]))
+            for key, data in self.sounds.items():
+                self.assertIn(key, reader)
+                samples, sr = reader.readAudio(key)
+                self.assertEqual(sr, 16000)
+                np.testing.assert_array_equal(samples, data)
+                self.assertEqual(reader.readRecipe(key), self.recipe)
+            self.assertEqual(reader.readAudio("bare")[1], 8000)
+            with self.assertRaises(KeyError):
+                reader.readRecipe("bare")
+
+    def test_files(self):
+        path = os.path.join(self.directory.name, "sound.wav")
+        soundfile.write(path, self.sounds["speaker0/sound0"], 16000, subtype="FLOAT")
+        with open(path, "rb") as fp:
+            content = fp.read()
+        shardDir = os.path.join(self.directory.name, "shards")
+        with ShardWriter(shardDir) as writer:
+            writer.addFile(writer.keyOf(os.path.join(shardDir, "speaker0", "sound0.wav")), path, recipe=self.recipe)
+        with ShardReader(shardDir) as reader:
+            self.assertEqual(reader.keys(), ["speaker0/sound0"])
+            self.assertEqual(reader.read("speaker0/sound0"), content)
+            self.assertEqual(reader.readRecipe("speaker0/sound0"), self.recipe)
+
+    def test_roll_over(self):
+        # every shard is closed once a single sound is in it
+        with ShardWriter(self.directory.name, prefix="small", maxShardSize=8000) as writer:
+            for key, data in self.sounds.items():
+                writer.addAudio(key, data, 16000, recipe=self.recipe)
+        shards = sorted(name for name in os.listdir(self.directory.name) if name.endswith(".tar"))
+        self.assertEqual(shards, ["small-{0:06d}.tar".format(index) for index in range(len(self.sounds))])
+        # the shards are plain tar files
+        with tarfile.open(os.path.join(self.directory.name, shards[0])) as tar:
+            self.assertEqual(tar.getnames(), ["speaker0/sound0.wav", "speaker0/sound0.json"])
+        with ShardReader(self.directory.name) as reader:
+            for key, data in self.sounds.items():
+                np.testing.assert_array_equal(reader.readAudio(key)[0], data)
+
+    def test_writers_sharing_a_directory(self):
+        first, second = ShardWriter(self.directory.name), ShardWriter(self.directory.name)
+        for index, (key, data) in enumerate(self.sounds.items()):
+            (first if index % 2 else second).addAudio(key, data, 16000)
+        second.close()
+        # the records of a writer which is not closed yet are readable too
+        with ShardReader(self.directory.name) as reader:
+            self.assertEqual(sorted(reader.keys()), sorted(self.sounds))
+            for key, data in self.sounds.items():
+                np.testing.assert_array_equal(reader.readAudio(key)[0], data)
+        first.close()
+
+
+class NoiseInjectionShardsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        generate_corpus(self.directory.name, speakers=2, files_per_speaker=3, min_duration=0.5, max_duration=1.5,
+                        sampling_rates=(16000,), noise_files=2, noise_duration=2.0, seed=0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_shards_hold_the_files_of_a_run(self):
+        soundPath = os.path.join(self.directory.name, "sounds")
+        noisePath = os.path.join(self.directory.name, "noise")
+        filesDir = os.path.join(self.directory.name, "files")
+        shardsDir = os.path.join(self.directory.name, "shards")
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            AddNoise.advanced_noise_injection(soundPath, noisePath, filesDir, percentage=30, seed=5)
+            AddNoise.advanced_noise_injection(soundPath, noisePath, shardsDir, percentage=30, seed=5,
+                                              output_shard_size=64 * 1024)
+        sounds = {}
+        for root, _, files in os.walk(filesDir):
+            for name in files:
+                if name.endswith(".wav"):
+                    path = os.path.join(root, name)
+                    sounds[os.path.splitext(os.path.relpath(path, filesDir))[0].replace(os.sep, "/")] = path
+        self.assertEqual(len(sounds), 6)
+        with ShardReader(shardsDir) as reader:
+            self.assertEqual(sorted(reader.keys()), sorted(sounds))
+            for key, path in sounds.items():
+                samples, sr = reader.readAudio(key)
+                expected, expectedSr = soundfile.read(path, dtype="float32")
+                self.assertEqual(sr, expectedSr)
+                np.testing.assert_array_equal(samples, expected)
+                with open(os.path.splitext(path)[0] + ".json") as fp:
+                    self.assertEqual(reader.readRecipe(key), loads(fp.read())["Steps"])
+
+
+if __name__ == "__main__":
+    unittest.main()
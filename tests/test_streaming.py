@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import soundfile
+
+from Augmenter.Augmenter import Audio
+from Augmenter.streaming import stream_mix
+
+
+class StreamMixTest(unittest.TestCase):
+    sr = 16000
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        rng = np.random.RandomState(0)
+        self.soundPath = os.path.join(self.directory.name, "sound.wav")
+        soundfile.write(self.soundPath, (0.4 * rng.uniform(-1, 1, 3 * self.sr)).astype(np.float32), self.sr,
+                        subtype="FLOAT")
+        self.noisePath = os.path.join(self.directory.name, "noise.wav")
+        self.noise = Audio(data=Audio.AudioImpl(array=(0.2 * rng.standard_normal(2 * self.sr)).astype(np.float32),
+                                                samplingRate=self.sr, path=self.noisePath))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertStreamedEqualsInMemory(self, windows):
+        sound = Audio(data=Audio.AudioImpl(path=self.soundPath))
+        for startAt, noiseStartAt, duration in windows:
+            sound = sound.mix(other=self.noise, segmentsAsSeconds=[
+                sound.getSegment(begin=startAt, end=startAt + duration),
+                self.noise.getSegment(begin=noiseStartAt, end=noiseStartAt + duration)])
+        inMemoryDir = os.path.join(self.directory.name, "memory")
+        streamedDir = os.path.join(self.directory.name, "streamed")
+        os.makedirs(inMemoryDir)
+        os.makedirs(streamedDir)
+        inMemory, _ = soundfile.read(sound.write(inMemoryDir))
+        # a small block size, so the windows span several blocks
+        streamed, _ = soundfile.read(stream_mix(self.soundPath, self.noise.impl.getData(),
+                                                Audio.operandCache.peak(self.noise), self.sr, windows, streamedDir,
+                                                noise_name=self.noisePath, block_size=1000))
+        self.assertEqual(inMemory.shape, streamed.shape)
+        np.testing.assert_allclose(streamed, inMemory, rtol=0, atol=1e-6)
+        self.assertEqual(sorted(os.listdir(inMemoryDir)), sorted(os.listdir(streamedDir)))
+
+    def test_single_window(self):
+        self.assertStreamedEqualsInMemory([(0.5, 0.25, 1.0)])
+
+    def test_noise_wrapping_around(self):
+        # the noise runs out after 0.25 seconds and the rest of the window starts from its beginning
+        self.assertStreamedEqualsInMemory([(0.5, 1.75, 0.25), (0.75, 0.0, 1.5)])
+
+    def test_output_is_not_normalized(self):
+        sound = Audio(data=Audio.AudioImpl(path=self.soundPath))
+        streamed, _ = soundfile.read(stream_mix(self.soundPath, self.noise.impl.getData(),
+                                                Audio.operandCache.peak(self.noise), self.sr, [(0.5, 0.0, 1.0)],
+                                                self.directory.name))
+        # outside of the window the sound is only normalized and halved, like in Audio.mix
+        np.testing.assert_allclose(streamed[:self.sr // 4],
+                                   sound.impl.getData()[:self.sr // 4] / np.max(sound.impl.getData()) * 0.5,
+                                   rtol=0, atol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+import numpy as np
+from scipy.signal import butter, sosfilt
+
+from Augmenter import tool_kit
+
+
+class SnrMixTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.sound = (0.3 * rng.standard_normal(1000)).astype(np.float32)
+        self.noise = (0.1 * rng.standard_normal(700)).astype(np.float32)
+
+    def test_window_energy_of_looped_windows(self):
+        index = tool_kit.energy_index(self.noise)
+        for begin, length in ((0, 700), (650, 100), (123, 2500), (1400, 1)):
+            window = tool_kit.looped_window(self.noise, begin, length).astype(np.float64)
+            self.assertAlmostEqual(tool_kit.window_energy(index, begin, length), np.sum(window ** 2), places=6)
+
+    def test_target_ratio(self):
+        for snr_db in (-5.0, 0.0, 10.0):
+            mixed = tool_kit.mix_snr_librosa(self.sound, self.noise, snr_db=snr_db, sound2_begin=300)
+            noise = mixed.astype(np.float64) - self.sound
+            self.assertAlmostEqual(10 * np.log10(np.sum(self.sound.astype(np.float64) ** 2) / np.sum(noise ** 2)),
+                                   snr_db, places=4)
+
+    def test_silent_noise_window_leaves_the_sound_unchanged(self):
+        padded = np.concatenate([self.noise, np.zeros(2000, dtype=np.float32)])
+        mixed = tool_kit.mix_snr_librosa(self.sound, padded, snr_db=5.0, sound2_begin=len(self.noise))
+        np.testing.assert_array_equal(mixed, self.sound)
+        mixed = tool_kit.mix_snr_librosa(self.sound, np.zeros(700, dtype=np.float32), snr_db=5.0)
+        np.testing.assert_array_equal(mixed, self.sound)
+
+    def test_empty_noise_is_rejected(self):
+        with self.assertRaises(ValueError):
+            tool_kit.mix_snr_librosa(self.sound, np.zeros(0, dtype=np.float32))
+        with self.assertRaises(ValueError):
+            tool_kit.window_energy(tool_kit.energy_index(np.zeros(0)), 0, 10)
+
+
+
+class ButterFilterTest(unittest.TestCase):
+    sr = 16000
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.sounds = [(0.3 * rng.standard_normal(length)).astype(np.float32) for length in (1000, 1600, 700)]
+
+    def test_filters_are_the_butterworth_designs(self):
+        sound = self.sounds[0]
+        np.testing.assert_allclose(tool_kit.butter_lowpass_filter(sound, 1000, self.sr),
+                                   sosfilt(butter(5, 1000 / (self.sr / 2), btype="lowpass", output="sos"), sound),
+                                   rtol=0, atol=1e-6)
+        np.testing.assert_allclose(tool_kit.butter_bandpass_filter(sound, self.sr, 1024, 7000),
+                                   sosfilt(butter(5, [1024 / (self.sr / 2), 7000 / (self.sr / 2)], btype="bandpass",
+                                                  output="sos"), sound),
+                                   rtol=0, atol=1e-6)
+
+    def test_batches_match_single_sounds(self):
+        batch, lengths = tool_kit.pad_batch(self.sounds)
+        lowpassed = tool_kit.butter_lowpass_filter_batch(batch, lengths, 1000, self.sr)
+        bandpassed = tool_kit.butter_bandpass_filter_batch(batch, lengths, self.sr, 1024, 7000)
+        for row, sound in enumerate(self.sounds):
+            np.testing.assert_allclose(lowpassed[row, :len(sound)],
+                                       tool_kit.butter_lowpass_filter(sound, 1000, self.sr), rtol=0, atol=1e-6)
+            np.testing.assert_allclose(bandpassed[row, :len(sound)],
+                                       tool_kit.butter_bandpass_filter(sound, self.sr, 1024, 7000), rtol=0, atol=1e-6)
+            self.assertFalse(np.any(lowpassed[row, len(sound):]))
+
+
+if __name__ == "__main__":
+    unittest.main()